@@ -5,12 +5,10 @@ Revises: 921f9c6e9456
 Create Date: 2020-05-09 10:31:55.513006
 
 """
-from tqdm.auto import tqdm
 from alembic import op
 import sqlalchemy as sa
-from sqlalchemy import orm
 
-from cdcrapp.model import NewsArticle, SciPaper
+from cdcrapp.backfill import backfill
 
 # revision identifiers, used by Alembic.
 revision = '7ddae5807eae'
@@ -20,6 +18,23 @@ depends_on = None
 
 
 def upgrade():
+    conn = op.get_bind()
+
+    # an interrupted upgrade has already committed the documents, carry on with the backfill
+    if 'newsarticles' not in sa.inspect(conn).get_table_names():
+        create_documents(conn)
+
+    # commit each chunk so that running the upgrade again resumes from the last one
+    with op.get_context().autocommit_block():
+        # join each chunk of tasks to its documents in one statement rather than one UPDATE per document
+        backfill(conn, "tasks", "sci_paper_id = scipapers.id", from_clause="scipapers",
+            where="scipapers.url = tasks.sci_url", name="7ddae5807eae_sci_paper_id")
+
+        backfill(conn, "tasks", "news_article_id = newsarticles.id", from_clause="newsarticles",
+            where="newsarticles.url = tasks.news_url", name="7ddae5807eae_news_article_id")
+
+
+def create_documents(conn):
     # ### commands auto generated by Alembic - please adjust! ###
     op.create_table('newsarticles',
     sa.Column('id', sa.Integer(), nullable=False),
@@ -39,32 +54,22 @@ def upgrade():
     op.create_foreign_key(None, 'tasks', 'newsarticles', ['news_article_id'], ['id'])
     # ### end Alembic commands ###
 
-    conn = op.get_bind()
-    session = orm.Session(bind=conn)
-
-    for url, text in conn.execute("SELECT news_url, news_text from tasks GROUP BY news_url, news_text"):
-        na = NewsArticle(url=url, summary=text)
-        session.add(na)
-
-    for url, text in conn.execute("SELECT sci_url, sci_text from tasks GROUP BY sci_url, sci_text"):
-        sp = SciPaper(url=url, abstract=text)
-        session.add(sp)
-
-    session.commit()
-
-    from sqlalchemy.sql import text
+    # use plain SQL rather than the ORM models because later revisions add columns to them
+    conn.execute("INSERT INTO newsarticles (url, summary) SELECT news_url, news_text from tasks GROUP BY news_url, news_text")
+    conn.execute("INSERT INTO scipapers (url, abstract) SELECT sci_url, sci_text from tasks GROUP BY sci_url, sci_text")
 
-    papercount = session.query(SciPaper).count()
-    articlecount = session.query(NewsArticle).count()
 
-    for sp in tqdm(session.query(SciPaper).all(), total=papercount):
-        conn.execute(text("UPDATE tasks SET sci_paper_id=:id WHERE sci_url=:url"), id=sp.id, url=sp.url)
+def downgrade():
+    conn = op.get_bind()
 
-    for na in tqdm(session.query(NewsArticle).all(), total=articlecount):
-        conn.execute(text("UPDATE tasks SET news_article_id=:id WHERE news_url=:url"), id=na.id, url=na.url)
+    # copy the documents back onto the tasks before the link columns are dropped
+    with op.get_context().autocommit_block():
+        backfill(conn, "tasks", "sci_url = scipapers.url, sci_text = scipapers.abstract", from_clause="scipapers",
+            where="scipapers.id = tasks.sci_paper_id", name="7ddae5807eae_downgrade_sci")
 
+        backfill(conn, "tasks", "news_url = newsarticles.url, news_text = newsarticles.summary", from_clause="newsarticles",
+            where="newsarticles.id = tasks.news_article_id", name="7ddae5807eae_downgrade_news")
 
-def downgrade():
     # ### commands auto generated by Alembic - please adjust! ###
     op.drop_constraint(None, 'tasks', type_='foreignkey')
     op.drop_constraint(None, 'tasks', type_='foreignkey')
@@ -73,18 +78,3 @@ def downgrade():
     op.drop_table('scipapers')
     op.drop_table('newsarticles')
     # ### end Alembic commands ###
-
-    conn = op.get_bind()
-    session = orm.Session(bind=conn)
-
-
-    from sqlalchemy.sql import text
-
-    papercount = session.query(SciPaper).count()
-    articlecount = session.query(NewsArticle).count()
-
-    for sp in tqdm(session.query(SciPaper).all(), total=papercount):
-        conn.execute(text("UPDATE tasks SET sci_url=:url, sci_text=:text WHERE sci_paper_id=:id"), id=sp.id, url=sp.url, text=sp.abstract)
-
-    for na in tqdm(session.query(NewsArticle).all(), total=articlecount):
-        conn.execute(text("UPDATE tasks SET news_url=:url, news_text=:text WHERE news_article_id=:id"), id=na.id, url=na.url, text=na.summary)
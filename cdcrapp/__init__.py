@@ -1,30 +1,54 @@
 import click
 import dotenv
-import tqdm
 import os
-import random
 import json
 import hashlib
 import datetime
-import pandas as pd
-from typing import List, Optional
+from typing import List, Optional, TYPE_CHECKING
 
-from tqdm.auto import tqdm
-
-from sqlalchemy import create_engine
-from sqlalchemy.engine import Engine
-from cdcrapp.services import UserService, TaskService
-from cdcrapp.model import Task, UserTask, User, NewsArticle, SciPaper
+# heavy dependencies (pandas, sqlalchemy, the service layer) are imported by the
+# commands that need them so that `python -m cdcrapp` starts quickly
+if TYPE_CHECKING:
+    from sqlalchemy.engine import Engine
+    from cdcrapp.services import UserService, TaskService
+    from cdcrapp.model import User
     
 dotenv.load_dotenv()
 
+from cdcrapp.settings import DOC_COVERAGE_SUMMARY
+
 
 class CLIContext(object):
+    """Database engine and services for commands, created the first time a command uses them"""
     
     def __init__(self):
-        self.engine : Engine = create_engine(os.getenv("SQLALCHEMY_DB_URI"))
-        self.usersvc : UserService = UserService(self.engine)
-        self.tasksvc : TaskService = TaskService(self.engine)
+        self._engine = None
+        self._usersvc = None
+        self._tasksvc = None
+
+    @property
+    def engine(self) -> "Engine":
+        if self._engine is None:
+            from sqlalchemy import create_engine
+            self._engine = create_engine(os.getenv("SQLALCHEMY_DB_URI"))
+
+        return self._engine
+
+    @property
+    def usersvc(self) -> "UserService":
+        if self._usersvc is None:
+            from cdcrapp.services import UserService
+            self._usersvc = UserService(self.engine)
+
+        return self._usersvc
+
+    @property
+    def tasksvc(self) -> "TaskService":
+        if self._tasksvc is None:
+            from cdcrapp.services import TaskService
+            self._tasksvc = TaskService(self.engine)
+
+        return self._tasksvc
 
 
 @click.group()
@@ -89,9 +113,12 @@ def change_password(ctx: CLIContext, username: str, password: str):
 @cli.command()
 @click.argument("user_profile", type=click.Path(exists=True))
 @click.option("--username", type=str, prompt='User to import data into')
+@click.option("--chunk-size", type=int, default=1000, help="Number of lines to resolve and write at a time")
+@click.option("--dry-run", is_flag=True, default=False, help="Report what would be imported without changing anything")
 @click.pass_obj
-def import_user(ctx: CLIContext, user_profile: str, username: str):
+def import_user(ctx: CLIContext, user_profile: str, username: str, chunk_size: int, dry_run: bool):
     """Import an existing user profile from legacy CDCR tool and associate with given username"""
+    from tqdm.auto import tqdm
     
     # check that the user is valid
     user = ctx.usersvc.get_by_username(username)
@@ -106,48 +133,32 @@ def import_user(ctx: CLIContext, user_profile: str, username: str):
     with open(user_profile, "r") as f:
         total = sum([1 for line in f])
         f.seek(0)
-        
-        for line in tqdm(f, total=total):
-            
-            work = json.loads(line)
-            
-            task = ctx.tasksvc.get_by_hash(hash=work['hash'])
-            
-            if not task:
-                tqdm.write(f"Could not find task with hash={work['hash']}")
-                continue
-            
-            if work['label'] == "invalid":
-                print(f"Mark task with hash={work['hash']} as bad")
-                task.is_bad = True
-                ctx.tasksvc.update(task)
-            
-            else:
-                
-                ctx.usersvc.user_add_task(user,task, work['label'] )
-                
-                if work.get('iaa', False):
-                    print(f"Mark IAA task where hash={work['hash']}")
-                    task.is_iaa = True
-                    ctx.tasksvc.update(task)
+
+        work = (json.loads(line) for line in tqdm(f, total=total) if line.strip() != "")
+
+        stats, news_article_ids = ctx.usersvc.import_answers(user, work, chunk_size=chunk_size, dry_run=dry_run)
+
+    prefix = "Would import" if dry_run else "Imported"
+
+    print(f"{prefix} {stats['answers']} answers from {stats['lines']} lines")
+    print(f"{stats['already_answered']} tasks already answered, {stats['missing']} hashes not found")
+    print(f"{stats['bad']} tasks marked bad, {stats['iaa']} tasks marked IAA")
+
+    if DOC_COVERAGE_SUMMARY and not dry_run and len(news_article_ids) > 0:
+        ctx.tasksvc.refresh_doc_coverage(news_article_ids)
 
 @cli.command()
 @click.option("--new-count", type=int, default=150)
+@click.option("--seed", type=int, default=None, help="Seed for the random sample, reuse it to pick the same tasks again")
+@click.option("--buckets", type=int, default=None, help="Spread the sample evenly across this many similarity buckets")
 @click.pass_obj
-def rebalance_iaa(ctx: CLIContext, new_count: int):
+def rebalance_iaa(ctx: CLIContext, new_count: int, seed: Optional[int], buckets: Optional[int]):
     """Rebalance IAA tasks so that new users are not overwhelmed"""
-    from cdcrapp.services import TaskService
-    from cdcrapp.model import Task
-
-    # get tasks that are IAA
 
-    iaa_tasks = ctx.tasksvc.list(Task, filters={"is_iaa":True})
-    iaa_priority = ctx.tasksvc.list(Task, filters={"is_iaa_priority":True})
+    stats = ctx.tasksvc.rebalance_iaa(new_count, seed=seed, buckets=buckets)
 
-    print(f"Found {len(iaa_tasks)} tasks marked is_iaa and {len(iaa_priority)} tasks marked is_iaa_priority")
-    print("Rebalance priority tasks to max of 150")
-
-    ctx.tasksvc.rebalance_iaa(new_count)
+    print(f"Found {stats['iaa']} tasks marked is_iaa and {stats['previous_priority']} tasks marked is_iaa_priority")
+    print(f"Rebalanced priority tasks to {stats['priority']} (max {new_count}, seed={stats['seed']})")
 
     
 
@@ -170,12 +181,13 @@ def export_conll(ctx: CLIContext, json_file: str, output_file:str, remove_single
 @click.option("--dev-split", type=float, default=0.2)
 @click.option("--exclude-user", type=int, multiple=True )
 @click.option("--min-coverage", type=float, default=None)
+@click.option("--use-summary/--no-use-summary", default=False, help="Read coverage from the news_coverage summary table")
 @click.pass_obj
-def export_json(ctx: CLIContext, json_dir:str, seed:int, train_split:float, dev_split:float, exclude_user: List[int], min_coverage: Optional[float]):
+def export_json(ctx: CLIContext, json_dir:str, seed:int, train_split:float, dev_split:float, exclude_user: List[int], min_coverage: Optional[float], use_summary: bool):
     """Export json to conll format"""
     
 
-    t = ctx.tasksvc.get_annotated_tasks(exclude_users=exclude_user, min_coverage=min_coverage)
+    t = ctx.tasksvc.get_annotated_tasks(exclude_users=exclude_user, min_coverage=min_coverage, use_summary=use_summary)
     
     from cdcrapp.export import export_to_json
 
@@ -198,15 +210,16 @@ def compare(ctx: CLIContext, pkl_file:str):
 
 
 @cli.command()
+@click.option("--use-summary/--no-use-summary", default=False, help="Read coverage from the news_coverage summary table")
 @click.pass_obj
-def get_doc_coverage(ctx: CLIContext):
+def get_doc_coverage(ctx: CLIContext, use_summary: bool):
     """Get coverage of news documents"""
 
     from collections import Counter
 
     c = Counter()
 
-    for row in ctx.tasksvc.get_task_doc_coverage():
+    for row in ctx.tasksvc.get_task_doc_coverage(use_summary=use_summary):
         c[row['complete_percent']] += 1
 
     print("Percent Complete, Count")
@@ -214,11 +227,56 @@ def get_doc_coverage(ctx: CLIContext):
         print(f"{percent}%",count)
 
 
+@cli.command()
+@click.pass_obj
+def refresh_doc_coverage(ctx: CLIContext):
+    """Rebuild the news_coverage summary table from scratch"""
+
+    ctx.tasksvc.refresh_doc_coverage()
+
+    print(f"Refreshed coverage for {len(list(ctx.tasksvc.get_task_doc_coverage(use_summary=True)))} news articles")
+
+
+@cli.command()
+@click.option("--interval", type=int, default=lambda: int(os.getenv("STATS_REFRESH_INTERVAL", 0)), 
+    help="Keep refreshing every INTERVAL seconds (default STATS_REFRESH_INTERVAL), 0 refreshes once")
+@click.option("--use-summary", is_flag=True, default=DOC_COVERAGE_SUMMARY,
+    help="Read document coverage from the news_coverage summary table")
+@click.pass_obj
+def refresh_stats(ctx: CLIContext, interval: int, use_summary: bool):
+    """Recalculate the statistics snapshot shown on the admin dashboards"""
+    import time
+    from cdcrapp.services import StatisticsService
+
+    statsvc = StatisticsService(ctx.engine)
+
+    while True:
+        start = time.time()
+        updated_at = statsvc.refresh_snapshot(use_summary=use_summary)
+        print(f"Refreshed statistics snapshot at {updated_at:%Y-%m-%d %H:%M:%S} in {time.time() - start:.1f}s")
+
+        if interval <= 0:
+            break
+
+        time.sleep(max(interval - (time.time() - start), 0))
+
+
+@cli.command()
+@click.pass_obj
+def link_mentions(ctx: CLIContext):
+    """Link tasks still using their own mention columns to the shared mentions table"""
+
+    linked = ctx.tasksvc.link_mentions()
+
+    print(f"Linked {linked} tasks to shared mentions")
+
+
 @cli.command()
 @click.argument("pkl_file", type=click.Path(exists=True))
 @click.pass_obj
 def import_model_results(ctx: CLIContext, pkl_file:str):
     from cdcrapp.compare import compare
+    from cdcrapp.model import Task, NewsArticle, SciPaper
     
     t = ctx.tasksvc.get_annotated_tasks()
     candidates = compare(pkl_file, t)
@@ -253,10 +311,8 @@ def import_model_results(ctx: CLIContext, pkl_file:str):
             if existing_task is None:
 
                 existing_task = session.query(Task).filter(
-                    Task.sci_paper_id==sci_id, 
-                    Task.news_article_id==news_id, 
-                    Task.news_ent==news_ent, 
-                    Task.sci_ent==sci_ent).one_or_none()
+                    Task.mention_filter("news", news_id, news_ent), 
+                    Task.mention_filter("sci", sci_id, sci_ent)).one_or_none()
 
             if existing_task:
                 existing_task.priorty=5
@@ -349,6 +405,7 @@ def count_clusters(json_dir):
 @click.pass_obj
 def prioritise_docs(ctx: CLIContext,corpus_dir: str, priority=5):
     """Re-prioritise tasks in documents associated with the given json corpus"""
+    from cdcrapp.model import Task
 
     for fn in ['dev.json','train.json','test.json']:
 
@@ -404,53 +461,66 @@ def import_difficult_tasks(ctx: CLIContext, sheet_id: str, sheet_range:str):
     """Get difficult tasks from google sheets and update in db"""
 
     from cdcrapp.gsheets import Spreadsheet
+    from cdcrapp.services import SheetMirrorService
 
     sheet = Spreadsheet(sheet_id)
     sheet.connect()
 
-    with ctx.tasksvc.session() as session:
-        for hash,username,_ in sheet.get_range(sheet_range)['values']:
-            user = session.query(User).filter(User.username==username.strip().lower()).one_or_none()
+    mirror = SheetMirrorService(ctx.engine, sheet)
+    mirror.sync(sheet_range)
 
-            if user is None:
-                print(f"Could not find user {username.strip().lower()} skipping task...")
-                continue
-            
-            task = session.query(Task).filter(Task.hash==hash).one_or_none()
+    stats = mirror.import_difficult(sheet_range)
 
-            if task is None:
-                print(f"Could not find task with hash {hash}. Skipping task...")
-                continue
+    for username in stats['missing_users']:
+        print(f"Could not find user {username} skipping tasks...")
 
-            task.is_difficult = True
-            task.is_difficult_user = user
-            task.is_difficult_reported_at = datetime.datetime.utcnow()
+    for task_hash in stats['missing_tasks']:
+        print(f"Could not find task with hash {task_hash}. Skipping task...")
 
-        session.commit()
+    print(f"Marked {stats['updated']} tasks as difficult")
 
 
+@cli.command()
+@click.argument("sheet_id", type=str)
+@click.argument("sheet_ranges", type=str, nargs=-1, required=True)
+@click.pass_obj
+def sync_sheets(ctx: CLIContext, sheet_id: str, sheet_ranges: List[str]):
+    """Send queued rows to google sheets and copy new rows from the given ranges into the local mirror"""
+
+    from cdcrapp.gsheets import Spreadsheet
+    from cdcrapp.services import SheetMirrorService
+
+    sheet = Spreadsheet(sheet_id)
+    sheet.connect()
+
+    mirror = SheetMirrorService(ctx.engine, sheet)
+
+    print(f"Appended {mirror.flush()} queued rows")
+
+    for sheet_range in sheet_ranges:
+        print(f"Read {mirror.sync(sheet_range)} new rows from {sheet_range}")
+
 
 @cli.command()
 @click.argument("task_csv", type=click.Path(exists=True))
 @click.pass_obj
 def import_tasks(ctx: CLIContext, task_csv: str):
     """Import annotation tasks from a CSV"""
+    import pandas as pd
+    from tqdm.auto import tqdm
+
     df = pd.read_csv(task_csv)
     
-    from cdcrapp.services import TaskService
     from cdcrapp.model import Task
     
     
     print(f"Found {len(df)} tasks in f{task_csv}...")
     print(f"Adding tasks to database")
     
-    engine = create_engine(os.getenv("SQLALCHEMY_DB_URI"))
-    taskmgr = TaskService(engine)
+    taskmgr = ctx.tasksvc
     
     # filter existing tasks
-    tasks: List[Task] = taskmgr.list(Task)
-    
-    existing = set([t.hash for t in tasks])
+    existing = set([hash for hash, in taskmgr.iter(Task, columns=[Task.hash])])
     
     not_ingested = df[~df.hash.isin(existing)]
     
@@ -469,62 +539,270 @@ def import_tasks(ctx: CLIContext, task_csv: str):
         tasks.append(task)
         
         if i % 1000 == 0:
-            taskmgr.add_tasks(tasks)
+            news_article_ids = taskmgr.add_tasks(tasks)
             tasks = []
+
+            if DOC_COVERAGE_SUMMARY and len(news_article_ids) > 0:
+                taskmgr.refresh_doc_coverage(news_article_ids)
     
     print("Import complete")
 
 @cli.command()
+@click.option("--dry-run", is_flag=True, default=False, help="Report what would be removed without changing anything")
 @click.pass_obj        
-def tidy_duplicate_tasks(ctx: CLIContext):
+def tidy_duplicate_tasks(ctx: CLIContext, dry_run: bool):
     """Remove duplicate tasks"""
-    from sqlalchemy import desc
-    from sqlalchemy.sql.functions import count
 
-    with ctx.tasksvc.session() as session:
-        q = session.query(count(Task.hash).label('total'), Task.news_article_id, Task.sci_paper_id, Task.news_ent, Task.sci_ent)\
-              .group_by(Task.news_article_id, Task.sci_paper_id, Task.news_ent, Task.sci_ent).order_by(desc('total'))
+    stats = ctx.tasksvc.tidy_duplicate_tasks(dry_run=dry_run, refresh_coverage=DOC_COVERAGE_SUMMARY)
 
-        for total, news_id, sci_id, news_ent, sci_ent in q.all():
-            
-            # We're sorted in descending order by total and we only
-            # care about dupes so break when we get to 1
-            if total < 2:
-                break
-
-            # we should end up with the most important task at the top (e.g. IAA tasks or recently created ones)
-            tasks = session.query(Task)\
-                .filter(Task.news_article_id==news_id, Task.sci_paper_id==sci_id, Task.sci_ent==sci_ent, Task.news_ent==news_ent)\
-                    .order_by(Task.is_iaa.desc(), Task.created_at.desc()).all()
-
-            deleted_one = False
-            for task in tasks:
-                if len(task.usertasks) < 1:
-                    print(f"Remove duplicate task {task.id}")
-                    session.delete(task)
-                    deleted_one = True
-                    break
-            
-            if not deleted_one:
-                print(f"Was unable to delete a task for {news_id},{sci_id},{news_ent},{sci_ent}")
-                print(f"Move all links from {tasks[-1].id} -> {tasks[0].id}")
-
-                existing_uts = set()
-                for ut in tasks[0].usertasks:
-                    existing_uts.add((ut.user_id,ut.task_id))
-
-                for ut in tasks[-1].usertasks:
-                    if (ut.user_id, tasks[0].id) in existing_uts:
-                        print(f"Remove duplicate UT {ut.user_id},{ut.task_id}")
-                        session.delete(ut)
-                    else:
-                        print(f"Move UT from task {ut.task_id} to {tasks[0].id}")
-                        ut.task_id = tasks[0].id
-                        existing_uts.add((ut.user_id, tasks[0].id))
+    prefix = "Would remove" if dry_run else "Removed"
 
-            
+    print(f"{prefix} {stats['removed_tasks']} duplicate tasks from {stats['groups']} groups")
+    print(f"{stats['moved_answers']} answers moved to the surviving task, {stats['dropped_answers']} duplicate answers dropped")
 
-        session.commit()
+@cli.command()
+@click.option("--limit", type=int, default=1000, help="Number of tasks to load with each profile")
+@click.pass_obj
+def measure_load_profiles(ctx: CLIContext, limit: int):
+    """Compare how much data each task load profile pulls from the database"""
+    from sqlalchemy import inspect
+    from cdcrapp.services import TASK_LOAD_PROFILES
+
+    def loaded_bytes(obj, seen):
+        if obj is None or id(obj) in seen:
+            return 0
+        seen.add(id(obj))
+        state = inspect(obj)
+        total = 0
+        for attr in state.attrs:
+            if attr.key in state.unloaded:
+                continue
+            value = attr.loaded_value
+            if isinstance(value, list):
+                total += sum(loaded_bytes(item, seen) for item in value)
+            elif hasattr(value, "_sa_instance_state"):
+                total += loaded_bytes(value, seen)
+            elif value is not None:
+                total += len(str(value).encode("utf8"))
+        return total
+
+    for profile in TASK_LOAD_PROFILES:
+        with ctx.tasksvc.session() as session:
+            start = datetime.datetime.now()
+            tasks = ctx.tasksvc.query_tasks(session, profile).limit(limit).all()
+            elapsed = (datetime.datetime.now() - start).total_seconds()
+            seen = set()
+            total = sum(loaded_bytes(task, seen) for task in tasks)
+
+        print(f"{profile}: {len(tasks)} tasks, {total/1024:.1f} KiB loaded in {elapsed:.3f}s")
+
+@cli.command()
+@click.option("--load", "names", type=str, multiple=True, help="Load this model and report its cost, 'all' loads every model")
+def models_info(names: List[str]):
+    """List the NLP models in the registry with the time and memory it took to load them"""
+    from cdcrapp.models import get_model, model_info, registered_models
+    # imported for its side effect of registering the cpu, int8 and onnx BERT models
+    import cdcrapp.encoders  # noqa: F401
+
+    names = registered_models() if "all" in names else names
+
+    for name in names:
+        try:
+            get_model(name)
+        except Exception as e:
+            # e.g. a missing spacy package or no GPU for the models that need one
+            print(f"{name}: failed to load, {type(e).__name__}: {e}")
+
+    loaded = {info.name: info for info in model_info()}
+
+    for name in registered_models():
+        info = loaded.get(name)
+
+        if info is None:
+            print(f"{name:<30} not loaded")
+        else:
+            memory = f"{info.rss_mb:.0f}MB" if info.rss_mb is not None else "unknown"
+            print(f"{name:<30} loaded in {info.load_seconds:.2f}s, memory {memory}")
+
+@cli.command()
+@click.option("--db-uri", type=str, default="sqlite:///cdcr_benchmark.db", help="Database to fill with synthetic data, its tables are dropped")
+@click.option("--scale", "scales", type=str, multiple=True, default=["small", "medium"],
+    help="small, medium, large or articles,papers,tasks_per_pair,users[,answered_fraction[,answers_per_task]]")
+@click.option("--repeat", type=int, default=5)
+@click.option("--seed", type=int, default=42)
+@click.option("--output", type=click.Path(), default=None, help="JSON results file, defaults to benchmark-api-<commit>.json")
+def benchmark_api(db_uri: str, scales: List[str], repeat: int, seed: int, output: Optional[str]):
+    """Time the task services and API endpoints on synthetic databases of different sizes"""
+    from cdcrapp.benchmarks import current_commit, save_results
+    from cdcrapp.benchmarks.api import run_api_benchmarks
+    from cdcrapp.benchmarks.synthetic import parse_scale
+
+    if db_uri == os.getenv("SQLALCHEMY_DB_URI"):
+        raise click.BadParameter("refusing to replace the contents of SQLALCHEMY_DB_URI, use a separate database", param_hint="--db-uri")
+
+    try:
+        parsed = {scale: parse_scale(scale) for scale in scales}
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint="--scale")
+
+    results = run_api_benchmarks(db_uri, parsed, repeat=repeat, seed=seed)
+
+    if output is None:
+        output = f"benchmark-api-{(current_commit() or 'unknown')[:8]}.json"
+
+    save_results(output, "api", results, dialect=db_uri.split(":")[0], repeat=repeat, seed=seed)
+    print(f"Results written to {output}")
+
+@cli.command()
+@click.option("--db-uri", type=str, default="sqlite:///cdcr_benchmark.db", help="Database to hold the fixture, its tables are dropped")
+@click.option("--fixture", type=str, default="corpus",
+    help="corpus to rebuild tasks from --corpus-dir, or a synthetic scale as for benchmark-api")
+@click.option("--corpus-dir", type=click.Path(exists=True, file_okay=False), default="mentions/31_07_20_5pc")
+@click.option("--exporter", "exporters", type=str, multiple=True, help="Exporters to run, defaults to all of them")
+@click.option("--repeat", type=int, default=1)
+@click.option("--seed", type=int, default=42)
+@click.option("--profile-dir", type=click.Path(file_okay=False), default=None, help="Write a cProfile dump per exporter stage here")
+@click.option("--output", type=click.Path(), default=None, help="JSON results file, defaults to benchmark-export-<commit>.json")
+def benchmark_export(db_uri: str, fixture: str, corpus_dir: str, exporters: List[str], repeat: int, seed: int,
+    profile_dir: Optional[str], output: Optional[str]):
+    """Time each exporter stage by stage with peak memory use"""
+    from cdcrapp.benchmarks import current_commit, save_results
+    from cdcrapp.benchmarks.export import EXPORTERS, run_export_benchmarks
+    from cdcrapp.benchmarks.synthetic import parse_scale
+
+    if db_uri == os.getenv("SQLALCHEMY_DB_URI"):
+        raise click.BadParameter("refusing to replace the contents of SQLALCHEMY_DB_URI, use a separate database", param_hint="--db-uri")
+
+    unknown = set(exporters) - set(EXPORTERS)
+
+    if len(unknown) > 0:
+        raise click.BadParameter(f"unknown exporters {', '.join(unknown)}, expected some of {', '.join(EXPORTERS)}", param_hint="--exporter")
+
+    try:
+        scale = parse_scale(fixture) if fixture != "corpus" else None
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint="--fixture")
+
+    results = run_export_benchmarks(db_uri, fixture, corpus_dir, list(exporters or EXPORTERS), repeat=repeat, seed=seed,
+        profile_dir=profile_dir, scale=scale)
+
+    if output is None:
+        output = f"benchmark-export-{(current_commit() or 'unknown')[:8]}.json"
+
+    save_results(output, "export", results, dialect=db_uri.split(":")[0], repeat=repeat, seed=seed)
+    print(f"Results written to {output}")
+
+@cli.command()
+@click.option("--command", "commands", type=click.Choice(["count-docs", "count-mentions", "count-clusters", "benchmark-compare"]),
+    multiple=True, help="Commands to run, defaults to all of them")
+@click.option("--budget", type=float, default=None, help="Maximum median import time in seconds")
+@click.option("--repeat", type=int, default=5)
+@click.option("--output", type=click.Path(), default=None, help="Also write the results to this JSON file")
+def benchmark_imports(commands: List[str], budget: Optional[float], repeat: int, output: Optional[str]):
+    """Check that lightweight commands start within the import time budget"""
+    import tempfile
+
+    from cdcrapp.benchmarks import save_results
+    from cdcrapp.benchmarks.imports import IMPORT_BUDGET_SECONDS, LIGHT_COMMANDS, measure_command, write_fixture
+
+    budget = budget if budget is not None else IMPORT_BUDGET_SECONDS
+    failures = []
+    benchmarks = {}
+
+    fixture_dir = tempfile.TemporaryDirectory()
+    paths = write_fixture(fixture_dir.name)
+
+    for command in commands or LIGHT_COMMANDS:
+        args = [arg.format(**paths) for arg in LIGHT_COMMANDS[command]]
+        result = measure_command(command, args, repeat=repeat)
+        benchmarks[command] = result["imports"]
+        median = result["imports"]["median"]
+
+        print(f"{command:<20} imports {median * 1000:7.1f}ms  wall {result['wall']['median'] * 1000:7.1f}ms  {result['modules']} modules")
+
+        for heaviest in result["heaviest"][:3]:
+            print(f"    {heaviest['module']:<30} {heaviest['cumulative_ms']:7.1f}ms")
+
+        if median > budget:
+            failures.append(f"{command} spends {median * 1000:.0f}ms importing, over the {budget * 1000:.0f}ms budget")
+
+        if len(result["heavy_modules"]) > 0:
+            failures.append(f"{command} imports {', '.join(result['heavy_modules'])}")
+
+    fixture_dir.cleanup()
+
+    if output is not None:
+        save_results(output, "imports", [{"scale": "cli", "config": {"budget": budget}, "benchmarks": benchmarks}],
+            repeat=repeat)
+
+    if len(failures) > 0:
+        raise click.ClickException("\n".join(failures))
+
+@cli.command()
+@click.option("--backend", "backends", type=str, multiple=True, default=["cpu", "int8", "onnx"], help="Encoder backends to check")
+@click.option("--reference", type=str, default="cpu", help="fp32 backend the others are compared with, cpu or cuda")
+@click.option("--sample", type=int, default=50, help="Number of document pairs to score")
+@click.option("--seed", type=int, default=42)
+@click.option("--threads", type=int, default=None, help="CPU threads for the cpu, int8 and onnx backends")
+@click.option("--threshold", type=float, default=0.3, help="Similarity cut off ingest uses to create tasks")
+@click.option("--max-drift", type=float, default=None, help="Fail if any backend's p95 similarity drift is larger")
+@click.option("--output", type=click.Path(), default=None, help="Also write the results to this JSON file")
+@click.pass_obj
+def validate_encoders(ctx: CLIContext, backends: List[str], reference: str, sample: int, seed: int, threads: Optional[int],
+    threshold: float, max_drift: Optional[float], output: Optional[str]):
+    """Report similarity drift from the fp32 model and throughput for each encoder backend on existing tasks"""
+    from cdcrapp.benchmarks import save_results
+    from cdcrapp.benchmarks.encoders import run_encoder_validation
+    from cdcrapp.encoders import backends as known_backends, set_threads
+
+    unknown = (set(backends) | {reference}) - set(known_backends())
+
+    if len(unknown) > 0:
+        raise click.BadParameter(f"unknown backends {', '.join(unknown)}, expected some of {', '.join(known_backends())}", param_hint="--backend")
+
+    if threads is not None:
+        set_threads(threads)
+
+    results = run_encoder_validation(ctx.tasksvc, list(backends), reference=reference, sample=sample, seed=seed,
+        threshold=threshold)
+
+    if output is not None:
+        save_results(output, "encoders", results, threads=threads)
+
+    drifted = [backend for backend, drift in results[0]["drift"].items() if max_drift is not None and drift["p95"] > max_drift]
+
+    if len(drifted) > 0:
+        raise click.ClickException(f"{', '.join(drifted)} drift more than {max_drift} from {reference}")
+
+@cli.command()
+@click.argument("old_json", type=click.Path(exists=True))
+@click.argument("new_json", type=click.Path(exists=True))
+@click.option("--threshold", type=float, default=1.2, help="Slowdown ratio reported as a regression")
+def benchmark_compare(old_json: str, new_json: str, threshold: float):
+    """Compare median timings between two benchmark result files"""
+    from cdcrapp.benchmarks import compare_results
+
+    with open(old_json) as f:
+        old = json.load(f)
+
+    with open(new_json) as f:
+        new = json.load(f)
+
+    print(f"{(old['commit'] or 'unknown')[:8]} -> {(new['commit'] or 'unknown')[:8]}")
+
+    regressions = 0
+
+    for scale, name, before, after, ratio in compare_results(old, new):
+        flag = ""
+
+        if ratio >= threshold:
+            flag = "  REGRESSION"
+            regressions += 1
+
+        print(f"{scale:<10} {name:<50} {before * 1000:9.2f}ms -> {after * 1000:9.2f}ms  x{ratio:.2f}{flag}")
+
+    if regressions > 0:
+        raise click.ClickException(f"{regressions} benchmarks are at least {threshold}x slower")
 
 
 if __name__ == "__main__":
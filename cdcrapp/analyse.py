@@ -14,6 +14,7 @@ from dotenv import load_dotenv
 from sqlalchemy import create_engine
 from cdcrapp.services import UserService, TaskService
 from cdcrapp.model import Task, NewsArticle, SciPaper
+from cdcrapp.models import get_model, SPACY_EN_TOKENS
 
 FILE_ID_COLUMN = 2
 SENT_ID_COLUMN = 3
@@ -21,10 +22,6 @@ TOK_ID_COLUMN = 4
 TOK_TEXT_COLUMN = 5
 CLUSTER_SIGNAL_COLUMN = 7
 
-@st.cache(allow_output_mutation=True)
-def load_spacy():
-    return spacy.load('en_core_web_sm')
-
 @st.cache(allow_output_mutation=True)
 def get_sql_engine():
     return create_engine(os.getenv("SQLALCHEMY_DB_URI"))
@@ -33,7 +30,7 @@ load_dotenv()
 _engine = get_sql_engine()
 _usersvc : UserService = UserService(_engine)
 _tasksvc : TaskService = TaskService(_engine)
-_nlp : spacy.language.Language = load_spacy()
+_nlp : spacy.language.Language = get_model(SPACY_EN_TOKENS)
 
 def msig(mention) -> tuple:
     """Return mention signature for given mention"""
@@ -271,9 +268,8 @@ def map_tasks_to_mentions(tasks: List[Task], newsdoc: spacy.tokens.doc.Doc, scid
 
 
     for task in tasks:
-        _, start, end = task.news_ent.split(";")
-        start = int(start)
-        end = int(end)
+        start = task.news_ent_start
+        end = task.news_ent_end
 
         news_words = []
         sci_words = []
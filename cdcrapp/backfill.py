@@ -0,0 +1,124 @@
+"""Chunked data backfills for alembic migrations
+
+Large UPDATEs are run as set based statements over keyset paginated ranges of
+the primary key so that no single statement touches the whole table. Progress
+is kept in the backfill_progress table. When a migration runs the backfill
+inside `op.get_context().autocommit_block()` every chunk is committed as it
+goes, and running the migration again after an interruption carries on from
+the last finished chunk. Entering the block commits the schema changes made
+before it, so the migration has to skip them when it is run again.
+
+backfill_progress is created on demand rather than by a migration, alembic's
+env.py leaves it out of autogenerate.
+"""
+import time
+from typing import Iterator, Optional, Tuple
+
+import sqlalchemy as sa
+from sqlalchemy.engine import Connection
+from sqlalchemy.sql import text
+from tqdm.auto import tqdm
+
+BACKFILL_CHUNK_SIZE = 5000
+
+_metadata = sa.MetaData()
+
+backfill_progress = sa.Table("backfill_progress", _metadata,
+    sa.Column("name", sa.String(128), primary_key=True),
+    sa.Column("last_key", sa.Integer),
+    sa.Column("updated_at", sa.DateTime, server_default=sa.func.now()),
+)
+
+
+def _get_progress(conn: Connection, name: str) -> Optional[int]:
+    backfill_progress.create(conn, checkfirst=True)
+    return conn.execute(sa.select([backfill_progress.c.last_key]).where(backfill_progress.c.name==name)).scalar()
+
+
+def _save_progress(conn: Connection, name: str, last_key: int, exists: bool):
+    if exists:
+        conn.execute(backfill_progress.update().where(backfill_progress.c.name==name)
+            .values(last_key=last_key, updated_at=sa.func.now()))
+    else:
+        conn.execute(backfill_progress.insert().values(name=name, last_key=last_key))
+
+
+def key_chunks(conn: Connection, table: str, key: str = "id", chunk_size: int = BACKFILL_CHUNK_SIZE,
+    name: Optional[str] = None) -> Iterator[Tuple[int, int]]:
+    """Split a table into consecutive (low, high] ranges of its integer key with up to chunk_size rows each
+
+    With a name, finished chunks are recorded in backfill_progress and a later
+    call with the same name starts after the last recorded chunk. The record is
+    removed once the whole table has been covered.
+    """
+
+    last_key = _get_progress(conn, name) if name is not None else None
+    resumed = last_key is not None
+
+    low = last_key if resumed else conn.execute(text(f"SELECT MIN({key}) - 1 FROM {table}")).scalar()
+
+    if low is None:
+        return
+
+    remaining = conn.execute(text(f"SELECT COUNT(*) FROM {table} WHERE {key} > :low"), low=low).scalar()
+
+    start = time.time()
+
+    with tqdm(total=remaining, desc=name or table, unit="rows") as progress:
+        while True:
+            high = conn.execute(text(f"SELECT {key} FROM {table} WHERE {key} > :low ORDER BY {key} LIMIT 1 OFFSET :offset"),
+                low=low, offset=chunk_size - 1).scalar()
+
+            if high is None:
+                high = conn.execute(text(f"SELECT MAX({key}) FROM {table} WHERE {key} > :low"), low=low).scalar()
+
+            if high is None:
+                break
+
+            yield low, high
+
+            if name is not None:
+                _save_progress(conn, name, high, resumed)
+                resumed = True
+
+            progress.update(min(chunk_size, progress.total - progress.n))
+            low = high
+
+    if name is not None:
+        conn.execute(backfill_progress.delete().where(backfill_progress.c.name==name))
+
+    elapsed = time.time() - start
+    print(f"{name or table}: {remaining} rows in {elapsed:.1f}s ({remaining / max(elapsed, 1e-6):.0f} rows/s)")
+
+
+def backfill(conn: Connection, table: str, set_clause: str, from_clause: Optional[str] = None, where: Optional[str] = None,
+    key: str = "id", chunk_size: int = BACKFILL_CHUNK_SIZE, name: Optional[str] = None, **params) -> int:
+    """Run `UPDATE table SET set_clause [FROM from_clause] [WHERE where]` one key range at a time
+
+    e.g. backfill(conn, "tasks", "sci_paper_id = scipapers.id", from_clause="scipapers",
+    where="scipapers.url = tasks.sci_url") joins each chunk of tasks to scipapers
+    in a single statement. Extra keyword arguments are bound into the statement.
+    Returns the number of rows updated.
+    """
+
+    conditions = [f"{table}.{key} > :_low", f"{table}.{key} <= :_high"]
+
+    if where is not None:
+        conditions.insert(0, f"({where})")
+
+    condition = " AND ".join(conditions)
+
+    if from_clause is None:
+        statement = f"UPDATE {table} SET {set_clause} WHERE {condition}"
+    elif conn.dialect.name == "mysql":
+        statement = f"UPDATE {table}, {from_clause} SET {set_clause} WHERE {condition}"
+    else:
+        statement = f"UPDATE {table} SET {set_clause} FROM {from_clause} WHERE {condition}"
+
+    statement = text(statement)
+    updated = 0
+
+    for low, high in key_chunks(conn, table, key=key, chunk_size=chunk_size, name=name):
+        updated += conn.execute(statement, _low=low, _high=high, **params).rowcount
+
+    return updated
@@ -0,0 +1,105 @@
+"""Benchmarks for the services and REST API run against synthetic data
+
+Each suite writes its timings to a JSON file together with the commit it was
+run on, so that results from two commits can be compared with
+`python -m cdcrapp benchmark-compare old.json new.json`.
+"""
+
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import time
+
+from contextlib import redirect_stdout
+from datetime import datetime
+from typing import Callable, Iterator, List, Optional, Tuple
+
+
+def current_commit() -> Optional[str]:
+    """Hash of the checked out git commit, None outside a git checkout"""
+
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL).decode("utf8").strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def summarise(timings: List[float]) -> dict:
+    """Summary statistics of a list of timings in seconds"""
+
+    return {
+        "runs": len(timings),
+        "min": min(timings),
+        "median": statistics.median(timings),
+        "mean": statistics.mean(timings),
+        "max": max(timings),
+    }
+
+
+def time_call(fn: Callable, repeat: int = 5, warmup: int = 1) -> dict:
+    """Call fn warmup + repeat times and summarise the timed calls in seconds
+
+    fn is called with the index of the run so that benchmarks that change the
+    database can work on different rows each time. Anything printed by fn is
+    discarded.
+    """
+
+    timings = []
+
+    with redirect_stdout(io.StringIO()):
+        for run in range(warmup + repeat):
+            start = time.perf_counter()
+            fn(run)
+            elapsed = time.perf_counter() - start
+
+            if run >= warmup:
+                timings.append(elapsed)
+
+    return summarise(timings)
+
+
+def save_results(path: str, suite: str, results: List[dict], **config) -> dict:
+    """Write a suite's results to path along with the commit and environment they were measured in"""
+
+    report = {
+        "suite": suite,
+        "commit": current_commit(),
+        "created_at": datetime.utcnow().isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": config,
+        "results": results,
+    }
+
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+
+    return report
+
+
+def compare_results(old: dict, new: dict) -> Iterator[Tuple[str, str, float, float, float]]:
+    """Pair up benchmarks present in both reports
+
+    Yields (scale, benchmark, old median, new median, new/old ratio).
+    """
+
+    old_scales = {result["scale"]: result for result in old["results"]}
+
+    for result in new["results"]:
+        previous = old_scales.get(result["scale"])
+
+        if previous is None:
+            continue
+
+        for name, timing in result["benchmarks"].items():
+            if name not in previous["benchmarks"]:
+                continue
+
+            before = previous["benchmarks"][name]["median"]
+            after = timing["median"]
+
+            yield result["scale"], name, before, after, after / before if before > 0 else float("inf")
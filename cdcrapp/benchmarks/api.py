@@ -0,0 +1,120 @@
+"""Time the task services and REST API endpoints on synthetic databases"""
+
+import time
+
+from typing import Dict, List
+
+from sqlalchemy import create_engine
+
+from cdcrapp.model import NewsArticle, Task, User
+from cdcrapp.services import TaskService, UserService
+from cdcrapp.benchmarks import time_call
+from cdcrapp.benchmarks.synthetic import SyntheticScale, generate_database
+
+
+def _api_client(engine):
+    """Flask test client for the API with the web app's session bound to engine"""
+
+    from cdcrapp.web import create_app, db_session
+
+    db_session.remove()
+    db_session.configure(bind=engine)
+
+    # every request checks its token against a hash of the user's password. With the default
+    # sha256_crypt that takes longer than the endpoints being timed, so use a fast scheme here
+    app = create_app({"SECURITY_HASHING_SCHEMES": ["hex_md5"], "SECURITY_DEPRECATED_HASHING_SCHEMES": []})
+    app.config["TESTING"] = True
+
+    return app, app.test_client()
+
+
+def _auth_headers(app, user_ids: List[int]) -> Dict[int, dict]:
+    from cdcrapp.web import db_session
+
+    with app.app_context():
+        return {user.id: {"Authentication-Token": user.get_auth_token()}
+            for user in db_session.query(User).filter(User.id.in_(user_ids))}
+
+
+def benchmark_scale(engine, app, client, repeat: int, warmup: int) -> Dict[str, dict]:
+    """Time each service call and endpoint against the database engine is bound to"""
+
+    tasksvc = TaskService(engine)
+    usersvc = UserService(engine)
+
+    users = usersvc.list(User, orderby=User.id)
+    headers = _auth_headers(app, [user.id for user in users])
+
+    # one task from each of the first few document pairs, run i works on tasks[i]
+    articles = tasksvc.list(NewsArticle, orderby=NewsArticle.id, limit=warmup + repeat)
+    tasks = [tasksvc.list(Task, filters={"news_article_id": articles[run % len(articles)].id}, orderby=Task.id, limit=1)[0]
+        for run in range(warmup + repeat)]
+
+    def user(run: int) -> User:
+        return users[run % len(users)]
+
+    def get_next_task(run):
+        # reqparse looks for arguments in the JSON body as well as the query string
+        response = client.get("/api/v1/task", headers=headers[user(run).id], json={})
+        assert response.status_code == 200, response.data
+
+    def get_task_with_documents(run):
+        response = client.get("/api/v1/task", headers=headers[user(run).id], json={},
+            query_string={"hash": tasks[run].hash, "include_documents": "true"})
+        assert response.status_code == 200, response.data
+
+    def post_answers(run):
+        # every run answers a different pair of documents so that new answers are written each time
+        task = tasks[run]
+        siblings = tasksvc.list(Task, filters={"news_article_id": task.news_article_id, "sci_paper_id": task.sci_paper_id})
+        response = client.post("/api/v1/answers", headers=headers[user(run).id], json={
+            "news_article_id": task.news_article_id,
+            "sci_paper_id": task.sci_paper_id,
+            "answers": [{"news_ent": t.news_ent, "sci_ent": t.sci_ent, "answer": "yes"} for t in siblings],
+        })
+        assert response.status_code == 200, response.data
+
+    return {
+        "TaskService.next_tasks_for_user": time_call(lambda run: tasksvc.next_tasks_for_user(user(run)), repeat, warmup),
+        "TaskResource.get": time_call(get_next_task, repeat, warmup),
+        "TaskResource.get[include_documents]": time_call(get_task_with_documents, repeat, warmup),
+        "BatchAnswerResource.post": time_call(post_answers, repeat, warmup),
+        "TaskService.get_annotated_tasks": time_call(lambda run: tasksvc.get_annotated_tasks(), repeat, warmup),
+        "UserService.get_fleiss_iaa": time_call(lambda run: list(usersvc.get_fleiss_iaa()), repeat, warmup),
+        "TaskService.get_task_doc_coverage": time_call(lambda run: list(tasksvc.get_task_doc_coverage()), repeat, warmup),
+        "TaskService.get_task_doc_coverage[use_summary]": time_call(
+            lambda run: list(tasksvc.get_task_doc_coverage(use_summary=True)), repeat, warmup),
+    }
+
+
+def run_api_benchmarks(db_uri: str, scales: Dict[str, SyntheticScale], repeat: int = 5, warmup: int = 1,
+    seed: int = 42) -> List[dict]:
+    """Generate a database at each scale in db_uri, replacing its contents, and benchmark it"""
+
+    engine = create_engine(db_uri)
+    app, client = _api_client(engine)
+    results = []
+
+    for name, scale in scales.items():
+        print(f"Generating {name} database {scale}")
+        start = time.perf_counter()
+        rows = generate_database(engine, scale, seed=seed)
+        generate_seconds = time.perf_counter() - start
+
+        print(f"Benchmarking {name} ({rows['tasks']} tasks, {rows['user_tasks']} answers)")
+        benchmarks = benchmark_scale(engine, app, client, repeat, warmup)
+
+        for benchmark, timing in benchmarks.items():
+            print(f"  {benchmark:<50} median {timing['median'] * 1000:9.2f}ms  max {timing['max'] * 1000:9.2f}ms")
+
+        results.append({
+            "scale": name,
+            "config": scale._asdict(),
+            "rows": rows,
+            "generate_seconds": generate_seconds,
+            "benchmarks": benchmarks,
+        })
+
+        engine.dispose()
+
+    return results
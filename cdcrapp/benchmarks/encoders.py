@@ -0,0 +1,127 @@
+"""Compare the encoder backends against the fp32 model on existing tasks
+
+Every backend scores the same sample of document pairs from the database. The
+similarity it gives each task's mention pair is compared with the reference
+backend's, and the time spent encoding gives its throughput.
+"""
+
+import random
+import time
+
+from typing import List, Tuple
+
+import numpy as np
+
+from scipy.spatial.distance import cosine
+
+from cdcrapp.benchmarks import summarise
+from cdcrapp.encoders import get_encoder
+from cdcrapp.model import Task
+from cdcrapp.services import TaskService
+
+
+def sample_pairs(tasksvc: TaskService, sample: int, seed: int = 42) -> List[Tuple[str, str, List[tuple]]]:
+    """Pick up to sample document pairs, returning their texts and each task's (id, news start, news end, sci start, sci end)"""
+
+    with tasksvc.session() as session:
+        pairs = session.query(Task.news_article_id, Task.sci_paper_id).distinct()\
+            .order_by(Task.news_article_id, Task.sci_paper_id).all()
+        chosen = random.Random(seed).sample(pairs, min(sample, len(pairs)))
+        results = []
+
+        for news_id, sci_id in chosen:
+            tasks = tasksvc.query_tasks(session, "with_docs")\
+                .filter(Task.news_article_id == news_id, Task.sci_paper_id == sci_id).all()
+
+            spans = [(task.id, task.news_ent_start, task.news_ent_end, task.sci_ent_start, task.sci_ent_end)
+                for task in tasks if task.news_ent_start is not None and task.sci_ent_start is not None]
+
+            if tasks[0].news_text and tasks[0].sci_text:
+                results.append((tasks[0].news_text, tasks[0].sci_text, spans))
+
+    return results
+
+
+def score_pairs(backend: str, pairs: List[Tuple[str, str, List[tuple]]]) -> Tuple[dict, List[float], int]:
+    """Similarity of every task in pairs with one backend, the seconds spent encoding each pair and tokens encoded"""
+    from cdcrapp.ingest import encode_pair, span_vector
+
+    encoder = get_encoder(backend)
+    sims, timings, tokens = {}, [], 0
+
+    # the first call allocates buffers and, for onnx, optimises the graph
+    encode_pair(pairs[0][0], pairs[0][1], encoder)
+
+    for news_text, sci_text, spans in pairs:
+        start = time.perf_counter()
+        model_inputs, state = encode_pair(news_text, sci_text, encoder)
+        timings.append(time.perf_counter() - start)
+        tokens += len(model_inputs['input_ids'])
+
+        for task_id, news_start, news_end, sci_start, sci_end in spans:
+            n_v = span_vector(state, model_inputs, news_start, news_end)
+            s_v = span_vector(state, model_inputs, sci_start, sci_end, second_doc=True)
+
+            if n_v is not None and s_v is not None:
+                sims[task_id] = 1 - cosine(n_v, s_v)
+
+    return sims, timings, tokens
+
+
+def run_encoder_validation(tasksvc: TaskService, backends: List[str], reference: str = "cpu", sample: int = 50,
+    seed: int = 42, threshold: float = 0.3) -> List[dict]:
+    """Score a sample of tasks with each backend, reporting throughput and similarity drift from the reference
+
+    A task flips when the backend and the reference disagree on whether its
+    similarity is over threshold, the cut off ingest uses to create tasks.
+    """
+
+    pairs = sample_pairs(tasksvc, sample, seed=seed)
+
+    if len(pairs) < 1:
+        raise ValueError("There are no tasks to sample")
+
+    print(f"Scoring {sum(len(spans) for _, _, spans in pairs)} tasks from {len(pairs)} document pairs")
+
+    benchmarks, throughput, drift = {}, {}, {}
+    reference_sims = None
+
+    for backend in [reference] + [backend for backend in backends if backend != reference]:
+        sims, timings, tokens = score_pairs(backend, pairs)
+
+        benchmarks[backend] = summarise(timings)
+        throughput[backend] = {"pairs_per_second": len(timings) / sum(timings), "tokens_per_second": tokens / sum(timings)}
+
+        print(f"{backend:<6} {throughput[backend]['pairs_per_second']:8.2f} pairs/s {throughput[backend]['tokens_per_second']:10.0f} tokens/s")
+
+        if reference_sims is None:
+            reference_sims = sims
+            continue
+
+        common = [task_id for task_id in sims if task_id in reference_sims]
+
+        if len(common) < 1:
+            print(f"       no tasks scored by both {backend} and {reference}")
+            continue
+
+        errors = np.abs(np.array([sims[task_id] - reference_sims[task_id] for task_id in common]))
+        flipped = sum((sims[task_id] > threshold) != (reference_sims[task_id] > threshold) for task_id in common)
+
+        drift[backend] = {
+            "tasks": len(common),
+            "mean": float(errors.mean()),
+            "p95": float(np.percentile(errors, 95)),
+            "max": float(errors.max()),
+            "flipped": int(flipped),
+        }
+
+        print(f"       drift from {reference}: mean {drift[backend]['mean']:.4f}, p95 {drift[backend]['p95']:.4f}, "
+            f"max {drift[backend]['max']:.4f}, {flipped} of {len(common)} tasks flipped at {threshold}")
+
+    return [{
+        "scale": f"sample-{len(pairs)}",
+        "config": {"reference": reference, "seed": seed, "threshold": threshold},
+        "benchmarks": benchmarks,
+        "throughput": throughput,
+        "drift": drift,
+    }]
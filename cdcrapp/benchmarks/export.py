@@ -0,0 +1,235 @@
+"""Time the export pipeline stage by stage
+
+Each exporter run happens in a freshly spawned process so that its peak RSS
+is its own and spacy/BERT start cold, as they do when the CLI commands run.
+Database backed exporters read tasks from either a fixture rebuilt from an
+exported corpus such as mentions/31_07_20_5pc or a synthetic database.
+"""
+
+import hashlib
+import json
+import multiprocessing
+import os
+import tempfile
+import time
+
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional
+
+from sqlalchemy import create_engine
+from sqlalchemy.engine import Engine
+
+from cdcrapp.benchmarks import summarise
+from cdcrapp.instrumentation import peak_rss_mb, record_stages, stage
+from cdcrapp.benchmarks.synthetic import SyntheticScale, generate_database, load_rows
+from cdcrapp.model import content_hash
+from cdcrapp.services import TaskService
+
+CORPUS_SPLITS = ("train", "dev", "test")
+
+
+def _doc_text(tokens: list) -> (str, dict):
+    """Join a document's token rows with spaces, returning the text and each token's (start, end) offsets"""
+
+    offsets = {}
+    position = 0
+
+    for _, tok_id, word, _ in tokens:
+        offsets[tok_id] = (position, position + len(word))
+        position += len(word) + 1
+
+    return " ".join(word for _, _, word, _ in tokens), offsets
+
+
+def build_corpus_database(engine: Engine, corpus_dir: str) -> dict:
+    """Rebuild the tasks behind an exported corpus, replacing the contents of the database
+
+    Every news mention in a topic is paired with every science mention and
+    answered "yes" by a single user when both are in the same cluster.
+    Returns the number of rows written to each table.
+    """
+
+    users = [{"id": 1, "username": "corpus", "email": "corpus@example.com", "password": "benchmark", "active": True}]
+    docs = {"news": {}, "science": {}}
+    mentions, tasks, answers = [], [], []
+    mention_ids = {}
+
+    for split in CORPUS_SPLITS:
+        with open(os.path.join(corpus_dir, f"{split}.json")) as f:
+            split_docs = json.load(f)
+
+        with open(os.path.join(corpus_dir, f"{split}_entities.json")) as f:
+            entities = json.load(f)
+
+        # doc keys look like topic_doctype_docid e.g. 66_science_113
+        topics = defaultdict(dict)
+        texts = {}
+
+        for doc_key, tokens in split_docs.items():
+            topic, doc_type, doc_id = doc_key.split("_")
+            topics[topic][doc_type] = int(doc_id)
+            texts[doc_key] = _doc_text(tokens)
+
+            if int(doc_id) not in docs[doc_type]:
+                docs[doc_type][int(doc_id)] = texts[doc_key][0]
+
+        topic_mentions = defaultdict(lambda: {"news": [], "science": []})
+
+        for ent in entities:
+            topic, doc_type, doc_id = ent["doc_id"].split("_")
+            text, offsets = texts[ent["doc_id"]]
+            start, end = offsets[ent["tokens_ids"][0]][0], offsets[ent["tokens_ids"][-1]][1]
+            ent_string = f"{text[start:end]};{start};{end}"
+            key = (doc_type, int(doc_id), ent_string)
+
+            if key not in mention_ids:
+                mention_ids[key] = len(mentions) + 1
+                mentions.append({"id": mention_ids[key],
+                    "news_article_id": int(doc_id) if doc_type == "news" else None,
+                    "sci_paper_id": int(doc_id) if doc_type == "science" else None,
+                    "ent": ent_string, "text": text[start:end], "start_char": start, "end_char": end})
+
+            topic_mentions[topic][doc_type].append((mentions[mention_ids[key] - 1], ent["cluster_id"]))
+
+        for topic, pair in topics.items():
+            for news, news_cluster in topic_mentions[topic]["news"]:
+                for sci, sci_cluster in topic_mentions[topic]["science"]:
+                    task_id = len(tasks) + 1
+                    tasks.append({
+                        "id": task_id,
+                        "hash": hashlib.sha256(f"{pair['news']}:{pair['science']}:{news['ent']}:{sci['ent']}".encode("utf8")).hexdigest(),
+                        "news_article_id": pair["news"], "sci_paper_id": pair["science"],
+                        "news_mention_id": news["id"], "sci_mention_id": sci["id"],
+                        "news_ent": news["ent"], "news_ent_text": news["text"],
+                        "news_ent_start": news["start_char"], "news_ent_end": news["end_char"],
+                        "sci_ent": sci["ent"], "sci_ent_text": sci["text"],
+                        "sci_ent_start": sci["start_char"], "sci_ent_end": sci["end_char"],
+                    })
+                    answers.append({"user_id": 1, "task_id": task_id, "answer": "yes" if news_cluster == sci_cluster else "no"})
+
+    articles = [{"id": doc_id, "url": f"https://news.example.com/{doc_id}", "summary": text, "content_hash": content_hash(text)}
+        for doc_id, text in docs["news"].items()]
+    papers = [{"id": doc_id, "url": f"10.5555/corpus.{doc_id}", "abstract": text, "content_hash": content_hash(text)}
+        for doc_id, text in docs["science"].items()]
+
+    return load_rows(engine, users, papers, articles, mentions, tasks, answers)
+
+
+def _export_json(tasksvc: TaskService, corpus_dir: str, output_dir: str, seed: int):
+    with stage("import"):
+        from cdcrapp.export import export_to_json
+
+    with stage("db_fetch"):
+        tasks = tasksvc.get_annotated_tasks()
+
+    export_to_json(tasks, os.path.join(output_dir, "json"), train_split=0.6, dev_split=0.2, seed=seed)
+
+
+def _export_joshi(tasksvc: TaskService, corpus_dir: str, output_dir: str, seed: int):
+    with stage("import"):
+        from cdcrapp.export import export_to_joshi
+
+    with stage("db_fetch"):
+        tasks = tasksvc.get_annotated_tasks()
+
+    export_to_joshi(tasks, os.path.join(output_dir, "joshi.jsonl"), train_split=0.6, dev_split=0.2, seed=seed)
+
+
+def _export_conll(tasksvc: TaskService, corpus_dir: str, output_dir: str, seed: int):
+    with stage("import"):
+        from cdcrapp.export import export_to_conll
+
+    export_to_conll(os.path.join(corpus_dir, "train.json"), os.path.join(output_dir, "train.conll"))
+
+
+def _export_csv(tasksvc: TaskService, corpus_dir: str, output_dir: str, seed: int):
+    with stage("import"):
+        from cdcrapp.export import export_json_to_csv
+
+    export_json_to_csv(corpus_dir, os.path.join(output_dir, "docs.csv"))
+
+
+# export_to_conll and export_json_to_csv read the corpus JSON files rather than the database
+EXPORTERS = {
+    "export_to_json": _export_json,
+    "export_to_joshi": _export_joshi,
+    "export_to_conll": _export_conll,
+    "export_json_to_csv": _export_csv,
+}
+
+
+def run_exporter(exporter: str, db_uri: str, corpus_dir: str, seed: int = 42, profile_dir: Optional[str] = None) -> dict:
+    """Run one exporter into a temporary directory and report its stage timings, called in a child process"""
+
+    engine = create_engine(db_uri)
+    error = None
+
+    with tempfile.TemporaryDirectory() as output_dir, record_stages(profile=profile_dir is not None) as recorder:
+        start = time.perf_counter()
+
+        try:
+            EXPORTERS[exporter](TaskService(engine), corpus_dir, output_dir, seed)
+        except Exception as e:
+            # e.g. a missing spacy model or tokenizer, the other exporters can still be measured
+            error = f"{type(e).__name__}: {e}"
+
+        total = time.perf_counter() - start
+
+    if profile_dir is not None:
+        recorder.dump_profiles(profile_dir, exporter)
+
+    return {"seconds": total, "peak_rss_mb": peak_rss_mb(), "stages": recorder.results(), "error": error}
+
+
+def run_export_benchmarks(db_uri: str, fixture: str, corpus_dir: str, exporters: List[str], repeat: int = 1,
+    seed: int = 42, profile_dir: Optional[str] = None, scale: Optional[SyntheticScale] = None) -> List[dict]:
+    """Build the fixture in db_uri, replacing its contents, then time each exporter repeat times"""
+
+    engine = create_engine(db_uri)
+
+    print(f"Building {fixture} fixture")
+
+    if scale is not None:
+        rows = generate_database(engine, scale, seed=seed)
+    else:
+        rows = build_corpus_database(engine, corpus_dir)
+
+    engine.dispose()
+
+    benchmarks, peak_rss, errors = {}, {}, {}
+    context = multiprocessing.get_context("spawn")
+
+    for exporter in exporters:
+        runs = []
+
+        for run in range(repeat):
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                runs.append(pool.submit(run_exporter, exporter, db_uri, corpus_dir, seed, profile_dir).result())
+
+        if runs[-1]["error"] is not None:
+            errors[exporter] = runs[-1]["error"]
+            print(f"{exporter} failed: {errors[exporter]}")
+            continue
+
+        benchmarks[exporter] = summarise([result["seconds"] for result in runs])
+        peak_rss[exporter] = max(result["peak_rss_mb"] or 0 for result in runs)
+
+        print(f"{exporter}: median {benchmarks[exporter]['median']:.2f}s, peak RSS {peak_rss[exporter]:.0f}MB")
+
+        for name, last in runs[-1]["stages"].items():
+            key = f"{exporter}:{name}"
+            stages = [result["stages"][name] for result in runs if name in result["stages"]]
+            benchmarks[key] = summarise([s["seconds"] for s in stages])
+            peak_rss[key] = max(s["peak_rss_mb"] or 0 for s in stages)
+
+            print(f"  {name:<20} {benchmarks[key]['median']:8.2f}s  calls {last['calls']:6d}  peak RSS {peak_rss[key]:.0f}MB")
+
+    return [{
+        "scale": fixture,
+        "config": scale._asdict() if scale is not None else {"corpus_dir": corpus_dir},
+        "rows": rows,
+        "benchmarks": benchmarks,
+        "peak_rss_mb": peak_rss,
+        "errors": errors,
+    }]
@@ -0,0 +1,100 @@
+"""Check how long lightweight CLI commands spend importing modules
+
+Each command is run for real with `python -X importtime -m cdcrapp <command>`
+against a tiny corpus and pair of benchmark reports written to a temporary
+directory, so that imports made inside the command are counted too.
+"""
+
+import json
+import os
+import subprocess
+import sys
+import time
+
+from typing import Dict, List, Tuple
+
+from cdcrapp.benchmarks import summarise
+
+# commands that should run without touching the database or NLP stack and their arguments,
+# {corpus}, {old} and {new} are filled in with the paths from write_fixture()
+LIGHT_COMMANDS = {
+    "count-docs": ["{corpus}"],
+    "count-mentions": ["{corpus}"],
+    "count-clusters": ["{corpus}"],
+    "benchmark-compare": ["{old}", "{new}"],
+}
+
+# start up budget for the commands above, in seconds of import time
+IMPORT_BUDGET_SECONDS = 0.3
+
+# modules that a lightweight command should never need
+HEAVY_MODULES = ("pandas", "numpy", "scipy", "sklearn", "sqlalchemy", "torch", "transformers", "spacy", "streamlit",
+    "matplotlib", "seaborn", "flask")
+
+
+def parse_importtime(output: str) -> List[Tuple[str, int, int, int]]:
+    """Parse -X importtime output into (module, self us, cumulative us, depth) rows"""
+
+    rows = []
+
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        rows.append((name.strip(), int(self_us), int(cumulative_us), depth))
+
+    return rows
+
+
+def write_fixture(directory: str) -> Dict[str, str]:
+    """Write a three document corpus and two identical benchmark reports to directory for the light commands"""
+
+    corpus = os.path.join(directory, "corpus")
+    os.makedirs(corpus, exist_ok=True)
+
+    for split in ("train", "dev", "test"):
+        with open(os.path.join(corpus, f"{split}.json"), "w") as f:
+            json.dump([{"doc_id": f"{split}_1", "text": "A drug slows the disease."}], f)
+
+        with open(os.path.join(corpus, f"{split}_entities.json"), "w") as f:
+            json.dump([{"doc_id": f"{split}_1", "text": "drug", "cluster_id": 1},
+                {"doc_id": f"{split}_1", "text": "disease", "cluster_id": 2}], f)
+
+    report = {"commit": None, "results": [{"scale": "cli", "benchmarks": {"count-docs": summarise([0.1])}}]}
+    paths = {"corpus": corpus}
+
+    for name in ("old", "new"):
+        paths[name] = os.path.join(directory, f"{name}.json")
+
+        with open(paths[name], "w") as f:
+            json.dump(report, f)
+
+    return paths
+
+
+def measure_command(command: str, args: List[str], repeat: int = 5) -> dict:
+    """Run a command repeat times and report its import time, wall time and heaviest imports"""
+
+    import_times, wall_times = [], []
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = subprocess.run([sys.executable, "-X", "importtime", "-m", "cdcrapp", command] + args,
+            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, check=True)
+        wall_times.append(time.perf_counter() - start)
+
+        rows = parse_importtime(result.stderr.decode("utf8"))
+        import_times.append(sum(self_us for _, self_us, _, _ in rows) / 1e6)
+
+    heaviest = sorted((row for row in rows if row[3] == 0), key=lambda row: row[2], reverse=True)[:10]
+    heavy = sorted({name for name, _, _, _ in rows if name.split(".")[0] in HEAVY_MODULES})
+
+    return {
+        "imports": summarise(import_times),
+        "wall": summarise(wall_times),
+        "modules": len(rows),
+        "heaviest": [{"module": name, "cumulative_ms": cumulative / 1000} for name, _, cumulative, _ in heaviest],
+        "heavy_modules": heavy,
+    }
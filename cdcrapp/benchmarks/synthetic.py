@@ -0,0 +1,161 @@
+"""Generate a synthetic annotation database for benchmarking
+
+Rows are written with bulk inserts and explicit ids rather than through the
+ORM so that large databases can be built in a reasonable time. The same scale
+and seed always produce the same database.
+"""
+
+import hashlib
+import math
+import random
+
+from typing import NamedTuple
+
+from sqlalchemy.engine import Engine
+from sqlalchemy.sql import text
+from tqdm.auto import tqdm
+
+from cdcrapp.model import Base, User, Task, UserTask, NewsArticle, SciPaper, Mention, content_hash
+from cdcrapp.services import TaskService
+
+INSERT_CHUNK_SIZE = 5000
+
+WORDS = ("cell", "study", "patients", "risk", "climate", "data", "effect", "model", "trial", "brain",
+    "species", "dose", "energy", "survey", "protein", "children", "carbon", "virus", "sleep", "diet")
+
+
+class SyntheticScale(NamedTuple):
+    """Size of a synthetic database, each news article is paired with one science paper"""
+
+    articles: int
+    papers: int
+    tasks_per_pair: int
+    users: int
+    # fraction of tasks that have been answered and how many users answered each of them
+    answered_fraction: float = 0.3
+    answers_per_task: int = 2
+
+
+SCALES = {
+    "small": SyntheticScale(articles=50, papers=50, tasks_per_pair=20, users=5),
+    "medium": SyntheticScale(articles=500, papers=400, tasks_per_pair=20, users=10),
+    "large": SyntheticScale(articles=5000, papers=4000, tasks_per_pair=30, users=20),
+}
+
+
+def parse_scale(value: str) -> SyntheticScale:
+    """Look up a named scale or parse "articles,papers,tasks_per_pair,users[,answered_fraction[,answers_per_task]]" """
+
+    if value in SCALES:
+        return SCALES[value]
+
+    parts = value.split(",")
+
+    if not 4 <= len(parts) <= 6:
+        raise ValueError(f"Unknown scale {value!r}, use one of {', '.join(SCALES)} or articles,papers,tasks_per_pair,users")
+
+    types = (int, int, int, int, float, int)
+
+    return SyntheticScale(*[convert(part) for convert, part in zip(types, parts)])
+
+
+def _text(rng: random.Random, words: int) -> str:
+    # split into sentences so that spacy has something to segment in the export benchmarks
+    tokens = [rng.choice(WORDS) for _ in range(words)]
+    return " ".join(" ".join(tokens[i:i + 12]).capitalize() + "." for i in range(0, words, 12))
+
+
+def load_rows(engine: Engine, users: list, papers: list, articles: list, mentions: list, tasks: list, answers: list) -> dict:
+    """Replace the contents of the database with the given rows, which carry explicit ids
+
+    Returns the number of rows written to each table.
+    """
+
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+
+    tables = ((User, users), (SciPaper, papers), (NewsArticle, articles), (Mention, mentions), (Task, tasks),
+        (UserTask, answers))
+
+    with engine.begin() as conn:
+        for model, rows in tables:
+            for i in tqdm(range(0, len(rows), INSERT_CHUNK_SIZE), desc=model.__tablename__, leave=False):
+                conn.execute(model.__table__.insert(), rows[i:i + INSERT_CHUNK_SIZE])
+
+    if engine.dialect.name == "postgresql":
+        # rows were inserted with explicit ids so move the sequences past them
+        with engine.begin() as conn:
+            for table in ("users", "scipapers", "newsarticles", "mentions", "tasks"):
+                conn.execute(text(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), MAX(id)) FROM {table}"))
+
+    TaskService(engine).refresh_doc_coverage()
+
+    return {model.__tablename__: len(rows) for model, rows in tables}
+
+
+def generate_database(engine: Engine, scale: SyntheticScale, seed: int = 42) -> dict:
+    """Drop and recreate all tables on engine and fill them with synthetic data at the given scale
+
+    Returns the number of rows written to each table.
+    """
+
+    rng = random.Random(seed)
+
+    users = [{"id": i + 1, "username": f"bench{i}", "email": f"bench{i}@example.com", "password": "benchmark",
+        "active": True} for i in range(scale.users)]
+
+    articles, papers, mentions, tasks, answers = [], [], [], [], []
+
+    for i in range(scale.papers):
+        abstract = _text(rng, 250)
+        papers.append({"id": i + 1, "url": f"10.5555/bench.{i}", "abstract": abstract, "content_hash": content_hash(abstract)})
+
+    # tasks for a pair are every combination of a few news and science mentions
+    news_mentions = math.ceil(math.sqrt(scale.tasks_per_pair))
+    sci_mentions = math.ceil(scale.tasks_per_pair / news_mentions)
+
+    for i in range(scale.articles):
+        summary = _text(rng, 600)
+        article_id, paper_id = i + 1, i % scale.papers + 1
+        articles.append({"id": article_id, "url": f"https://news.example.com/{i}", "summary": summary,
+            "content_hash": content_hash(summary)})
+
+        pair_mentions = {"news": [], "sci": []}
+
+        for side, count, doc_column, doc_id in (("news", news_mentions, "news_article_id", article_id),
+                ("sci", sci_mentions, "sci_paper_id", paper_id)):
+            for m in range(count):
+                word = rng.choice(WORDS)
+                start = rng.randrange(0, 1000)
+                mention = {"id": len(mentions) + 1, "news_article_id": None, "sci_paper_id": None, doc_column: doc_id,
+                    "ent": f"{word};{start};{start + len(word)}", "text": word, "start_char": start, "end_char": start + len(word)}
+                mentions.append(mention)
+                pair_mentions[side].append(mention)
+
+        for t in range(scale.tasks_per_pair):
+            news = pair_mentions["news"][t % news_mentions]
+            sci = pair_mentions["sci"][t // news_mentions]
+            task_id = len(tasks) + 1
+
+            tasks.append({
+                "id": task_id,
+                "hash": hashlib.sha256(f"{article_id}:{paper_id}:{news['ent']}:{sci['ent']}".encode("utf8")).hexdigest(),
+                "news_article_id": article_id, "sci_paper_id": paper_id,
+                "news_mention_id": news["id"], "sci_mention_id": sci["id"],
+                "news_ent": news["ent"], "news_ent_text": news["text"],
+                "news_ent_start": news["start_char"], "news_ent_end": news["end_char"],
+                "sci_ent": sci["ent"], "sci_ent_text": sci["text"],
+                "sci_ent_start": sci["start_char"], "sci_ent_end": sci["end_char"],
+                "similarity": rng.random(),
+                "is_iaa": rng.random() < 0.1,
+                "is_iaa_priority": rng.random() < 0.02,
+                "is_bad": rng.random() < 0.02,
+                "is_difficult": rng.random() < 0.03,
+                "priority": 0,
+            })
+
+            if rng.random() < scale.answered_fraction:
+                for user in rng.sample(users, min(scale.answers_per_task, len(users))):
+                    answers.append({"user_id": user["id"], "task_id": task_id, "answer": rng.choice(["yes", "no"])})
+
+    return load_rows(engine, users, papers, articles, mentions, tasks, answers)
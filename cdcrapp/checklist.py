@@ -40,7 +40,7 @@ for i,row in df.iterrows():
 
 # %%
 with _tasksvc.session() as session:
-    q= session.query(Task)\
+    q= _tasksvc.query_tasks(session, "with_docs")\
         .options(joinedload(Task.usertasks))\
         .filter(Task.id.in_(df['id'].tolist()))
     tasks = q.all()
@@ -67,8 +67,8 @@ for doc in docs.keys():
     else:
         sci_docs.append(int(id))
 # %%
-import spacy
-nlp = spacy.load('en_core_web_md')
+from cdcrapp.models import get_model, SPACY_EN_TOKENS
+nlp = get_model(SPACY_EN_TOKENS)
 
 news_docs = {}
 sci_docs = {}
@@ -109,17 +109,13 @@ for task in tasks:
 difficult = []
 for task in tasks:
 
-    text,start,end = task.news_ent.split(';')
-
     news_idx = list(tok_id_from_doc(
         news_docs[task.news_article_id], 
-        int(start), int(end)))
-
-    text,start,end = task.sci_ent.split(';')
+        task.news_ent_start, task.news_ent_end))
 
     sci_idx = list(tok_id_from_doc(
         sci_docs[task.sci_paper_id], 
-        int(start), int(end)))
+        task.sci_ent_start, task.sci_ent_end))
 
     difficult.append({
         "news_document":  f"news_{task.news_article_id}",
@@ -159,13 +155,11 @@ for cluster_id, cluster in clusters.items():
 
 def check_task_result(task):
 
-    _,start,end = task.news_ent.split(";")
     doc = nlp(task.news_text)
-    news_offsets = list(tok_id_from_doc(doc,int(start),int(end)))
+    news_offsets = list(tok_id_from_doc(doc,task.news_ent_start,task.news_ent_end))
 
-    _,start,end = task.sci_ent.split(";")
     doc = nlp(task.sci_text)
-    sci_offsets = list(tok_id_from_doc(doc,int(start),int(end)))
+    sci_offsets = list(tok_id_from_doc(doc,task.sci_ent_start,task.sci_ent_end))
 
     for offset in news_offsets:
         ncluster = news_doc_mentions.get((task.news_article_id, offset))
@@ -2,11 +2,11 @@
 
 import pickle
 import logging
-import spacy
 
 from typing import List
 from cdcrapp.export import map_and_sort
 from cdcrapp.model import Task
+from cdcrapp.models import get_model, SPACY_EN_TOKENS
 from collections import defaultdict
 
 from itertools import combinations
@@ -15,7 +15,7 @@ logging.basicConfig(level=logging.INFO)
 
 def compare(pklfile: str, task_group: List[Task]):
 
-    nlp = spacy.load('en')
+    nlp = get_model(SPACY_EN_TOKENS)
     logger = logging.getLogger(__name__)
 
     logger.info("Prepare known tasks from db")
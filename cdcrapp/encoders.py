@@ -0,0 +1,255 @@
+"""Encoder backends that run BERT over tokenized text for candidate similarity scoring
+
+cuda runs the fp32 model on the GPU as ingest always has, cpu runs the same
+model on the CPU, int8 quantizes its linear layers to int8 with dynamic
+quantization and onnx exports it to ONNX and runs it with onnxruntime. The
+backend defaults to ENCODER_BACKEND and the number of CPU threads used by the
+CPU backends to ENCODER_THREADS.
+"""
+
+import os
+
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from cdcrapp.models import BERT_MODEL, get_model, register_model
+
+BERT_MODEL_CPU = "bert-base-uncased/cpu"
+BERT_MODEL_INT8 = "bert-base-uncased/int8"
+BERT_MODEL_ONNX = "bert-base-uncased/onnx"
+
+_backends: Dict[str, type] = {}
+_encoders: Dict[str, "Encoder"] = {}
+_threads: Optional[int] = int(os.environ["ENCODER_THREADS"]) if os.environ.get("ENCODER_THREADS") else None
+
+
+def register_backend(name: str):
+    """Register the decorated Encoder subclass as a backend"""
+
+    def decorator(cls):
+        _backends[name] = cls
+        return cls
+
+    return decorator
+
+
+def backends():
+    """Names of the available encoder backends"""
+
+    return list(_backends)
+
+
+def set_threads(threads: int):
+    """Limit the CPU threads used by the torch backends and by onnx sessions created afterwards"""
+    global _threads
+
+    import torch
+
+    _threads = threads
+    torch.set_num_threads(threads)
+
+
+def get_encoder(backend: Optional[str] = None) -> "Encoder":
+    """Get the shared encoder for a backend, loading its model on first use"""
+
+    backend = backend or os.environ.get("ENCODER_BACKEND", "cuda")
+
+    if backend not in _backends:
+        raise ValueError(f"Unknown encoder backend {backend}, expected one of {','.join(_backends)}")
+
+    if backend not in _encoders:
+        _encoders[backend] = _backends[backend]()
+
+    return _encoders[backend]
+
+
+def _chunks(length: int, size: int, overlap: int) -> List[Tuple[int, int]]:
+    """(start, end) of windows of up to size tokens covering length tokens, neighbouring windows sharing overlap tokens"""
+
+    if length <= size:
+        return [(0, length)]
+
+    step = size - min(overlap, size // 2)
+    starts = list(range(0, length - size, step)) + [length - size]
+
+    return [(start, start + size) for start in starts]
+
+
+def encode_windows(tokenizer: Any, text: str, text_pair: str, encoder: "Encoder", max_length: int = 512,
+    overlap: int = 128) -> Tuple[dict, np.ndarray]:
+    """Encode a pair of texts of any length as overlapping windows in a single batch
+
+    Every window holds a chunk of text and a chunk of text_pair. When text is
+    short enough, as news summaries are, it goes whole into every window and
+    only text_pair is split. Otherwise both are split and every chunk of one is
+    paired with every chunk of the other. A token that appears in several
+    windows gets the mean of its hidden states.
+
+    Returns inputs for the whole pair, laid out as [CLS] text [SEP] text_pair
+    [SEP] like encode_plus without truncation, and each token's hidden state.
+    """
+
+    first = tokenizer.encode_plus(text, add_special_tokens=False, return_offsets_mapping=True)
+    second = tokenizer.encode_plus(text_pair, add_special_tokens=False, return_offsets_mapping=True)
+    n1, n2 = len(first['input_ids']), len(second['input_ids'])
+
+    # room for the tokens of both texts once [CLS] and two [SEP]s are added
+    budget = max_length - 3
+    size1 = min(n1, max(budget - n2, budget // 2))
+    size2 = budget - size1
+
+    cls, sep = tokenizer.cls_token_id, tokenizer.sep_token_id
+    windows, positions = [], []
+
+    for a, b in _chunks(n1, size1, overlap):
+        for c, d in _chunks(n2, size2, overlap):
+            windows.append(([cls] + first['input_ids'][a:b] + [sep] + second['input_ids'][c:d] + [sep], b - a + 2))
+            # where each window token sits in the whole pair
+            positions.append([0] + list(range(1 + a, 1 + b)) + [n1 + 1] + list(range(n1 + 2 + c, n1 + 2 + d)) + [n1 + n2 + 2])
+
+    longest = max(len(ids) for ids, _ in windows)
+    pad = [tokenizer.pad_token_id or 0]
+
+    hidden = encoder.encode(
+        [ids + pad * (longest - len(ids)) for ids, _ in windows],
+        [[0] * first_len + [1] * (len(ids) - first_len) + [0] * (longest - len(ids)) for ids, first_len in windows],
+        [[1] * len(ids) + [0] * (longest - len(ids)) for ids, _ in windows])
+
+    sums = np.zeros((n1 + n2 + 3, hidden.shape[-1]), dtype=hidden.dtype)
+    counts = np.zeros(n1 + n2 + 3, dtype=hidden.dtype)
+
+    for window, window_positions in zip(hidden, positions):
+        sums[window_positions] += window[:len(window_positions)]
+        counts[window_positions] += 1
+
+    model_inputs = {
+        "input_ids": [cls] + first['input_ids'] + [sep] + second['input_ids'] + [sep],
+        "token_type_ids": [0] * (n1 + 2) + [1] * (n2 + 1),
+        "attention_mask": [1] * (n1 + n2 + 3),
+        # special tokens have no offsets so that they never count towards a mention
+        "offset_mapping": [None] + list(first['offset_mapping']) + [None] + list(second['offset_mapping']) + [None],
+    }
+
+    return model_inputs, sums / counts[:, None]
+
+
+class Encoder(object):
+    """Runs BERT over a batch of tokenized inputs"""
+
+    model_name: str = None
+
+    def __init__(self):
+        self.model = get_model(self.model_name)
+
+    def encode(self, input_ids: list, token_type_ids: list, attention_mask: list) -> np.ndarray:
+        """Last hidden state of every token in the batch, batch x sequence x hidden"""
+        raise NotImplementedError
+
+
+@register_backend("cuda")
+class TorchEncoder(Encoder):
+
+    model_name = BERT_MODEL
+    device = "cuda"
+
+    def encode(self, input_ids: list, token_type_ids: list, attention_mask: list) -> np.ndarray:
+        import torch
+
+        with torch.no_grad():
+            hidden_state = self.model(
+                input_ids=torch.tensor(input_ids, device=self.device),
+                token_type_ids=torch.tensor(token_type_ids, device=self.device),
+                attention_mask=torch.tensor(attention_mask, device=self.device)
+            )[0]
+
+        return hidden_state.cpu().numpy()
+
+
+@register_backend("cpu")
+class CPUEncoder(TorchEncoder):
+
+    model_name = BERT_MODEL_CPU
+    device = "cpu"
+
+    def __init__(self):
+        if _threads is not None:
+            set_threads(_threads)
+
+        super().__init__()
+
+
+@register_backend("int8")
+class QuantizedEncoder(CPUEncoder):
+
+    model_name = BERT_MODEL_INT8
+
+
+@register_backend("onnx")
+class ONNXEncoder(Encoder):
+
+    model_name = BERT_MODEL_ONNX
+
+    def encode(self, input_ids: list, token_type_ids: list, attention_mask: list) -> np.ndarray:
+        return self.model.run(["last_hidden_state"], {
+            "input_ids": np.asarray(input_ids, dtype=np.int64),
+            "token_type_ids": np.asarray(token_type_ids, dtype=np.int64),
+            "attention_mask": np.asarray(attention_mask, dtype=np.int64),
+        })[0]
+
+
+@register_model(BERT_MODEL_CPU)
+def _load_bert_cpu():
+    from transformers import BertModel
+
+    return BertModel.from_pretrained('bert-base-uncased').eval()
+
+
+@register_model(BERT_MODEL_INT8)
+def _load_bert_int8():
+    import torch
+    from transformers import BertModel
+
+    model = BertModel.from_pretrained('bert-base-uncased').eval()
+
+    return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+
+
+def export_onnx(path: str):
+    """Export the fp32 BERT model to an ONNX file with dynamic batch and sequence sizes"""
+    import torch
+    from transformers import BertModel
+
+    model = BertModel.from_pretrained('bert-base-uncased').eval()
+    dummy = torch.ones((1, 8), dtype=torch.long)
+    axes = {0: "batch", 1: "sequence"}
+
+    with torch.no_grad():
+        torch.onnx.export(model, (dummy, dummy, torch.zeros_like(dummy)), path,
+            input_names=["input_ids", "attention_mask", "token_type_ids"],
+            output_names=["last_hidden_state", "pooler_output"],
+            dynamic_axes={"input_ids": axes, "attention_mask": axes, "token_type_ids": axes,
+                "last_hidden_state": axes, "pooler_output": {0: "batch"}},
+            opset_version=11)
+
+
+@register_model(BERT_MODEL_ONNX)
+def _load_bert_onnx():
+    try:
+        import onnxruntime
+    except ImportError:
+        raise ImportError("The onnx encoder backend needs onnxruntime, install it with pip install onnxruntime")
+
+    path = os.environ.get("ENCODER_ONNX_PATH", "bert-base-uncased.onnx")
+
+    if not os.path.exists(path):
+        print(f"Exporting bert-base-uncased to {path}")
+        export_onnx(path)
+
+    options = onnxruntime.SessionOptions()
+    options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+
+    if _threads is not None:
+        options.intra_op_num_threads = _threads
+
+    return onnxruntime.InferenceSession(path, options)
@@ -2,19 +2,22 @@
 Export CDCRApp annotations to CONLL format
 """
 
-import spacy
 import json
 import os
 import random
 import itertools
-import html
 
 from tqdm.auto import tqdm
-from typing import List, Optional, Iterator, Dict
+from typing import TYPE_CHECKING, List, Optional, Iterator, Dict
 from cdcrapp.model import Task, UserTask, NewsArticle, SciPaper
+from cdcrapp.models import get_model, SPACY_EN_SYNTAX, SPACY_EN_SENTS, SPANBERT_TOKENIZER
+from cdcrapp.instrumentation import stage
 from collections import defaultdict, OrderedDict, Counter
 from urllib.parse import urlparse
-from transformers import BertModel, BertTokenizerFast
+
+if TYPE_CHECKING:
+    import spacy
+    from transformers import BertTokenizerFast
 
 _next_cluster_id=0
 
@@ -31,12 +34,8 @@ def map_pairs(task_group: List[Task], coref_chains: Dict[tuple, int]):
 
     for task in task_group:
 
-        try:
-            _,start,end = task.news_ent.split(";")
-            start = int(start)
-            end = int(end)
-        except ValueError:
-            print(f"Failed to split ent {task.sci_ent}")
+        if task.news_ent_start is None:
+            print(f"Failed to split ent {task.news_ent}")
             continue
 
 
@@ -44,19 +43,15 @@ def map_pairs(task_group: List[Task], coref_chains: Dict[tuple, int]):
 
 
         # append the mention and ID
-        news_bounds.append((start,end, cluster_id))
+        news_bounds.append((task.news_ent_start, task.news_ent_end, cluster_id))
 
-        try:
-            _,start,end = html.unescape(task.sci_ent).split(";")
-            start = int(start)
-            end = int(end)
-        except ValueError as e:
+        if task.sci_ent_start is None:
             print(f"Failed to split ent {task.sci_ent}")
             continue
 
         cluster_id = coref_chains[("sci", task.sci_ent)]
 
-        sci_bounds.append((start,end, cluster_id))
+        sci_bounds.append((task.sci_ent_start, task.sci_ent_end, cluster_id))
     
 
     return news_bounds, sci_bounds
@@ -130,9 +125,10 @@ def export_json_to_csv(json_dir:str, output_file: str):
 
         for file in [test_file,train_file,dev_file]:
             print(f"Processing {file}")
-            with open(file) as f:
+            with open(file) as f, stage("load"):
                 docs = json.load(f)
 
+            with stage("serialize"):
                 for docname, tokens in docs.items():
                     words = " ".join(tok[2] for tok in tokens)
 
@@ -145,45 +141,46 @@ def export_to_conll(input_file:str, output_file: str, remove_singletons:bool=Fal
     """Given a JSON formatted set of mentions, turn into CONLL notation"""
 
     # open the 'complete' json file
-    with open(input_file) as f:
+    with open(input_file) as f, stage("load"):
         docs = json.load(f, object_pairs_hook=OrderedDict)
 
     # open the mentions file    
     entities_file = os.path.join(os.path.dirname(input_file), 
                                     os.path.splitext(os.path.basename(input_file))[0] + "_entities.json")
 
-    with open(entities_file) as f:
+    with open(entities_file) as f, stage("load"):
         entities = json.load(f)
 
     ent_map = {}
 
 
 
-    cluster_count = Counter([ent['cluster_id'] for ent in entities])
+    with stage("chains"):
+        cluster_count = Counter([ent['cluster_id'] for ent in entities])
 
 
-    for ent in entities:
+        for ent in entities:
 
-        tok_total = len(ent['tokens_ids'])
-        for i, tok_id in enumerate(ent['tokens_ids']):
+            tok_total = len(ent['tokens_ids'])
+            for i, tok_id in enumerate(ent['tokens_ids']):
             
-            # remove singleton entries
-            if cluster_count[ent['cluster_id']] == 1 and remove_singletons:
-                continue
+                # remove singleton entries
+                if cluster_count[ent['cluster_id']] == 1 and remove_singletons:
+                    continue
 
-            if i == 0 and tok_total == 1:
-                ent_map_val = f"({ent['cluster_id']})"
-            elif i == 0:
-                ent_map_val = f"({ent['cluster_id']}"
+                if i == 0 and tok_total == 1:
+                    ent_map_val = f"({ent['cluster_id']})"
+                elif i == 0:
+                    ent_map_val = f"({ent['cluster_id']}"
 
-            elif (i+1) == tok_total:
-                ent_map_val = f"{ent['cluster_id']})"
-            else:
-                ent_map_val = "-"
+                elif (i+1) == tok_total:
+                    ent_map_val = f"{ent['cluster_id']})"
+                else:
+                    ent_map_val = "-"
 
-            ent_map[(ent['doc_id'], tok_id)] = ent_map_val
+                ent_map[(ent['doc_id'], tok_id)] = ent_map_val
     
-    with open(output_file, "w") as fp:
+    with open(output_file, "w") as fp, stage("serialize"):
         fp.write("#begin document test_entities\n")
 
         for doc_id, doc in tqdm(docs.items()):
@@ -282,7 +279,7 @@ def generate_coref_chains(task_items: List[tuple]):
         
 
 
-def generate_json_maps(task_items: List[tuple], nlp: spacy.language.Language) -> (dict, List[dict]):
+def generate_json_maps(task_items: List[tuple], nlp: 'spacy.language.Language') -> (dict, List[dict]):
     """Generate map of document words and entities"""
 
     doc_map = {}
@@ -294,8 +291,9 @@ def generate_json_maps(task_items: List[tuple], nlp: spacy.language.Language) ->
 
     for topic_idx, (task_group_id, tasklist) in enumerate(tqdm(task_items)):
 
-        scidoc = nlp(tasklist[0].sci_text)
-        newsdoc = nlp(tasklist[0].news_text)
+        with stage("spacy"):
+            scidoc = nlp(tasklist[0].sci_text)
+            newsdoc = nlp(tasklist[0].news_text)
 
         doc_ids = [tasklist[0].newsarticle.id, tasklist[0].scipaper.id]
 
@@ -414,15 +412,17 @@ def export_to_json(tasks: List[Task], output_dir: str, train_split:float, dev_sp
     """Export to JSON format compatible with Arie's coref model"""
 
     # first we generate arrays of words within files
-    nlp = spacy.load('en', disable=['textcat'])
+    with stage("spacy_load"):
+        nlp = get_model(SPACY_EN_SYNTAX)
 
     _next_cluster_id = max([task.id for task in tasks]) + 1
 
-    task_map_items = map_and_sort(tasks)
+    with stage("split"):
+        task_map_items = map_and_sort(tasks)
 
-    # build coref chains
+        # build coref chains
 
-    train_set, dev_set, test_set = test_train_split(task_map_items, train_split, dev_split, seed)
+        train_set, dev_set, test_set = test_train_split(task_map_items, train_split, dev_split, seed)
 
     ext = ".json"
 
@@ -433,21 +433,23 @@ def export_to_json(tasks: List[Task], output_dir: str, train_split:float, dev_sp
         outfile = os.path.join(output_dir, f"{split_name}{ext}")
         entfile = os.path.join(output_dir, f"{split_name}_entities{ext}")
 
-        doc_map, entities = generate_json_maps(items, nlp)
+        with stage("chains"):
+            doc_map, entities = generate_json_maps(items, nlp)
 
-        with open(outfile,"w") as f:
+        with open(outfile,"w") as f, stage("serialize"):
             json.dump(doc_map, f, indent=2)
 
-        with open(entfile, "w") as f:
+        with open(entfile, "w") as f, stage("serialize"):
             json.dump(entities, f, indent=2)
 
-def generate_joshi_jsondocs(task_map_items, tokenizer: BertTokenizerFast, nlp: spacy.language.Language) -> Iterator[dict]:
+def generate_joshi_jsondocs(task_map_items, tokenizer: 'BertTokenizerFast', nlp: 'spacy.language.Language') -> Iterator[dict]:
     """Given a set of task items generate json docs to be serialised"""
 
     for task_id, task_records in tqdm(task_map_items):
 
-        news_doc = nlp(task_records[0].news_text)
-        sci_doc = nlp(task_records[0].sci_text)
+        with stage("spacy"):
+            news_doc = nlp(task_records[0].news_text)
+            sci_doc = nlp(task_records[0].sci_text)
 
         jsondoc = {
             'doc_key': f"nw",
@@ -489,8 +491,11 @@ def generate_joshi_jsondocs(task_map_items, tokenizer: BertTokenizerFast, nlp: s
 def export_to_joshi(tasks: List[Task], output_file: str, train_split:float, dev_split:float, seed:int):
     """Export to JOSHI jsonlines format"""
 
-    nlp = spacy.load('en', disable=['textcat'])
-    tokenizer = BertTokenizerFast.from_pretrained('../joshi_coref/data/spanbert_base')
+    with stage("spacy_load"):
+        nlp = get_model(SPACY_EN_SENTS)
+
+    with stage("tokenizer_load"):
+        tokenizer = get_model(SPANBERT_TOKENIZER)
 
 
     task_map = defaultdict(lambda:[])
@@ -498,9 +503,10 @@ def export_to_joshi(tasks: List[Task], output_file: str, train_split:float, dev_
     for task in tasks:
         task_map[(task.news_article_id, task.sci_paper_id)].append(task)
 
-    task_map_items = map_and_sort(tasks)
+    with stage("split"):
+        task_map_items = map_and_sort(tasks)
 
-    train_set, dev_set, test_set = test_train_split(task_map_items, train_split, dev_split, seed)
+        train_set, dev_set, test_set = test_train_split(task_map_items, train_split, dev_split, seed)
 
     basedir = os.path.dirname(output_file)
     basename = os.path.basename(output_file)
@@ -512,10 +518,12 @@ def export_to_joshi(tasks: List[Task], output_file: str, train_split:float, dev_
 
     for taskset, outname in zip([train_set, dev_set, test_set], [trainname, devname, testname]):
 
-        with open(outname,"w") as f:
+        # subword tokenisation happens as the documents are generated, spacy parsing is counted separately
+        with open(outname,"w") as f, stage("tokenize"):
 
             for jsondoc in generate_joshi_jsondocs(taskset, tokenizer, nlp):                
-                f.write(json.dumps(jsondoc) + "\n")
+                with stage("serialize"):
+                    f.write(json.dumps(jsondoc) + "\n")
 
         #end for task (doc-pair)
     #end with open output_file
\ No newline at end of file
@@ -1,5 +1,6 @@
 import pickle
 import os.path
+import re
 from typing import Optional
 
 from googleapiclient.discovery import build
@@ -22,6 +23,32 @@ SAMPLE_SPREADSHEET_ID = '1crLL2SMWrftJTDdvFedD64BvZJq0zUMgXxru-IGEDwE'
 SAMPLE_RANGE_NAME = 'Class Data!A2:E'
 
 
+A1_RANGE = re.compile(r"^(?P<sheet>.*!)?(?P<start_col>[A-Z]+)(?P<start_row>\d*)(?::(?P<end_col>[A-Z]+)(?P<end_row>\d*))?$")
+
+
+def offset_range(range_name: str, rows: int) -> Optional[str]:
+    """Move the start of an A1 range down by a number of rows
+
+    e.g. offset_range("Tasks!A2:C", 10) gives "Tasks!A12:C". Returns None if
+    the range has a last row and the offset moves past it.
+    """
+
+    m = A1_RANGE.match(range_name)
+
+    if m is None:
+        raise ValueError(f"Can not parse sheet range {range_name}")
+
+    start_row = int(m.group('start_row') or 1) + rows
+    end_row = m.group('end_row')
+
+    if end_row and start_row > int(end_row):
+        return None
+
+    end = f":{m.group('end_col')}{end_row or ''}" if m.group('end_col') else ""
+
+    return f"{m.group('sheet') or ''}{m.group('start_col')}{start_row}{end}"
+
+
 class Spreadsheet(object):
     
     spreadsheet_id: str
@@ -2,39 +2,33 @@ import requests
 import click
 import json
 import datetime
-import spacy
 import re
-import torch
 import hashlib
 import itertools
 import sys
+from typing import Optional
 from lxml import etree
 import numpy as np
 
 from scipy.spatial.distance import cosine
 from cdcrapp import CLIContext
+from cdcrapp.settings import DOC_COVERAGE_SUMMARY
 from cdcrapp.model import Task, NewsArticle, SciPaper
-from transformers import BertModel, BertTokenizerFast
+from cdcrapp.models import get_model, BERT_TOKENIZER, SPACY_EN
+from cdcrapp.encoders import Encoder, backends, encode_windows, get_encoder, set_threads
 
-from spacy.tokens.span import Span
-
-torch.cuda.init()
-
-tokenizer = BertTokenizerFast.from_pretrained('bert-base-uncased')
-model = BertModel.from_pretrained('bert-base-uncased').cuda()
-nlp = spacy.load('en')
 
 def extract_mentions(text: str):
     """Extract named entities and noun phrases"""
 
-    doc = nlp(text)
+    doc = get_model(SPACY_EN)(text)
 
     return list(doc.ents) + list(doc.noun_chunks)
 
 
 def get_tokens_by_offset(start:int,end:int, model_inputs: dict, second_doc=False):
     
-    tokens = tokenizer.convert_ids_to_tokens(model_inputs['input_ids'])
+    tokens = get_model(BERT_TOKENIZER).convert_ids_to_tokens(model_inputs['input_ids'])
 
     found_sep = False
     for i, (tok, bounds) in enumerate(zip(tokens, model_inputs['offset_mapping'])):
@@ -57,24 +51,32 @@ def get_tokens_by_offset(start:int,end:int, model_inputs: dict, second_doc=False
         if s >= start and e <= end:
             yield i,tok
 
-def process_pair(news_summary: str, abstract: str):
+def encode_pair(news_summary: str, abstract: str, encoder: Optional[Encoder] = None, max_length: int = 512,
+    overlap: int = 128) -> (dict, np.ndarray):
+    """Run a news summary and abstract through the encoder together
+
+    Pairs longer than max_length tokens are covered by overlapping windows
+    that are encoded in one batch, see encode_windows. Returns the tokenizer
+    output for the whole pair and the hidden state of each token.
+    """
+
+    return encode_windows(get_model(BERT_TOKENIZER), news_summary, abstract, encoder or get_encoder(),
+        max_length=max_length, overlap=overlap)
+
+def span_vector(state: np.ndarray, model_inputs: dict, start: int, end: int, second_doc=False) -> Optional[np.ndarray]:
+    """Mean hidden state of the tokens between two character offsets, None if they were truncated away"""
+
+    tokens = [i for i, _ in get_tokens_by_offset(start, end, model_inputs, second_doc=second_doc)]
+
+    if len(tokens) < 1:
+        return None
+
+    return np.mean(state[tokens], axis=0)
+
+def process_pair(news_summary: str, abstract: str, encoder: Optional[Encoder] = None):
     """Given a news summary and a sci abstract, find all candidates"""
 
-    model_inputs = tokenizer.encode_plus(text=news_summary, text_pair=abstract, 
-    add_special_tokens=True, 
-    return_offsets_mapping=True,
-    max_length=512,
-    truncation_strategy='only_second')
-
-    # run single pass of BERT with both documents to get attention matrices
-    with torch.no_grad():
-            hidden_state, out = model(
-                input_ids=torch.tensor([model_inputs['input_ids']]).cuda(), 
-                token_type_ids = torch.tensor([model_inputs['token_type_ids']]).cuda(),
-                attention_mask = torch.tensor([model_inputs['attention_mask']]).cuda()
-            )
-
-    state = hidden_state.squeeze()
+    model_inputs, state = encode_pair(news_summary, abstract, encoder)
     
     
     # now find candidate phrases
@@ -84,33 +86,23 @@ def process_pair(news_summary: str, abstract: str):
     ncandidates = []
     for news_cand in news_candidates:
 
-        n_tokens = list(get_tokens_by_offset(news_cand.start_char,news_cand.end_char, model_inputs))
+        n_v = span_vector(state, model_inputs, news_cand.start_char, news_cand.end_char)
 
-        if len(n_tokens) < 1:
+        if n_v is None:
            print(f"[NEWS] No tokens found for {news_cand.text}")
            continue
-        
-        try:
-            n_v = np.mean(np.array([state[i].cpu().numpy() for (i,_) in n_tokens]), axis=0)
-        except Exception as e:
-            print(hidden_state.shape)
-            print(state.cpu().shape)
-            print(n_tokens)
-            print(news_cand.text, news_cand.start_char, news_cand.end_char)
-            raise e
+
         ncandidates.append((news_cand, n_v))
 
     scandidates = []
     for sci_cand in sci_candidates:
         
-        s_tokens = list(get_tokens_by_offset(sci_cand.start_char, sci_cand.end_char, model_inputs, second_doc=True))
+        s_v = span_vector(state, model_inputs, sci_cand.start_char, sci_cand.end_char, second_doc=True)
 
-        if len(s_tokens) < 1:
+        if s_v is None:
             print(f"[SCI] No tokens found for {sci_cand.text}")
             continue
 
-        s_v = np.mean(np.array([state[i].cpu().numpy() for (i,_) in s_tokens]), axis=0)
-
         scandidates.append((sci_cand, s_v))
 
 
@@ -154,10 +146,17 @@ def tidy_abstract(abstract: str) -> str:
 @click.command()
 @click.option("--endpoint", type=str, default="http://localhost:4000/api/newsarticles")
 @click.option("--summarizer_endpoint", type=str, default="http://localhost:8000/")
-def main(endpoint, summarizer_endpoint):
+@click.option("--backend", type=click.Choice(backends()), default=None, help="Encoder backend, defaults to ENCODER_BACKEND or cuda")
+@click.option("--threads", type=int, default=None, help="CPU threads for the cpu, int8 and onnx backends")
+def main(endpoint, summarizer_endpoint, backend, threads):
     """Ingest new tasks from harri core server"""
     
     ctx = CLIContext()
+
+    if threads is not None:
+        set_threads(threads)
+
+    encoder = get_encoder(backend)
     
     r = requests.get(endpoint)
     response = r.json()
@@ -230,7 +229,7 @@ def main(endpoint, summarizer_endpoint):
                 sp_obj = SciPaper(url=paper['doi'], abstract=abstract)
 
                 
-                pairgen = process_pair(summary, abstract)
+                pairgen = process_pair(summary, abstract, encoder)
 
                 for news_cand, sci_cand, sim in pairgen:
                     
@@ -254,7 +253,10 @@ def main(endpoint, summarizer_endpoint):
 
                 if len(new_tasks) > 0:
                     print(f"Add {len(new_tasks)} new tasks to database")
-                    ctx.tasksvc.add_tasks(new_tasks)
+                    news_article_ids = ctx.tasksvc.add_tasks(new_tasks)
+
+                    if DOC_COVERAGE_SUMMARY:
+                        ctx.tasksvc.refresh_doc_coverage(news_article_ids)
 
 
 
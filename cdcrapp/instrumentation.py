@@ -0,0 +1,148 @@
+"""Timing and memory instrumentation used by the exporters, model loading and the benchmarks
+
+stage() blocks cost nothing unless a benchmark is recording them with
+record_stages().
+"""
+
+import cProfile
+import os
+import sys
+import time
+
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# recorder that stage() reports to, only set while a benchmark is recording
+_recorder = None
+
+
+def peak_rss_mb() -> Optional[float]:
+    """Largest resident set size this process has reached so far, None where it can't be measured"""
+
+    if resource is None:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # linux reports kilobytes and macOS bytes
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def current_rss_mb() -> Optional[float]:
+    """Resident set size of this process right now, falling back to the peak where /proc isn't available"""
+
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return peak_rss_mb()
+
+    return pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+
+
+class StageRecorder(object):
+    """Wall time, number of calls and peak RSS of the named stages of a job
+
+    Time is exclusive: while a stage is nested inside another, e.g. spacy
+    parsing inside chain building, only the inner stage is charged for it, so
+    stage times add up to the time spent in recorded stages. With profile set
+    a separate cProfile profile is kept for each stage.
+    """
+
+    def __init__(self, profile: bool = False):
+        self.timings = defaultdict(float)
+        self.calls = Counter()
+        self.peak_rss = {}
+        self.profiles = {} if profile else None
+        self._stack = []
+
+    def _pause(self):
+        name, started = self._stack[-1]
+        self.timings[name] += time.perf_counter() - started
+
+        if self.profiles is not None:
+            self.profiles[name].disable()
+
+    def _resume(self):
+        name, _ = self._stack[-1]
+        self._stack[-1] = (name, time.perf_counter())
+
+        if self.profiles is not None:
+            self.profiles[name].enable()
+
+    def enter(self, name: str):
+        if len(self._stack) > 0:
+            self._pause()
+
+        if self.profiles is not None and name not in self.profiles:
+            self.profiles[name] = cProfile.Profile()
+
+        self.calls[name] += 1
+        self._stack.append((name, None))
+        self._resume()
+
+    def exit(self):
+        self._pause()
+        name, _ = self._stack.pop()
+        self.peak_rss[name] = peak_rss_mb()
+
+        if len(self._stack) > 0:
+            self._resume()
+
+    def results(self) -> Dict[str, dict]:
+        return {name: {"seconds": seconds, "calls": self.calls[name], "peak_rss_mb": self.peak_rss.get(name)}
+            for name, seconds in self.timings.items()}
+
+    def dump_profiles(self, directory: str, prefix: str) -> List[str]:
+        """Write each stage's profile to directory/prefix-stage.prof for snakeviz, flameprof etc."""
+
+        os.makedirs(directory, exist_ok=True)
+        paths = []
+
+        for name, profile in (self.profiles or {}).items():
+            path = os.path.join(directory, f"{prefix}-{name}.prof")
+            profile.dump_stats(path)
+            paths.append(path)
+
+        return paths
+
+
+@contextmanager
+def record_stages(profile: bool = False) -> Iterator[StageRecorder]:
+    """Collect the stage() blocks run inside this block"""
+
+    global _recorder
+
+    previous, _recorder = _recorder, StageRecorder(profile=profile)
+
+    try:
+        yield _recorder
+    finally:
+        _recorder = previous
+
+
+@contextmanager
+def stage(name: str):
+    """Count the time spent inside the block towards a named stage of the job being benchmarked
+
+    Does nothing unless called inside record_stages().
+    """
+
+    recorder = _recorder
+
+    if recorder is None:
+        yield
+        return
+
+    recorder.enter(name)
+
+    try:
+        yield
+    finally:
+        recorder.exit()
@@ -1,8 +1,12 @@
+import hashlib
+import html
+
 from sqlalchemy.ext.declarative import declarative_base
 
-from sqlalchemy.orm import relationship, backref
+from sqlalchemy.orm import relationship, backref, Session
+from sqlalchemy.ext.hybrid import hybrid_property
 
-from sqlalchemy import Column, Integer, String, Text, Boolean, Table, ForeignKey, Float, DateTime
+from sqlalchemy import Column, Integer, String, Text, Boolean, Table, ForeignKey, Float, DateTime, Index, UniqueConstraint, event, and_, or_, func, select, union
 
 from datetime import datetime
 
@@ -46,20 +50,91 @@ class User(Base, UserMixin):
 
     active = Column(Boolean())
     created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
     @property
     def total_annotations(self):
         return UserTask.query.filter(UserTask.user_id==self.id).count()
+
+
+def parse_mention(ent: str) -> tuple:
+    """Split a "text;start;end" mention string into (text, start, end)
+
+    Returns (None, None, None) if the string is not in the expected format.
+    """
+    try:
+        text, start, end = html.unescape(ent).rsplit(";", 2)
+        return text, int(start), int(end)
+    except (AttributeError, TypeError, ValueError):
+        return None, None, None
+
+
+def mention_attribute(side: str, attr: str, legacy: str, settable: bool = False) -> hybrid_property:
+    """Read an attribute of a task's news or sci mention from the shared mentions table
+
+    Tasks that have not been linked to a mention yet fall back to their own legacy
+    column, so both kinds of task can be read while the mentions table is rolled out.
+    Setting a settable attribute writes the legacy column and unlinks the mention so
+    that the task is linked to the right one on the next flush.
+    """
+
+    def fget(self):
+        mention = getattr(self, f"{side}_mention")
+        return getattr(self, legacy) if mention is None else getattr(mention, attr)
+
+    def fset(self, value):
+        setattr(self, legacy, value)
+        setattr(self, f"{side}_mention", None)
+
+    def expr(cls):
+        mention_value = select([getattr(Mention, attr)])\
+            .where(Mention.id==getattr(cls, f"{side}_mention_id")).as_scalar()
+        return func.coalesce(mention_value, getattr(cls, legacy))
+
+    # name the accessors after the attribute so that query columns are labelled sensibly
+    fget.__name__ = fset.__name__ = expr.__name__ = legacy[len("legacy_"):]
+
+    return hybrid_property(fget, fset if settable else None, expr=expr)
+
     
 class Task(Base):
     
     __tablename__ = "tasks"
+    __table_args__ = (
+        Index("ix_tasks_news_mention", "news_article_id", "news_ent_start", "news_ent_end"),
+        Index("ix_tasks_sci_mention", "sci_paper_id", "sci_ent_start", "sci_ent_end"),
+    )
     
     id = Column(Integer, primary_key=True)
     hash = Column(String(64), unique=True)
-    news_ent = Column(String(255))
-    sci_ent = Column(String(255))
+
+    # shared mentions, tasks without them are linked on flush (see _link_task_mentions)
+    news_mention_id = Column(ForeignKey("mentions.id"), index=True)
+    news_mention = relationship("Mention", foreign_keys=[news_mention_id], lazy="joined")
+    sci_mention_id = Column(ForeignKey("mentions.id"), index=True)
+    sci_mention = relationship("Mention", foreign_keys=[sci_mention_id], lazy="joined")
+
+    # legacy per-task copies of the mentions, read only for tasks not linked to a mention
+    legacy_news_ent = Column("news_ent", String(255))
+    legacy_sci_ent = Column("sci_ent", String(255))
+
+    # structured copies of the legacy strings, kept in sync by the listeners below
+    legacy_news_ent_text = Column("news_ent_text", String(255))
+    legacy_news_ent_start = Column("news_ent_start", Integer)
+    legacy_news_ent_end = Column("news_ent_end", Integer)
+    legacy_sci_ent_text = Column("sci_ent_text", String(255))
+    legacy_sci_ent_start = Column("sci_ent_start", Integer)
+    legacy_sci_ent_end = Column("sci_ent_end", Integer)
+
+    news_ent = mention_attribute("news", "ent", "legacy_news_ent", settable=True)
+    news_ent_text = mention_attribute("news", "text", "legacy_news_ent_text")
+    news_ent_start = mention_attribute("news", "start_char", "legacy_news_ent_start")
+    news_ent_end = mention_attribute("news", "end_char", "legacy_news_ent_end")
+    sci_ent = mention_attribute("sci", "ent", "legacy_sci_ent", settable=True)
+    sci_ent_text = mention_attribute("sci", "text", "legacy_sci_ent_text")
+    sci_ent_start = mention_attribute("sci", "start_char", "legacy_sci_ent_start")
+    sci_ent_end = mention_attribute("sci", "end_char", "legacy_sci_ent_end")
+
     similarity = Column(Float)
     # If set can be used in IAA calculations 
     is_iaa = Column(Boolean, default=False)
@@ -74,14 +149,15 @@ class Task(Base):
     is_difficult_user_id = Column(ForeignKey("users.id"))
     is_difficult_reported_at = Column(DateTime, nullable=True)
 
+    # documents are only loaded on request, see TASK_LOAD_PROFILES in cdcrapp.services
     sci_paper_id = Column(ForeignKey("scipapers.id"))
-    scipaper = relationship("SciPaper", lazy="joined")
+    scipaper = relationship("SciPaper")
 
     news_article_id = Column(ForeignKey("newsarticles.id"))
-    newsarticle = relationship("NewsArticle", lazy="joined")
+    newsarticle = relationship("NewsArticle")
     
     created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
     priority = Column(Integer, default=0)
 
@@ -114,13 +190,58 @@ class Task(Base):
 
     @property
     def news_ents(self):
-        base_query = Task.query.filter(Task.news_article_id==self.news_article_id)
-        return list(set([t.news_ent for t in base_query.all()]))
+        return Mention.document_entities(Task.query.session, "news", self.news_article_id)
 
     @property
     def sci_ents(self):
-        base_query = Task.query.filter(Task.sci_paper_id==self.sci_paper_id)
-        return list(set([t.sci_ent for t in base_query.all()]))
+        return Mention.document_entities(Task.query.session, "sci", self.sci_paper_id)
+
+    @classmethod
+    def mention_columns(cls, doc_type: str) -> dict:
+        """Get the mention id and legacy mention columns for 'news' or 'sci' side of tasks"""
+        prefix = "news" if doc_type == "news" else "sci"
+
+        return {
+            "mention_id": getattr(cls, f"{prefix}_mention_id"),
+            "ent": getattr(cls, f"legacy_{prefix}_ent"),
+            "text": getattr(cls, f"legacy_{prefix}_ent_text"),
+            "start": getattr(cls, f"legacy_{prefix}_ent_start"),
+            "end": getattr(cls, f"legacy_{prefix}_ent_end"),
+        }
+
+    @classmethod
+    def mention_values(cls, doc_type: str, ent: str) -> dict:
+        """Generate the legacy column values to store given entity string on 'news' or 'sci' side of tasks"""
+        text, start, end = parse_mention(ent)
+        columns = cls.mention_columns(doc_type)
+
+        return {columns["ent"]: ent, columns["text"]: text, columns["start"]: start, columns["end"]: end}
+
+    @classmethod
+    def legacy_mention_filter(cls, doc_type: str, doc_id: int, ent: str):
+        """Filter criteria for tasks not linked to a mention that store given mention themselves
+
+        Uses the indexed start/end offsets and falls back to string equality for malformed mentions.
+        """
+        columns = cls.mention_columns(doc_type)
+        doc_column = cls.news_article_id if doc_type == "news" else cls.sci_paper_id
+
+        _, start, end = parse_mention(ent)
+
+        if start is None:
+            span = columns["ent"]==ent
+        else:
+            span = and_(columns["start"]==start, columns["end"]==end)
+
+        return and_(columns["mention_id"]==None, doc_column==doc_id, span)
+
+    @classmethod
+    def mention_filter(cls, doc_type: str, doc_id: int, ent: str):
+        """Filter criteria for tasks with given mention in given document"""
+        mention_ids = select([Mention.id]).where(Mention.mention_filter(doc_type, doc_id, ent))
+
+        return or_(cls.mention_columns(doc_type)["mention_id"].in_(mention_ids), 
+            cls.legacy_mention_filter(doc_type, doc_id, ent))
 
     def get_best_answer(self):
         """Use votes to work out which answer is most appropriate"""
@@ -146,12 +267,17 @@ class Task(Base):
 
         return [{"news_ent":ut.task.news_ent, "sci_ent":ut.task.sci_ent, "answer": ut.answer} for ut in q.all()]
 
+def content_hash(text: str) -> str:
+    """Generate a stable hash of document content, used for ETags and client caching"""
+    return hashlib.sha256((text or "").encode("utf8")).hexdigest()
+
 class NewsArticle(Base):
 
     __tablename__ = "newsarticles"
     id = Column(Integer, primary_key=True)
     url = Column(String(255))
     summary = Column(Text)
+    content_hash = Column(String(64))
 
 class SciPaper(Base):
 
@@ -159,11 +285,132 @@ class SciPaper(Base):
     id = Column(Integer, primary_key=True)
     url = Column(String(150))
     abstract = Column(Text)
+    content_hash = Column(String(64))
+
+
+class Mention(Base):
+    """A mention of an entity in a news article or science paper, shared by the tasks that use it"""
+
+    __tablename__ = "mentions"
+    __table_args__ = (
+        UniqueConstraint("news_article_id", "ent", name="uq_mentions_news_article_id_ent"),
+        UniqueConstraint("sci_paper_id", "ent", name="uq_mentions_sci_paper_id_ent"),
+    )
+
+    id = Column(Integer, primary_key=True)
+
+    # exactly one of these is set
+    news_article_id = Column(ForeignKey("newsarticles.id"))
+    newsarticle = relationship("NewsArticle")
+    sci_paper_id = Column(ForeignKey("scipapers.id"))
+    scipaper = relationship("SciPaper")
+
+    # "text;start;end" string used by the API, text and offsets are kept in sync by the listener below
+    ent = Column(String(255))
+    text = Column(String(255))
+    start_char = Column(Integer)
+    end_char = Column(Integer)
+
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    @classmethod
+    def doc_column(cls, doc_type: str):
+        return cls.news_article_id if doc_type == "news" else cls.sci_paper_id
+
+    @classmethod
+    def mention_filter(cls, doc_type: str, doc_id: int, ent: str):
+        """Filter criteria for the mention in given document with the same span as given entity string"""
+        _, start, end = parse_mention(ent)
+
+        if start is None:
+            return and_(cls.doc_column(doc_type)==doc_id, cls.ent==ent)
+
+        return and_(cls.doc_column(doc_type)==doc_id, cls.start_char==start, cls.end_char==end)
+
+    @classmethod
+    def document_entities(cls, session: Session, doc_type: str, doc_id: int) -> list:
+        """List entity strings in a document, including those of tasks not linked to a mention yet"""
+        columns = Task.mention_columns(doc_type)
+        task_doc_column = Task.news_article_id if doc_type == "news" else Task.sci_paper_id
+
+        q = union(
+            select([cls.ent]).where(cls.doc_column(doc_type)==doc_id),
+            select([columns["ent"]]).where(and_(task_doc_column==doc_id, columns["mention_id"]==None))
+        )
+
+        return [ent for (ent,) in session.execute(q) if ent is not None]
+
+
+@event.listens_for(Task.legacy_news_ent, "set")
+def _update_news_mention(target, value, oldvalue, initiator):
+    target.legacy_news_ent_text, target.legacy_news_ent_start, target.legacy_news_ent_end = parse_mention(value)
+
+@event.listens_for(Task.legacy_sci_ent, "set")
+def _update_sci_mention(target, value, oldvalue, initiator):
+    target.legacy_sci_ent_text, target.legacy_sci_ent_start, target.legacy_sci_ent_end = parse_mention(value)
+
+@event.listens_for(Mention.ent, "set")
+def _update_mention_span(target, value, oldvalue, initiator):
+    target.text, target.start_char, target.end_char = parse_mention(value)
+
+@event.listens_for(Session, "before_flush")
+def _link_task_mentions(session, flush_context, instances):
+    """Link new and changed tasks to shared mentions, creating the mentions where needed"""
+
+    mentions = {}
+
+    with session.no_autoflush:
+        for task in list(session.new) + list(session.dirty):
+
+            if not isinstance(task, Task):
+                continue
+
+            for side, doc_attr, doc_id_attr in (("news", "newsarticle", "news_article_id"), ("sci", "scipaper", "sci_paper_id")):
+                ent = getattr(task, f"legacy_{side}_ent")
+
+                if ent is None or getattr(task, f"{side}_mention") is not None:
+                    continue
+
+                # documents created in the same flush don't have an id yet
+                doc = getattr(task, doc_attr)
+                doc_id = doc.id if doc is not None else getattr(task, doc_id_attr)
+                key = (side, doc_id if doc_id is not None else id(doc), ent)
+
+                if key not in mentions:
+                    mention = None
+
+                    if doc_id is not None:
+                        mention = session.query(Mention)\
+                            .filter(Mention.doc_column(side)==doc_id, Mention.ent==ent).one_or_none()
+
+                    if mention is None:
+                        mention = Mention(ent=ent)
+                        if doc is not None:
+                            setattr(mention, doc_attr, doc)
+                        else:
+                            setattr(mention, doc_id_attr, doc_id)
+                        session.add(mention)
+
+                    mentions[key] = mention
+
+                setattr(task, f"{side}_mention", mentions[key])
+
+@event.listens_for(NewsArticle.summary, "set")
+def _update_news_content_hash(target, value, oldvalue, initiator):
+    target.content_hash = content_hash(value)
+
+@event.listens_for(SciPaper.abstract, "set")
+def _update_sci_content_hash(target, value, oldvalue, initiator):
+    target.content_hash = content_hash(value)
 
 
 class UserTask(Base):
     
     __tablename__ = "user_tasks"
+
+    # supports keyset pagination of a user's answer history
+    __table_args__ = (Index("ix_user_tasks_user_id_created_at", "user_id", "created_at", "task_id"),)
     
     user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
     task_id = Column(Integer, ForeignKey("tasks.id"), primary_key=True)
@@ -174,4 +421,53 @@ class UserTask(Base):
     user = relationship("User", backref="usertasks")
     
     created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow)
\ No newline at end of file
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class NewsCoverage(Base):
+    """Materialised per-article annotation coverage, see TaskService.refresh_doc_coverage"""
+
+    __tablename__ = "news_coverage"
+
+    news_article_id = Column(Integer, ForeignKey("newsarticles.id"), primary_key=True)
+    total_tasks = Column(Integer, default=0)
+    completed_tasks = Column(Integer, default=0)
+    complete_percent = Column(Integer, default=0, index=True)
+
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+
+class StatsSnapshot(Base):
+    """Materialised dashboard statistics, see StatisticsService.refresh_snapshot"""
+
+    __tablename__ = "stats_snapshots"
+
+    name = Column(String(64), primary_key=True)
+    data = Column(Text)
+
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+
+class SheetTask(Base):
+    """Local mirror of the task lists kept in google sheets, see SheetMirrorService"""
+
+    __tablename__ = "sheet_tasks"
+
+    id = Column(Integer, primary_key=True)
+    sheet_range = Column(String(255), nullable=False)
+    # position of the row within the range, None until the row has been read back from the sheet
+    row_index = Column(Integer, nullable=True)
+    task_hash = Column(String(64))
+    username = Column(String(255))
+    comment = Column(Text)
+    # False while the row is queued to be appended to the sheet
+    synced = Column(Boolean, default=True)
+    # when a flush claimed the queued row, None while it waits for one
+    flushing_since = Column(DateTime, nullable=True)
+
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_sheet_tasks_range_row", "sheet_range", "row_index"),
+        Index("ix_sheet_tasks_range_hash", "sheet_range", "task_hash"),
+    )
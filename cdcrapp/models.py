@@ -0,0 +1,158 @@
+"""Lazily loaded NLP models shared across the package
+
+Models are registered by name with a function that loads them. Nothing is
+imported or loaded until get_model() first asks for a model, after which the
+same instance is returned to every caller in the process.
+
+spaCy pipelines are registered per set of components so that each caller only
+pays for the components it uses, e.g. token offsets don't need the parser.
+"""
+
+import os
+import threading
+import time
+
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Sequence
+
+from cdcrapp.instrumentation import current_rss_mb
+
+
+class ModelInfo(NamedTuple):
+    name: str
+    load_seconds: float
+    rss_mb: Optional[float]
+
+
+_loaders: Dict[str, Callable[[], Any]] = {}
+_models: Dict[str, Any] = {}
+_info: Dict[str, ModelInfo] = {}
+_lock = threading.Lock()
+
+# every pipe spacy's english models ship with, anything not asked for is disabled
+_SPACY_PIPES = ("tagger", "parser", "ner", "textcat", "entity_ruler", "sentencizer", "merge_noun_chunks",
+    "merge_entities")
+
+BERT_TOKENIZER = "bert-base-uncased/tokenizer"
+BERT_MODEL = "bert-base-uncased"
+ROBERTA_TOKENIZER = "roberta-large/tokenizer"
+ROBERTA_MODEL = "roberta-large"
+SPANBERT_TOKENIZER = "spanbert-base/tokenizer"
+
+# entities and noun chunks for ingest
+SPACY_EN = "spacy/en:tagger,parser,ner"
+# sentences, POS tags and lemmas for the JSON export
+SPACY_EN_SYNTAX = "spacy/en:tagger,parser"
+# sentence boundaries for the joshi export
+SPACY_EN_SENTS = "spacy/en:parser"
+# token offsets only, for compare, analyse and checklist
+SPACY_EN_TOKENS = "spacy/en:tokens"
+
+
+def register_model(name: str):
+    """Register the decorated function as the loader for a named model"""
+
+    def decorator(loader: Callable[[], Any]) -> Callable[[], Any]:
+        _loaders[name] = loader
+        return loader
+
+    return decorator
+
+
+def register_spacy(name: str, package: str, components: Sequence[str]):
+    """Register a spacy pipeline that only runs the given components"""
+
+    def load():
+        import spacy
+
+        return spacy.load(package, disable=[pipe for pipe in _SPACY_PIPES if pipe not in components])
+
+    register_model(name)(load)
+
+
+def get_model(name: str) -> Any:
+    """Get a model by name, loading it on first use"""
+
+    if name not in _loaders:
+        raise ValueError(f"Unknown model {name}, expected one of {','.join(_loaders)}")
+
+    if name not in _models:
+        with _lock:
+            # another thread may have loaded it while we waited
+            if name not in _models:
+                rss = current_rss_mb()
+                start = time.perf_counter()
+                model = _loaders[name]()
+                after = current_rss_mb()
+
+                _info[name] = ModelInfo(name, time.perf_counter() - start,
+                    after - rss if rss is not None and after is not None else None)
+                _models[name] = model
+
+    return _models[name]
+
+
+def registered_models() -> List[str]:
+    """Names of every model that can be loaded"""
+
+    return list(_loaders)
+
+
+def loaded_models() -> List[str]:
+    """Names of the models loaded so far in this process"""
+
+    return list(_models)
+
+
+def model_info() -> List[ModelInfo]:
+    """Load time and resident memory added by each model loaded so far
+
+    Memory is the growth in RSS while the model loaded, so the first model
+    from a library is also charged for importing it.
+    """
+
+    return list(_info.values())
+
+
+@register_model(BERT_TOKENIZER)
+def _load_bert_tokenizer():
+    from transformers import BertTokenizerFast
+
+    return BertTokenizerFast.from_pretrained('bert-base-uncased')
+
+
+@register_model(BERT_MODEL)
+def _load_bert_model():
+    import torch
+    from transformers import BertModel
+
+    torch.cuda.init()
+
+    return BertModel.from_pretrained('bert-base-uncased').cuda()
+
+
+@register_model(ROBERTA_TOKENIZER)
+def _load_roberta_tokenizer():
+    from transformers import RobertaTokenizerFast
+
+    return RobertaTokenizerFast.from_pretrained("roberta-large")
+
+
+@register_model(ROBERTA_MODEL)
+def _load_roberta_model():
+    import torch
+    from transformers import RobertaModel
+
+    return RobertaModel.from_pretrained("roberta-large").to(torch.device('cuda:0'))
+
+
+@register_model(SPANBERT_TOKENIZER)
+def _load_spanbert_tokenizer():
+    from transformers import BertTokenizerFast
+
+    return BertTokenizerFast.from_pretrained(os.environ.get("SPANBERT_PATH", "../joshi_coref/data/spanbert_base"))
+
+
+register_spacy(SPACY_EN, "en", ["tagger", "parser", "ner"])
+register_spacy(SPACY_EN_SYNTAX, "en", ["tagger", "parser"])
+register_spacy(SPACY_EN_SENTS, "en", ["parser"])
+register_spacy(SPACY_EN_TOKENS, "en", [])
@@ -1,6 +1,7 @@
 # %%
 from dotenv import load_dotenv
 from collections import Counter
+from itertools import groupby
 from matplotlib import pyplot as plt
 
 from sqlalchemy import create_engine
@@ -29,20 +30,14 @@ _tasksvc : TaskService = TaskService(_engine)
 # %%
 def get_task_sims():
 
-    annotated = _tasksvc.get_annotated_tasks()
+    # stream answers grouped by task rather than loading every annotated task
+    answers = _tasksvc.iter(UserTask, columns=[Task.id, Task.similarity, UserTask.answer],
+        joins=[UserTask.task], filters=[Task.similarity != None], orderby=[Task.id])
 
     sims = []
-    for task in annotated:
-
-        if task.similarity == None:
-            continue
-        
-        if len(task.usertasks) == 1:
-            sims.append((task.similarity, task.usertasks[0].answer))
-        else:
-            answers = Counter([ut.answer for ut in task.usertasks])
-
-            sims.append((task.similarity, answers.most_common(1)[0][0]))
+    for (_, similarity), rows in groupby(answers, key=lambda row: row[:2]):
+        votes = Counter([answer for _, _, answer in rows])
+        sims.append((similarity, votes.most_common(1)[0][0]))
 
     return sims
 
@@ -1,22 +1,58 @@
+import json
 import random
+import threading
 import numpy as np
 from sqlalchemy.engine import Engine
-from sqlalchemy.orm import sessionmaker, Session
-from typing import List, Optional, ContextManager
-from cdcrapp.model import User, Task, UserTask, NewsArticle, SciPaper, Base as ModelBase
+from sqlalchemy.orm import sessionmaker, Session, Query
+from typing import List, Optional, ContextManager, Iterable, Iterator, Tuple, Dict
+from cdcrapp.model import User, Task, UserTask, NewsArticle, SciPaper, NewsCoverage, Mention, StatsSnapshot, SheetTask, Base as ModelBase
 
 from collections import defaultdict, Counter
 
 from sklearn.metrics import cohen_kappa_score
-from itertools import combinations
+from itertools import combinations, islice
 
 from crypt import crypt, mksalt, METHOD_SHA512
 from contextlib import contextmanager
-from sqlalchemy import func
-from sqlalchemy.orm import joinedload
+from datetime import datetime, timedelta
+from sqlalchemy import func, case, cast, or_, and_, desc, literal, select, exists, Table, Column, Integer, BigInteger, MetaData
+from sqlalchemy.orm import joinedload, lazyload, selectinload
 
 from cdcrapp.kappa import fleiss_kappa
 
+
+# named sets of loader options for Task queries, only the annotation page and exporters need document bodies
+TASK_LOAD_PROFILES = {
+    "light": [lazyload(Task.newsarticle), lazyload(Task.scipaper)],
+    "with_doc_info": [joinedload(Task.newsarticle).load_only("id", "url", "content_hash"),
+        joinedload(Task.scipaper).load_only("id", "url", "content_hash")],
+    "with_docs": [joinedload(Task.newsarticle), joinedload(Task.scipaper)],
+    "with_answers": [lazyload(Task.newsarticle), lazyload(Task.scipaper), selectinload("usertasks")],
+}
+
+def task_load_options(profile: str) -> list:
+    """Get loader options for a named Task load profile"""
+
+    if profile not in TASK_LOAD_PROFILES:
+        raise ValueError(f"Unknown load profile {profile}, expected one of {','.join(TASK_LOAD_PROFILES)}")
+
+    return TASK_LOAD_PROFILES[profile]
+
+def similarity_bucket(dialect: str, column, low: float, high: float, buckets: int):
+    """SQL expression for the equal width bucket (0 to buckets-1) a value falls in
+
+    Values below low or above high are clamped into the first and last bucket.
+    """
+
+    if dialect == 'postgresql':
+        return func.greatest(func.least(func.width_bucket(column, low, high, buckets), buckets), 1) - 1
+
+    scaled = (column - low) * buckets / (high - low)
+    # CAST rounds on some databases and truncates on others so step back when it rounded up
+    floor = cast(scaled, Integer) - case([(cast(scaled, Integer) > scaled, 1)], else_=0)
+
+    return case([(column < low, 0), (column >= high, buckets - 1)], else_=floor)
+
 class DBServiceBase(object):
     engine: Engine
     Session: sessionmaker
@@ -33,40 +69,109 @@ class DBServiceBase(object):
             yield session
             session.close()
     
-    @contextmanager
     def update(self, obj: ModelBase) -> ModelBase:
         """Commit changes to a database object"""
         with self.session() as session:
             session.add(obj)
             session.commit()
 
-    def list(self, objtype: ModelBase, filters={}, limit:int=None, joins=[], offset:int=None, orderby=None) -> List[ModelBase]:
-        """List all items of given type"""
+    def _build_query(self, session: Session, objtype: ModelBase, filters={}, joins=[], orderby=None, profile:str=None, columns=None) -> Query:
+        """Build a query for list/iter, columns gives a projection instead of full objects"""
 
-        with self.session() as session:
+        if columns is not None:
+            q = session.query(*columns).select_from(objtype)
+        else:
             q = session.query(objtype)
+
+            if profile is not None:
+                q = q.options(*task_load_options(profile))
+
+        for join in joins:
+            q = q.join(join)
+
+        if len(filters) > 0:
+            if isinstance(filters, dict):
+                q = q.filter_by(**filters)
+            elif isinstance(filters, list):
+                q = q.filter(*filters)
+
+        if orderby is not None:
+            q = q.order_by(*orderby) if isinstance(orderby, (list, tuple)) else q.order_by(orderby)
+
+        return q
+
+    def list(self, objtype: ModelBase, filters={}, limit:int=None, joins=[], offset:int=None, orderby=None, profile:str=None) -> List[ModelBase]:
+        """List all items of given type, tasks can be loaded with a named load profile"""
+
+        with self.session() as session:
+            q = self._build_query(session, objtype, filters=filters, joins=joins, orderby=orderby, profile=profile)
+
             if limit is not None:
                 q = q.limit(limit)
                 
             if offset is not None:
-                q = q.offset(limit)
+                q = q.offset(offset)
         
-            if orderby != None:
-                q = q.order_by(**orderby)
+            return q.all()
 
-            if len(filters) > 0:
-                if isinstance(filters, dict):
-                    q = q.filter_by(**filters)
-                elif isinstance(filters, list):
-                    q = q.filter(*filters)
+    def iter(self, objtype: ModelBase, filters={}, joins=[], orderby=None, profile:str=None, columns=None,
+        batch_size:int=1000, keyset=None, after=None) -> Iterator:
+        """Stream items of given type without loading the whole table
 
-            for join in joins:
-                q = q.join(join)
-        
-            return q.all()
+        The session stays open until iteration finishes so lazy relationships
+        still work on the yielded objects. Pass columns to yield row tuples
+        instead of objects. By default rows come from a single server side
+        cursor (yield_per). With keyset set to an ordered unique column, rows
+        are instead fetched in batches of batch_size with `keyset > last value`,
+        starting after `after`, so no long running cursor is held open.
+        """
 
+        with self.session() as session:
+            q = self._build_query(session, objtype, filters=filters, joins=joins, orderby=orderby, profile=profile, columns=columns)
+
+            if keyset is None:
+                yield from q.yield_per(batch_size)
+                return
+
+            if orderby is not None:
+                raise ValueError("orderby can not be combined with keyset pagination, rows are ordered by the keyset column")
+
+            if columns is not None:
+                if not any(col is keyset for col in columns):
+                    raise ValueError(f"keyset column {keyset} must be one of the selected columns")
+                key_index = next(i for i, col in enumerate(columns) if col is keyset)
+                get_key = lambda row: row[key_index]
+            else:
+                get_key = lambda obj: getattr(obj, keyset.key)
+
+            q = q.order_by(keyset)
+
+            while True:
+                page = q.filter(keyset > after) if after is not None else q
+                rows = page.limit(batch_size).all()
+
+                yield from rows
+
+                if len(rows) < batch_size:
+                    return
+
+                after = get_key(rows[-1])
+
+    def estimate_count(self, q: Query) -> int:
+        """Estimate the number of rows a query returns
+
+        On postgres this uses the query planner's row estimate which avoids
+        scanning the table. Other databases fall back to an exact count.
+        """
+
+        if q.session.get_bind().dialect.name != 'postgresql':
+            return q.count()
+
+        stmt = q.statement.compile(q.session.get_bind(), compile_kwargs={"literal_binds": True})
+        plan = q.session.execute(f"EXPLAIN (FORMAT JSON) {stmt}").scalar()
+
+        return int(plan[0]['Plan']['Plan Rows'])
 
-        
     def get_by_filter(self, objtype, **kwargs):
         """Get a database record by type using filters"""
         
@@ -123,6 +228,82 @@ class UserService(DBServiceBase):
             session.commit()
     
     
+    def import_answers(self, user: User, work: Iterable[dict], chunk_size: int = 1000, 
+        dry_run: bool = False) -> Tuple[Counter, List[int]]:
+        """Import a stream of legacy {hash, label, iaa} records as answers for given user
+
+        Hashes are resolved a chunk at a time and each chunk is written with one batch
+        insert of answers and one update per task flag. Tasks the user has already
+        answered are skipped. Returns counts of what was (or with dry_run, would be) done
+        and the ids of the news articles whose tasks were answered or marked bad.
+        """
+
+        stats = Counter()
+        news_article_ids = set()
+        work = iter(work)
+
+        with self.session() as session:
+
+            answered = set()
+
+            while True:
+                chunk = list(islice(work, chunk_size))
+
+                if len(chunk) < 1:
+                    break
+
+                stats['lines'] += len(chunk)
+
+                tasks = session.query(Task.hash, Task.id, Task.news_article_id)\
+                    .filter(Task.hash.in_({item['hash'] for item in chunk})).all()
+
+                task_ids = {task_hash: task_id for task_hash, task_id, _ in tasks}
+                task_news_ids = {task_id: news_id for _, task_id, news_id in tasks}
+
+                answered.update(task_id for (task_id,) in session.query(UserTask.task_id)\
+                    .filter(UserTask.user_id==user.id, UserTask.task_id.in_(task_ids.values())))
+
+                answers, bad, iaa = {}, set(), set()
+
+                for item in chunk:
+                    task_id = task_ids.get(item['hash'])
+
+                    if task_id is None:
+                        stats['missing'] += 1
+                    elif item['label'] == "invalid":
+                        bad.add(task_id)
+                    elif task_id in answered or task_id in answers:
+                        stats['already_answered'] += 1
+                    else:
+                        answers[task_id] = item['label']
+
+                        if item.get('iaa', False):
+                            iaa.add(task_id)
+
+                stats['answers'] += len(answers)
+                stats['bad'] += len(bad)
+                stats['iaa'] += len(iaa)
+                answered.update(answers)
+                news_article_ids.update(task_news_ids[task_id] for task_id in set(answers) | bad)
+
+                if dry_run:
+                    continue
+
+                if len(answers) > 0:
+                    session.execute(UserTask.__table__.insert(), 
+                        [{"user_id": user.id, "task_id": task_id, "answer": answer} for task_id, answer in answers.items()])
+
+                if len(bad) > 0:
+                    session.query(Task).filter(Task.id.in_(bad)).update({Task.is_bad: True}, synchronize_session=False)
+
+                if len(iaa) > 0:
+                    session.query(Task).filter(Task.id.in_(iaa)).update({Task.is_iaa: True}, synchronize_session=False)
+
+            if not dry_run:
+                session.commit()
+
+        return stats, sorted(id for id in news_article_ids if id is not None)
+
     def get_all_user_progress(self) -> List[tuple]:
         
         # session: Session 
@@ -257,33 +438,78 @@ class UserService(DBServiceBase):
             y_b = [ut.answer for ut in userB_answers if ut.task_id in intersection]
         
         return cohen_kappa_score(y_a, y_b)
+
+    def get_all_pairwise_iaa(self, usernames: List[str], min_shared: int = 2) -> Dict[str, Optional[float]]:
+        """Cohen's kappa for every pair of users from a single query of IAA answers
+
+        Keys are the two usernames sorted and joined with a comma. Pairs that
+        share fewer than min_shared IAA tasks, or where kappa is undefined
+        because only one answer was ever given, get None.
+        """
+
+        with self.session() as session:
+            q = session.query(User.username, UserTask.task_id, UserTask.answer)\
+                .join(UserTask.user)\
+                .join(UserTask.task)\
+                .filter(Task.is_iaa == True)
+
+            answers = defaultdict(dict)
+
+            for username, task_id, answer in q.all():
+                answers[username][task_id] = answer
+
+        results = {}
+
+        for a, b in combinations(sorted(usernames), 2):
+            shared = sorted(set(answers[a]).intersection(answers[b]))
+            kappa = None
+
+            if len(shared) >= min_shared:
+                kappa = cohen_kappa_score([answers[a][t] for t in shared], [answers[b][t] for t in shared])
+                kappa = None if np.isnan(kappa) else float(kappa)
+
+            results[f"{a},{b}"] = kappa
+
+        return results
                     
                 
  
 
 class TaskService(DBServiceBase):
     
-    def add_tasks(self, tasks: List[Task]):
-        """Bulk import tasks from external source"""
+    def add_tasks(self, tasks: List[Task]) -> List[int]:
+        """Bulk import tasks from external source, returns the ids of the news articles they belong to"""
         
         with self.session() as session:
             session.add_all(tasks)
+            session.flush()
+
+            news_article_ids = sorted({task.news_article_id for task in tasks if task.news_article_id is not None})
             session.commit()
+
+        return news_article_ids
         
 
-    def get_by_hash(self, hash:str, allow_wildcard: Optional[bool]=False) -> Optional[Task]:
+    def query_tasks(self, session: Session, profile: str = "light") -> Query:
+        """Start a Task query that loads tasks with given load profile"""
+        return session.query(Task).options(*task_load_options(profile))
+
+    def get_by_hash(self, hash:str, allow_wildcard: Optional[bool]=False, profile: str = "with_docs") -> Optional[Task]:
         """Get task by hash"""
 
         with self.session() as session:
             if allow_wildcard:
-                q = session.query(Task).filter(Task.hash.ilike(f"{hash}%"))
+                q = self.query_tasks(session, profile).filter(Task.hash.ilike(f"{hash}%"))
             else:
-                q = session.query(Task).filter(Task.hash==hash)
+                q = self.query_tasks(session, profile).filter(Task.hash==hash)
             
             return q.one_or_none()
 
     def remove_tasks_by_doc_ids(self, news_article_id, sci_paper_id):
-        """Bulk remove tasks that tie together a particular pair of documents (erroneously)"""
+        """Bulk remove tasks that tie together a particular pair of documents (erroneously)
+
+        Callers keeping the news_coverage summary should refresh news_article_id afterwards.
+        """
 
         with self.session() as session:
 
@@ -294,7 +520,7 @@ class TaskService(DBServiceBase):
 
             return session.query(Task).filter_by(news_article_id=news_article_id, sci_paper_id=sci_paper_id).delete()
     
-    def next_tasks_for_user(self, user: User) -> Task:
+    def next_tasks_for_user(self, user: User, profile: str = "with_docs") -> Task:
         """List tasks that a given user has not yet completed"""
         
         with self.session() as session:
@@ -306,7 +532,7 @@ class TaskService(DBServiceBase):
             # list of task ids completed by other users excluding those in the current IAA priority list
             completed = session.query(Task.id).join(UserTask).filter(~Task.is_iaa_priority)
 
-            return (session.query(Task).filter(
+            return (self.query_tasks(session, profile).filter(
                 ~Task.id.in_(substmt), 
                 ~Task.id.in_(completed),
                 ~Task.is_bad)
@@ -316,44 +542,248 @@ class TaskService(DBServiceBase):
                     Task.similarity.desc()
                     )).first()
 
-    def get_task_doc_coverage(self, min_coverage=0):
-        """Get document coverage for tasks"""
+    def _doc_coverage_query(self, session: Session, min_coverage=None, news_article_ids=None):
+        """Build a single grouped query that yields coverage stats per news article
+
+        Only articles with at least one answered task are included. Rows are
+        (news_id, news_total, news_complete, complete_percent).
+        """
+
+        answered = session.query(UserTask.task_id).distinct().subquery()
+
+        completed = func.count(answered.c.task_id)
+        total = func.sum(case([(or_(Task.is_bad == None, Task.is_bad == False), 1)], else_=0))
+        percent = completed * 100 / func.nullif(total, 0)
+
+        q = session.query(Task.news_article_id.label('news_id'),
+                          total.label('news_total'),
+                          completed.label('news_complete'),
+                          percent.label('complete_percent'))\
+            .outerjoin(answered, answered.c.task_id == Task.id)\
+            .filter(Task.news_article_id != None)\
+            .group_by(Task.news_article_id)\
+            .having(completed > 0)
+
+        if news_article_ids is not None:
+            q = q.filter(Task.news_article_id.in_(news_article_ids))
+
+        if min_coverage is not None:
+            q = q.having(percent >= min_coverage)
+
+        return q
+
+    def _doc_coverage_summary_query(self, session: Session, min_coverage=None):
+        """Read coverage stats from the materialised news_coverage table"""
+
+        q = session.query(NewsCoverage.news_article_id.label('news_id'),
+                          NewsCoverage.total_tasks.label('news_total'),
+                          NewsCoverage.completed_tasks.label('news_complete'),
+                          NewsCoverage.complete_percent.label('complete_percent'))\
+            .filter(NewsCoverage.completed_tasks > 0)
+
+        if min_coverage is not None:
+            q = q.filter(NewsCoverage.complete_percent >= min_coverage)
+
+        return q
+
+    def get_task_doc_coverage(self, min_coverage=0, use_summary=False):
+        """Get document coverage for tasks
+
+        If use_summary is set, read from the news_coverage table maintained by
+        refresh_doc_coverage rather than aggregating over all tasks.
+        """
+
+        with self.session() as session:
+
+            if use_summary:
+                q = self._doc_coverage_summary_query(session, min_coverage=min_coverage)
+            else:
+                q = self._doc_coverage_query(session, min_coverage=min_coverage)
+
+            for row in q.order_by(desc('complete_percent')).all():
+                yield row._asdict()
+
+    def refresh_doc_coverage(self, news_article_ids: Optional[List[int]] = None):
+        """Recalculate the news_coverage summary for given articles (or all articles if None)
+
+        Rows are upserted so that two answers to the same article recorded at
+        the same time can't both try to insert its row.
+        """
 
-        from sqlalchemy import text
+        table = NewsCoverage.__table__
+        columns = [table.c.news_article_id, table.c.total_tasks, table.c.completed_tasks, table.c.complete_percent,
+            table.c.updated_at]
+
+        with self.session() as session:
+
+            coverage = self._doc_coverage_query(session, news_article_ids=news_article_ids)
+            dialect = session.get_bind().dialect.name
+
+            select_q = coverage.add_columns(literal(datetime.utcnow())).statement
+
+            if dialect == "postgresql":
+                from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+                stmt = pg_insert(table).from_select(columns, select_q)
+                stmt = stmt.on_conflict_do_update(index_elements=[table.c.news_article_id],
+                    set_={column.name: stmt.excluded[column.name] for column in columns[1:]})
+            elif dialect == "mysql":
+                from sqlalchemy.dialects.mysql import insert as mysql_insert
+
+                stmt = mysql_insert(table).from_select(columns, select_q)
+                stmt = stmt.on_duplicate_key_update({column.name: stmt.inserted[column.name] for column in columns[1:]})
+            else:
+                stmt = table.insert().prefix_with("OR REPLACE", dialect="sqlite").from_select(columns, select_q)
+
+            session.execute(stmt)
+
+            # articles with no answered tasks left drop out of the summary
+            stale_q = session.query(NewsCoverage)\
+                .filter(~NewsCoverage.news_article_id.in_(coverage.with_entities(Task.news_article_id)))
+
+            if news_article_ids is not None:
+                stale_q = stale_q.filter(NewsCoverage.news_article_id.in_(news_article_ids))
+
+            stale_q.delete(synchronize_session=False)
+            session.commit()
+
+    def link_mentions(self) -> int:
+        """Link tasks that still store their own mentions to the shared mentions table
+
+        Creates any mentions that don't exist yet. Returns the number of tasks linked.
+        """
+
+        linked = 0
+
+        with self.session() as session:
+
+            for side in ("news", "sci"):
+                columns = Task.mention_columns(side)
+                task_doc_column = Task.news_article_id if side == "news" else Task.sci_paper_id
+                unlinked = and_(columns["mention_id"]==None, columns["ent"]!=None)
+
+                same_mention = and_(Mention.doc_column(side)==task_doc_column, Mention.ent==columns["ent"])
+                now = literal(datetime.utcnow())
+
+                missing = session.query(task_doc_column, columns["ent"], func.min(columns["text"]),
+                        func.min(columns["start"]), func.min(columns["end"]), now, now)\
+                    .filter(unlinked, ~exists().where(same_mention))\
+                    .group_by(task_doc_column, columns["ent"])
+
+                session.execute(Mention.__table__.insert().from_select([
+                    Mention.doc_column(side),
+                    Mention.ent,
+                    Mention.text,
+                    Mention.start_char,
+                    Mention.end_char,
+                    Mention.created_at,
+                    Mention.updated_at], missing.statement))
+
+                mention_id = select([Mention.id]).where(same_mention).limit(1).as_scalar()
+
+                linked += session.query(Task).filter(unlinked)\
+                    .update({columns["mention_id"]: mention_id}, synchronize_session=False)
+
+            session.commit()
+
+        return linked
+
+    def tidy_duplicate_tasks(self, dry_run: bool = False, refresh_coverage: bool = False) -> dict:
+        """Merge tasks that pair up the same two mentions into one surviving task
+
+        Duplicates are ranked in SQL with IAA tasks first and then the most recently created,
+        answers on the losers are moved to the top ranked task (dropping any that would give
+        a user two answers for it) and the losers are deleted, all in one transaction.
+        Returns counts of what was (or with dry_run, would be) changed. If refresh_coverage
+        is set the news_coverage summary of the affected articles is recalculated afterwards.
+        """
+
+        # duplicates are keyed by mention so link any stragglers first, a dry run can't do that
+        # and won't see duplicates between a linked and an unlinked task
+        if not dry_run:
+            self.link_mentions()
+
+        metadata = MetaData()
+
+        duplicates = Table("tmp_duplicate_tasks", metadata,
+            Column("task_id", Integer, primary_key=True),
+            Column("survivor_id", Integer, index=True),
+            prefixes=["TEMPORARY"])
+
+        dropped = Table("tmp_duplicate_answers", metadata,
+            Column("user_id", Integer, primary_key=True),
+            Column("task_id", Integer, primary_key=True),
+            prefixes=["TEMPORARY"])
 
         with self.session() as session:
 
             conn = session.connection()
+            metadata.create_all(conn)
 
-            conn.execute("""DROP TABLE IF EXISTS news_complete""")
-            conn.execute("""DROP TABLE IF EXISTS news_total""")
-
-            conn.execute("""CREATE TEMP TABLE news_complete AS 
-            SELECT newsarticles.id as news_id, count(newsarticles.id) as completed_tasks 
-            FROM newsarticles LEFT JOIN tasks ON newsarticles.id=tasks.news_article_id  
-            WHERE tasks.id in (SELECT DISTINCT user_tasks.task_id from user_tasks)
-            GROUP BY newsarticles.id;""")
-
-            conn.execute("""CREATE TEMP TABLE news_total AS 
-            SELECT newsarticles.id as news_id, count(newsarticles.id) as total_tasks FROM newsarticles 
-            LEFT JOIN tasks ON newsarticles.id=tasks.news_article_id 
-            WHERE (tasks.is_bad is null or tasks.is_bad = false)
-            GROUP BY newsarticles.id;""")
-
-            result = conn.execute(text("""SELECT news_complete.news_id, 
-                                       news_total.total_tasks, 
-                                       news_complete.completed_tasks, 
-                                       (SELECT news_complete.completed_tasks * 100 / news_total.total_tasks ) as complete_percent 
-                        FROM news_complete LEFT JOIN news_total ON news_complete.news_id=news_total.news_id
-                        ORDER BY complete_percent DESC;"""), min=min_coverage)
-
-            columns = ['news_id','news_total','news_complete','complete_percent']
-            for r in result.fetchall():
-                row = {key:value for value,key in zip(r,columns)}
-                if row['complete_percent'] >= min_coverage:
-                    yield row
-        
-    def get_annotated_tasks(self, limit:Optional[int]=None, offset:Optional[int]=None, exclude_users=[], min_coverage=None) -> List[Task]:
+            group = [Task.news_article_id, Task.sci_paper_id, Task.news_mention_id, Task.sci_mention_id,
+                case([(Task.news_mention_id==None, Task.legacy_news_ent)]),
+                case([(Task.sci_mention_id==None, Task.legacy_sci_ent)])]
+            ranking = [Task.is_iaa.desc().nullslast(), Task.created_at.desc().nullslast(), Task.id.desc()]
+
+            ranked = session.query(Task.id.label("task_id"),
+                    func.first_value(Task.id).over(partition_by=group, order_by=ranking).label("survivor_id"),
+                    func.count(Task.id).over(partition_by=group).label("total"))\
+                .subquery()
+
+            conn.execute(duplicates.insert().from_select(["task_id", "survivor_id"],
+                select([ranked.c.task_id, ranked.c.survivor_id]).where(ranked.c.total > 1)))
+
+            # a user can only answer the survivor once, keep their answer to it or failing that the newest one
+            answer_rank = func.row_number().over(
+                partition_by=[UserTask.user_id, duplicates.c.survivor_id],
+                order_by=[case([(UserTask.task_id==duplicates.c.survivor_id, 0)], else_=1), 
+                    UserTask.created_at.desc().nullslast()])
+
+            ranked_answers = select([UserTask.user_id, UserTask.task_id, answer_rank.label("rank")])\
+                .select_from(UserTask.__table__.join(duplicates, UserTask.task_id==duplicates.c.task_id))\
+                .alias()
+
+            conn.execute(dropped.insert().from_select(["user_id", "task_id"],
+                select([ranked_answers.c.user_id, ranked_answers.c.task_id]).where(ranked_answers.c.rank > 1)))
+
+            losers = select([duplicates.c.task_id]).where(duplicates.c.task_id!=duplicates.c.survivor_id)
+
+            stats = {
+                "groups": conn.execute(select([func.count(duplicates.c.survivor_id.distinct())])).scalar(),
+                "removed_tasks": conn.execute(select([func.count()]).select_from(losers.alias())).scalar(),
+                "dropped_answers": conn.execute(select([func.count()]).select_from(dropped)).scalar(),
+                "moved_answers": session.query(UserTask).filter(UserTask.task_id.in_(losers)).count(),
+            }
+
+            stats["moved_answers"] -= stats["dropped_answers"]
+
+            # every task in a group belongs to the same article so the survivors cover the losers too
+            news_article_ids = [id for (id,) in session.query(Task.news_article_id.distinct())\
+                .filter(Task.id.in_(select([duplicates.c.survivor_id])), Task.news_article_id != None)]
+
+            if not dry_run:
+                session.query(UserTask).filter(exists().where(and_(
+                        dropped.c.user_id==UserTask.user_id, 
+                        dropped.c.task_id==UserTask.task_id)))\
+                    .delete(synchronize_session=False)
+
+                survivor = select([duplicates.c.survivor_id]).where(duplicates.c.task_id==UserTask.task_id).as_scalar()
+
+                session.query(UserTask).filter(UserTask.task_id.in_(losers))\
+                    .update({UserTask.task_id: survivor}, synchronize_session=False)
+
+                session.query(Task).filter(Task.id.in_(losers)).delete(synchronize_session=False)
+
+            metadata.drop_all(conn)
+            session.commit()
+
+        if refresh_coverage and not dry_run and len(news_article_ids) > 0:
+            self.refresh_doc_coverage(news_article_ids)
+
+        return stats
+
+    def get_annotated_tasks(self, limit:Optional[int]=None, offset:Optional[int]=None, exclude_users=[], min_coverage=None, use_summary=False,
+        profile: str = "with_docs") -> List[Task]:
         """Select tasks that have been annotate by at least 1 user"""
 
         with self.session() as session:
@@ -362,12 +792,17 @@ class TaskService(DBServiceBase):
 
 
             ut_task_ids = session.query(UserTask.task_id).distinct().filter(~UserTask.user_id.in_(exclude_users))
-            q = session.query(Task).filter(Task.id.in_(ut_task_ids)).join(NewsArticle).join(SciPaper).join(UserTask)
+            q = self.query_tasks(session, profile).filter(Task.id.in_(ut_task_ids)).join(NewsArticle).join(SciPaper).join(UserTask)
 
 
             if min_coverage is not None:
-                covered_ids = [c['news_id'] for c in self.get_task_doc_coverage(min_coverage=min_coverage)] 
-                q = q.filter(Task.news_article_id.in_(covered_ids))
+                if use_summary:
+                    covered = self._doc_coverage_summary_query(session, min_coverage=min_coverage)
+                else:
+                    covered = self._doc_coverage_query(session, min_coverage=min_coverage)
+
+                covered = covered.subquery()
+                q = q.filter(Task.news_article_id.in_(session.query(covered.c.news_id)))
 
             if limit is not None:
                 q = q.limit(limit)
@@ -389,7 +824,7 @@ class TaskService(DBServiceBase):
         with self.session() as session:
             
 
-            q = session.query(Task).filter(~Task.is_bad, Task.similarity != None)
+            q = session.query(Task.similarity).filter(~Task.is_bad, Task.similarity != None)
             
             if only_difficult:
                 q = q.filter(Task.is_difficult==True)
@@ -398,30 +833,378 @@ class TaskService(DBServiceBase):
                 subq = session.query(UserTask.task_id.distinct())
                 q = q.filter(Task.id.in_(subq))
 
-            return np.array([t.similarity for t in q.all()])
+            return np.array([similarity for (similarity,) in q.all()])
+
+    def rebalance_iaa(self, max_priority_tasks: int = 150, seed: Optional[int] = None, buckets: Optional[int] = None) -> dict:
+        """Rebalance IAA tasks
+
+        Picks a random sample of IAA tasks to prioritise without loading them. Given a number of
+        similarity buckets the sample is spread evenly across them. The sample is decided by the
+        seed, pass the same seed again to get the same sample.
+        """
+
+        if seed is None:
+            seed = random.randrange(2**31)
 
-    def rebalance_iaa(self, max_priority_tasks: int = 150):
-        """Rebalance IAA tasks"""
+        # a seeded hash of the task id stands in for a random number, SQLite can't seed random()
+        rng = random.Random(seed)
+        modulus = 2**31 - 1
+        mixed = (cast(Task.id, BigInteger) * rng.randrange(1, modulus) + rng.randrange(modulus)) % modulus
+        sample_key = (mixed * mixed + rng.randrange(modulus)) % modulus
 
         with self.session() as session:
 
-            iaa_tasks = session.query(Task).filter(Task.is_iaa).all()
-            priority_tasks = session.query(Task).filter(Task.is_iaa_priority).all()
+            stats = {
+                "seed": seed,
+                "iaa": session.query(Task).filter(Task.is_iaa==True).count(),
+                "previous_priority": session.query(Task).filter(Task.is_iaa_priority==True).count(),
+            }
 
-            for task in priority_tasks:
-                task.is_iaa_priority = False
+            session.query(Task).filter(Task.is_iaa_priority==True)\
+                .update({Task.is_iaa_priority: False}, synchronize_session=False)
 
-            session.bulk_save_objects(priority_tasks)
+            if buckets is None:
+                sample = session.query(Task.id).filter(Task.is_iaa==True)\
+                    .order_by(sample_key).limit(max_priority_tasks)
+            else:
+                low, high = session.query(func.min(Task.similarity), func.max(Task.similarity))\
+                    .filter(Task.is_iaa==True).one()
+                low = low or 0
+                width = ((high or 0) - low) or 1
 
-            new_pri_tasks = random.sample(iaa_tasks, max_priority_tasks)
+                # equal width buckets between the lowest and highest similarity
+                bucket = similarity_bucket(session.get_bind().dialect.name, Task.similarity, low, low + width, buckets)
 
-            for task in new_pri_tasks:
-                task.is_iaa_priority = True
-            
-            session.bulk_save_objects(new_pri_tasks)
+                # take tasks from each bucket in turn: first the top ranked task of every bucket, then the second...
+                rank = func.row_number().over(partition_by=bucket, order_by=sample_key)
+
+                ranked = session.query(Task.id.label("id"), rank.label("rank"), sample_key.label("sample_key"))\
+                    .filter(Task.is_iaa==True).subquery()
+
+                sample = session.query(ranked.c.id).order_by(ranked.c.rank, ranked.c.sample_key)\
+                    .limit(max_priority_tasks)
+
+            # wrap the sample so that databases which can't LIMIT inside IN (...) accept it
+            sample = sample.subquery()
+
+            stats["priority"] = session.query(Task).filter(Task.id.in_(session.query(sample.c.id)))\
+                .update({Task.is_iaa_priority: True}, synchronize_session=False)
+
+            session.commit()
+
+        return stats
+
+class StatisticsService(DBServiceBase):
+    """Aggregate statistics for the dashboards computed inside the database"""
+
+    def similarity_histogram(self, bins: int = 20, answered: bool = True, only_difficult: bool = False,
+        by_answer: bool = False, low: float = 0.0, high: float = 1.0) -> Tuple[np.ndarray, Dict[str, np.ndarray]]:
+        """Histogram of task similarity
+
+        Returns the bin edges and the counts per bin. Counts are keyed by each
+        task's majority answer when by_answer is set, otherwise under "all".
+        """
 
+        edges = np.linspace(low, high, bins + 1)
+
+        with self.session() as session:
+
+            bucket = similarity_bucket(session.get_bind().dialect.name, Task.similarity, low, high, bins).label("bucket")
+
+            if by_answer:
+                # majority answer per task, ties go to the alphabetically first answer
+                votes = session.query(UserTask.task_id.label("task_id"), UserTask.answer.label("answer"),
+                        func.row_number().over(partition_by=UserTask.task_id, 
+                            order_by=(func.count().desc(), UserTask.answer)).label("rank"))\
+                    .group_by(UserTask.task_id, UserTask.answer).subquery()
+
+                q = session.query(bucket, votes.c.answer, func.count()).select_from(Task)\
+                    .join(votes, and_(votes.c.task_id==Task.id, votes.c.rank==1))\
+                    .group_by(bucket, votes.c.answer)
+            else:
+                q = session.query(bucket, func.count()).group_by(bucket)
+
+                if answered:
+                    q = q.filter(Task.id.in_(session.query(UserTask.task_id.distinct())))
+
+            q = q.filter(~Task.is_bad, Task.similarity != None)
+
+            if only_difficult:
+                q = q.filter(Task.is_difficult==True)
+
+            counts = defaultdict(lambda: np.zeros(bins, dtype=np.int64))
+
+            for row in q.all():
+                answer = row[1] if by_answer else "all"
+                counts[answer][row[0]] = row[-1]
+
+        return edges, dict(counts)
+
+    @staticmethod
+    def similarity_snapshot_name(answered: bool, only_difficult: bool) -> str:
+        """Name of the similarity histogram for the given filters in the snapshot"""
+        return f"similarity_answered={answered:d}_difficult={only_difficult:d}"
+
+    def build_snapshot(self, use_summary: bool = False) -> dict:
+        """Compute every statistic shown on the admin dashboards"""
+
+        usersvc, tasksvc = UserService(self.engine), TaskService(self.engine)
+
+        user_progress = usersvc.get_all_user_progress()
+
+        snapshot = {
+            "user_progress": user_progress,
+            "user_statistics": list(usersvc.get_user_statistics()),
+            "fleiss_iaa": list(usersvc.get_fleiss_iaa()),
+            "fleiss_iaa_difficult": list(usersvc.get_fleiss_iaa(just_difficult=True)),
+            "pairwise_iaa": usersvc.get_all_pairwise_iaa([username for username, _ in user_progress]),
+            "doc_coverage": list(tasksvc.get_task_doc_coverage(use_summary=use_summary)),
+            "answer_dists": tasksvc.get_answer_dists(),
+            "similarity_by_answer": self.similarity_histogram(by_answer=True),
+        }
+
+        for answered in (True, False):
+            for only_difficult in (True, False):
+                snapshot[self.similarity_snapshot_name(answered, only_difficult)] = \
+                    self.similarity_histogram(answered=answered, only_difficult=only_difficult)
+
+        return snapshot
+
+    def refresh_snapshot(self, use_summary: bool = False) -> datetime:
+        """Recalculate the dashboard statistics and store them in the stats_snapshots table"""
+
+        snapshot = self.build_snapshot(use_summary=use_summary)
+        now = datetime.utcnow()
+
+        def encode(value):
+            if isinstance(value, np.ndarray):
+                return value.tolist()
+            if isinstance(value, np.generic):
+                return value.item()
+            return str(value)
+
+        with self.session() as session:
+            session.query(StatsSnapshot).delete(synchronize_session=False)
+            session.add_all([StatsSnapshot(name=name, data=json.dumps(value, default=encode), updated_at=now)
+                for name, value in snapshot.items()])
             session.commit()
 
+        return now
+
+    def get_snapshot(self) -> Tuple[dict, Optional[datetime]]:
+        """Read the stored dashboard statistics and the time they were calculated
+
+        Rows come back as lists and histograms as (edges, counts) numpy arrays.
+        The time is None if the snapshot has never been refreshed.
+        """
+
+        with self.session() as session:
+            rows = session.query(StatsSnapshot.name, StatsSnapshot.data, StatsSnapshot.updated_at).all()
+
+        snapshot = {name: json.loads(data) for name, data, _ in rows}
+
+        for name, value in snapshot.items():
+            if name.startswith("similarity_"):
+                edges, counts = value
+                snapshot[name] = (np.array(edges), {answer: np.array(hist) for answer, hist in counts.items()})
+
+        updated_at = min((updated_at for _, _, updated_at in rows), default=None)
+
+        return snapshot, updated_at
+
+class SheetMirrorService(DBServiceBase):
+    """Local copy of the task lists kept in google sheets
+
+    Rows are read from the sheet incrementally and appends are queued locally
+    then sent to the sheet in batches. The client can be anything with the
+    get_range/append_sheet methods of cdcrapp.gsheets.Spreadsheet.
+    """
+
+    # a flush that hasn't sent its rows by now is assumed to have died and its rows are sent again
+    claim_timeout = timedelta(minutes=5)
+
+    def __init__(self, engine: Engine, client):
+        super().__init__(engine)
+        self.client = client
+        self._wake = threading.Event()
+
+    def sync(self, range_name: str) -> int:
+        """Copy rows added to the sheet since the last sync into the mirror"""
+        from cdcrapp.gsheets import offset_range
+
+        with self.session() as session:
+            last_row = session.query(func.max(SheetTask.row_index)).filter(SheetTask.sheet_range==range_name).scalar()
+            offset = 0 if last_row is None else last_row + 1
+
+            fetch_range = offset_range(range_name, offset)
+
+            if fetch_range is None:
+                return 0
+
+            values = self.client.get_range(fetch_range).get('values', [])
+
+            # rows appended from here come back from the sheet too, match them up rather than adding them twice
+            appended = defaultdict(list)
+            for row in session.query(SheetTask).filter(SheetTask.sheet_range==range_name, 
+                SheetTask.row_index==None, or_(SheetTask.synced==True, SheetTask.flushing_since!=None))\
+                .order_by(SheetTask.id):
+                appended[(row.task_hash, row.username)].append(row)
+
+            new_rows = []
+            for i, sheet_row in enumerate(values):
+                # blank rows are skipped but still take up a row in the range
+                if len(sheet_row) == 0:
+                    continue
+
+                task_hash, username, comment = [str(value).strip() for value in (list(sheet_row) + ["", ""])[:3]]
+
+                if len(appended[(task_hash, username)]) > 0:
+                    appended[(task_hash, username)].pop(0).row_index = offset + i
+                else:
+                    new_rows.append({"sheet_range": range_name, "row_index": offset + i, "task_hash": task_hash[:64], 
+                        "username": username, "comment": comment, "synced": True, "created_at": datetime.utcnow()})
+
+            if len(new_rows) > 0:
+                session.execute(SheetTask.__table__.insert(), new_rows)
+
+            session.commit()
+
+        return len(values)
+
+    def tasks(self, range_name: str) -> Dict[str, str]:
+        """Map task hashes in a sheet range to the user that added them, including queued rows"""
+
+        with self.session() as session:
+            q = session.query(SheetTask.task_hash, SheetTask.username)\
+                .filter(SheetTask.sheet_range==range_name).order_by(SheetTask.id)
+
+            return dict(q.all())
+
+    def queue_append(self, range_name: str, task_hash: str, username: str, comment: str = ""):
+        """Add a row to the mirror now and send it to the sheet with the next flush"""
+
+        with self.session() as session:
+            session.add(SheetTask(sheet_range=range_name, task_hash=task_hash, username=username, comment=comment, synced=False))
+            session.commit()
+
+        self._wake.set()
+
+    def _claim_batch(self, batch_size: int) -> Tuple[Optional[str], List[tuple]]:
+        """Mark the oldest queued rows for one range as being flushed
+
+        Returns the range and the (id, task_hash, username, comment) of each row.
+        """
+
+        with self.session() as session:
+            claimable = and_(SheetTask.synced==False, or_(SheetTask.flushing_since==None, 
+                SheetTask.flushing_since < datetime.utcnow() - self.claim_timeout))
+
+            oldest = session.query(SheetTask.sheet_range).filter(claimable).order_by(SheetTask.id).first()
+
+            if oldest is None:
+                return None, []
+
+            # lock the batch while it is claimed so that a second app instance flushing at the same time skips it
+            batch = session.query(SheetTask).filter(claimable, SheetTask.sheet_range==oldest[0])\
+                .order_by(SheetTask.id).limit(batch_size).with_for_update(skip_locked=True).all()
+
+            claimed = []
+            for row in batch:
+                row.flushing_since = datetime.utcnow()
+                claimed.append((row.id, row.task_hash, row.username, row.comment))
+
+            session.commit()
+
+        return oldest[0], claimed
+
+    def flush(self, batch_size: int = 100) -> int:
+        """Append queued rows to the sheet, one API call per batch of rows for the same range
+
+        Each batch is claimed in its own short transaction so that no rows are
+        locked while the sheets API is called.
+        """
+
+        flushed = 0
+
+        while True:
+            range_name, batch = self._claim_batch(batch_size)
+
+            if len(batch) == 0:
+                return flushed
+
+            ids = [id for id, _, _, _ in batch]
+
+            try:
+                self.client.append_sheet(range_name, [[task_hash, username, comment] for _, task_hash, username, comment in batch])
+            except Exception:
+                # give the rows back so that the next flush tries them again
+                with self.session() as session:
+                    session.query(SheetTask).filter(SheetTask.id.in_(ids))\
+                        .update({SheetTask.flushing_since: None}, synchronize_session=False)
+                    session.commit()
+                raise
+
+            with self.session() as session:
+                session.query(SheetTask).filter(SheetTask.id.in_(ids))\
+                    .update({SheetTask.synced: True, SheetTask.flushing_since: None}, synchronize_session=False)
+                session.commit()
+
+            flushed += len(batch)
+
+    def start_background_sync(self, range_names: List[str], interval: int = 60) -> threading.Thread:
+        """Flush queued rows and sync the given ranges in a daemon thread
+
+        Runs every interval seconds, or straight away when a row is queued.
+        """
+
+        def run():
+            while True:
+                try:
+                    self.flush()
+
+                    for range_name in range_names:
+                        self.sync(range_name)
+                except Exception as e:
+                    print(f"Google sheets sync failed: {e}")
+
+                self._wake.wait(interval)
+                self._wake.clear()
+
+        thread = threading.Thread(target=run, name="sheet-sync", daemon=True)
+        thread.start()
+
+        return thread
+
+    def import_difficult(self, range_name: str) -> dict:
+        """Mark tasks listed in a mirrored sheet range as difficult
+
+        Each task is attributed to the user named on its last row in the sheet.
+        """
+
+        username = func.lower(SheetTask.username)
+
+        with self.session() as session:
+            in_range = SheetTask.sheet_range==range_name
+
+            missing_users = [name for name, in session.query(username.distinct())\
+                .filter(in_range, ~session.query(User.id).filter(User.username==username).exists())]
+
+            missing_tasks = [task_hash for task_hash, in session.query(SheetTask.task_hash.distinct())\
+                .filter(in_range, ~session.query(Task.id).filter(Task.hash==SheetTask.task_hash).exists())]
+
+            reporter = session.query(User.id).join(SheetTask, User.username==username)\
+                .filter(in_range, SheetTask.task_hash==Task.hash)\
+                .order_by(SheetTask.id.desc()).limit(1).as_scalar()
+
+            updated = session.query(Task)\
+                .filter(Task.hash.in_(session.query(SheetTask.task_hash).filter(in_range)), reporter != None)\
+                .update({Task.is_difficult: True, Task.is_difficult_user_id: reporter, 
+                    Task.is_difficult_reported_at: datetime.utcnow()}, synchronize_session=False)
+
+            session.commit()
+
+        return {"updated": updated, "missing_users": missing_users, "missing_tasks": missing_tasks}
+
 class FlaskUserService(UserService):
 
     @contextmanager
@@ -0,0 +1,76 @@
+import os
+from typing import Optional
+
+from redis import Redis
+from redis.exceptions import WatchError
+
+# how long annotation state is kept for an idle user
+SESSION_TTL = int(os.getenv("SESSION_TTL", 60 * 60 * 24))
+
+
+class AnnotationSessionState(object):
+    """Per user annotation state for the streamlit app, held in a redis hash
+
+    The hash stores the task currently shown to the user and the last task
+    they answered. It expires after ttl seconds without activity.
+    """
+
+    redis: Redis
+    key: str
+    ttl: int
+
+    def __init__(self, redis_conn: Redis, user_id: int, ttl: int = SESSION_TTL):
+        self.redis = redis_conn
+        self.key = f"user:{user_id}:session"
+        self.ttl = ttl
+
+    def current_task(self) -> Optional[str]:
+        """Hash of the task currently shown to the user"""
+
+        task_hash = self.redis.hget(self.key, "task_id")
+
+        return task_hash.decode("utf8") if task_hash is not None else None
+
+    def set_current_task(self, task_hash: str):
+        """Record the task shown to the user and refresh the expiry in one round trip
+
+        Showing a task again, e.g. one reached by its ID, lets it be answered again.
+        """
+
+        pipe = self.redis.pipeline()
+        pipe.hset(self.key, "task_id", task_hash)
+        pipe.hdel(self.key, "answered_task_id")
+        pipe.expire(self.key, self.ttl)
+        pipe.execute()
+
+    def claim_answer(self, expected_hash: str) -> Optional[str]:
+        """Mark the task whose buttons were clicked as answered and return its hash
+
+        Returns None unless expected_hash, the task rendered with the buttons,
+        is still the current task and hasn't been answered since it was shown.
+        That rejects a second click on the same buttons and a click that
+        arrives after the user has been moved on to another task. The hash is
+        watched while it is read so only one of two concurrent clicks gets the task.
+        """
+
+        with self.redis.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(self.key)
+
+                    task_hash, answered = pipe.hmget(self.key, "task_id", "answered_task_id")
+
+                    if task_hash is None or task_hash.decode("utf8") != expected_hash or task_hash == answered:
+                        pipe.unwatch()
+                        return None
+
+                    pipe.multi()
+                    pipe.hset(self.key, "answered_task_id", task_hash)
+                    pipe.expire(self.key, self.ttl)
+                    pipe.execute()
+
+                    return task_hash.decode("utf8")
+
+                except WatchError:
+                    # the state changed while we were reading it, try again with the new state
+                    continue
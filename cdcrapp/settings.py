@@ -9,4 +9,18 @@ SECRET_KEY = os.environ.get("SECRET_KEY", "changeme")
 TEMPLATES_AUTO_RELOAD = True
 SECURITY_PASSWORD_SALT = os.environ.get("SECURITY_PASSWORD_SALT", "supersecretsalt")
 SQLALCHEMY_POOL_RECYCLE = os.environ.get("SQLALCHEMY_POOL_RECYCLE",30)
-WTF_CSRF_ENABLED = False
\ No newline at end of file
+WTF_CSRF_ENABLED = False
+# responses smaller than this are not worth compressing
+COMPRESS_MIN_SIZE = int(os.environ.get("COMPRESS_MIN_SIZE", 500))
+COMPRESS_LEVEL = int(os.environ.get("COMPRESS_LEVEL", 6))
+# maintain the news_coverage summary table whenever answers are recorded
+DOC_COVERAGE_SUMMARY = os.environ.get("DOC_COVERAGE_SUMMARY", "false").lower() in ("1", "true", "yes")
+# per request SQL timings in Server-Timing headers and logs, see cdcrapp.web.profiling
+SQL_PROFILING = os.environ.get("SQL_PROFILING", "false").lower() in ("1", "true", "yes")
+SQL_PROFILING_REPEAT_THRESHOLD = int(os.environ.get("SQL_PROFILING_REPEAT_THRESHOLD", 5))
+# serve prometheus metrics on /metrics when prometheus_client is installed, see cdcrapp.web.metrics
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "false").lower() in ("1", "true", "yes")
+# if set, scrapes must send "Authorization: Bearer <METRICS_TOKEN>"
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN")
+# the task queue depth is counted at most once per this many seconds
+METRICS_QUEUE_CACHE_SECONDS = int(os.environ.get("METRICS_QUEUE_CACHE_SECONDS", 30))
\ No newline at end of file
@@ -15,12 +15,15 @@ import matplotlib.pyplot as plt
 import seaborn as sns
 
 from typing import Optional
+from datetime import datetime
 
 from sqlalchemy import create_engine
 
 from cdcrapp.gsheets import Spreadsheet
-from cdcrapp.services import UserService, TaskService
+from cdcrapp.session_state import AnnotationSessionState
+from cdcrapp.services import UserService, TaskService, StatisticsService, SheetMirrorService
 from cdcrapp.model import User, Task, UserTask, NewsArticle, SciPaper
+from cdcrapp.settings import DOC_COVERAGE_SUMMARY
 
 load_dotenv()
 
@@ -39,6 +42,7 @@ def get_sql_engine():
 _engine = get_sql_engine()
 _usersvc : UserService = UserService(_engine)
 _tasksvc : TaskService = TaskService(_engine)
+_statsvc : StatisticsService = StatisticsService(_engine)
 
 ASSETS_DIR = os.path.join(os.path.dirname(__file__), "../assets/")
 
@@ -71,25 +75,25 @@ def get_redis_connection():
     return redis.Redis(host=os.getenv("REDIS_SERVER", "localhost"), port=6379, password=os.getenv("REDIS_PASSWORD"))
 
 @st.cache(allow_output_mutation=True)
+def get_sheet_mirror():
+    """Local mirror of the google sheets task lists, kept in sync by a background thread"""
+    mirror = SheetMirrorService(_engine, get_spreadsheet_client())
+
+    # read the sheets before the first page is drawn so that it doesn't show empty task lists
+    for range_name in [INTERESTING_RANGE, FRAME_RANGE]:
+        mirror.sync(range_name)
+
+    mirror.start_background_sync([INTERESTING_RANGE, FRAME_RANGE], interval=int(os.getenv("SHEET_SYNC_INTERVAL", 60)))
+
+    return mirror
+
 def get_interesting_tasks():
-    """Get all interesting/difficult tasks from google sheets"""
-    all_complete = dict()
-    sheet = get_spreadsheet_client()
-    for (hash, user, _) in sheet.get_range(INTERESTING_RANGE)['values']:
-        all_complete[hash.strip()] = user
-    
-    return all_complete
+    """Get all interesting/difficult tasks from the google sheets mirror"""
+    return get_sheet_mirror().tasks(INTERESTING_RANGE)
 
-@st.cache(allow_output_mutation=True)
 def get_frame_tasks():
-    """Get all tasks with an interesting frame from google sheets"""
-    all_complete = dict()
-    sheet = get_spreadsheet_client()
-    
-    for (hash, user) in sheet.get_range(FRAME_RANGE)['values']:
-        all_complete[hash.strip()] = user
-    
-    return all_complete
+    """Get all tasks with an interesting frame from the google sheets mirror"""
+    return get_sheet_mirror().tasks(FRAME_RANGE)
 
 class CDCRTool():
 
@@ -109,13 +113,32 @@ class CDCRTool():
         self.display_admin_panel()
 
 
+    def load_stats_snapshot(self) -> Optional[dict]:
+        """Read dashboard statistics from the snapshot kept up to date by `cdcrapp refresh-stats`"""
+
+        snapshot, updated_at = _statsvc.get_snapshot()
+
+        if updated_at is None:
+            st.warning("No statistics have been calculated yet, run `python -m cdcrapp refresh-stats`")
+            return None
+
+        age = datetime.utcnow() - updated_at
+        st.markdown(f"*Statistics calculated {int(age.total_seconds() // 60)} minutes ago ({updated_at:%Y-%m-%d %H:%M} UTC)*")
+
+        return snapshot
+
     def show_iaa(self):
         """Show stuff related to IAA"""
 
+        snapshot = self.load_stats_snapshot()
+
+        if snapshot is None:
+            return
+
         st.markdown("## User Statistics")
 
 
-        user_stats = pd.DataFrame(data=_usersvc.get_user_statistics(), columns=['Username', 'yes', 'no'])
+        user_stats = pd.DataFrame(data=snapshot['user_statistics'], columns=['Username', 'yes', 'no'])
 
         st.dataframe(user_stats)
 
@@ -123,7 +146,8 @@ class CDCRTool():
 
         just_difficult = st.checkbox(label="Just show IAA for difficult tasks")
 
-        iaa_table = pd.DataFrame(data=_usersvc.get_fleiss_iaa(just_difficult=just_difficult), columns=['Group', 'Samples', 'Fleiss IAA Score'])
+        fleiss_iaa = snapshot['fleiss_iaa_difficult'] if just_difficult else snapshot['fleiss_iaa']
+        iaa_table = pd.DataFrame(data=fleiss_iaa, columns=['Group', 'Samples', 'Fleiss IAA Score'])
         
         st.dataframe(iaa_table)
 
@@ -142,17 +166,24 @@ class CDCRTool():
                 st.markdown("You can't compare the user against themselves")
             else:
             
-                iaa = _usersvc.get_pairwise_iaa(username_a,username_b)
+                iaa = snapshot['pairwise_iaa'].get(",".join(sorted([username_a, username_b])))
             
-                st.markdown(f"IAA {username_a} <-> {username_b}: {iaa}")        
+                # pairs without enough shared IAA tasks are stored as None
+                st.markdown(f"IAA {username_a} <-> {username_b}: {iaa if iaa is not None else 'n/a'}")        
         
                 
         st.markdown(IAA_GUIDE)
 
     def show_progress(self):
+
+        snapshot = self.load_stats_snapshot()
+
+        if snapshot is None:
+            return
+
         # get user performance
         
-        progress = _usersvc.get_all_user_progress()
+        progress = snapshot['user_progress']
         
         df = pd.DataFrame.from_records(progress, columns=['User','Completed Examples'])
 
@@ -161,13 +192,10 @@ class CDCRTool():
         
         st.dataframe(df)
 
-        # get task difficulty
-        diffdist = _tasksvc.get_task_difficulty_dist()
-        
 
         st.markdown("### Percentage coverage")
 
-        coverage_df = pd.DataFrame.from_records(_tasksvc.get_task_doc_coverage())
+        coverage_df = pd.DataFrame.from_records(snapshot['doc_coverage'])
         st.dataframe(coverage_df)
         sns.distplot(coverage_df['complete_percent'], norm_hist=False, kde=False)
         plt.title("Percentage of Document Pair examples annotated")
@@ -179,17 +207,20 @@ class CDCRTool():
         st.markdown("### Total distinct answers")
 
 
-        dists_df = pd.DataFrame(data=_tasksvc.get_answer_dists(), columns=['Answer', 'Count'])
+        dists_df = pd.DataFrame(data=snapshot['answer_dists'], columns=['Answer', 'Count'])
         st.dataframe(dists_df)
 
         st.markdown("### BERT Similarity distribution of Tasks")
+
+        edges, counts = snapshot[_statsvc.similarity_snapshot_name(True, False)]
+        plt.bar(edges[:-1], counts.get("all", np.zeros(len(edges) - 1)), width=np.diff(edges), align="edge")
         st.pyplot()
 
     def do_bad_task_management(self):
 
         st.markdown("## Bad Tasks")
 
-        bad_tasks = _tasksvc.list(Task, filters={"is_bad": True}, joins=[NewsArticle, SciPaper])
+        bad_tasks = _tasksvc.list(Task, filters={"is_bad": True}, joins=[NewsArticle, SciPaper], profile="with_doc_info")
 
 
         rows = []
@@ -216,7 +247,7 @@ class CDCRTool():
             else:
                 st.markdown("********")
                 st.markdown(f"Hash: {task.hash} \n\n News URL: {task.news_url} \n\n Science DOI: http://dx.doi.org/{task.sci_url}\n\n")
-                st.markdown(f"News Ent: {task.news_ent.split(';')[0]} \n\n Sci Ent: {task.sci_ent.split(';')[0]}\n")
+                st.markdown(f"News Ent: {task.news_ent_text} \n\n Sci Ent: {task.sci_ent_text}\n")
                 st.markdown(f"News Text: {task.news_text} \n\n Science Text: {task.sci_text}")
                 st.markdown("## Danger Zone")
 
@@ -226,6 +257,9 @@ class CDCRTool():
 
                     _tasksvc.remove_tasks_by_doc_ids(task.news_article_id, task.sci_paper_id)
 
+                    if DOC_COVERAGE_SUMMARY:
+                        _tasksvc.refresh_doc_coverage([task.news_article_id])
+
                     st.markdown("Removed the task.")
 
             
@@ -266,35 +300,37 @@ class CDCRTool():
 
     def add_frame_task(self, task):
         self.add_sheet_task(task, FRAME_RANGE)
-        #append to cache
-        get_frame_tasks()[task.hash] = self.user.username
 
     def add_interesting_task(self, task):
         self.add_sheet_task(task, INTERESTING_RANGE)
-        #append to cache
-        get_interesting_tasks()[task.hash] = self.user.username
         
     def add_sheet_task(self, task: Task, range):
         # generate text
-        entity = task.news_ent.split(";")[0]
-        sci_entity = task.sci_ent.split(";")[0]
-        comment = f"{entity} and {sci_entity}"
+        comment = f"{task.news_ent_text} and {task.sci_ent_text}"
         
-        #append to actual sheet
-        sheet = get_spreadsheet_client()
-        row = [task.hash, self.user.username, comment]
-        sheet.append_sheet(range, [row])
+        # the mirror sends it to the actual sheet in the background
+        get_sheet_mirror().queue_append(range, task.hash, self.user.username, comment)
 
             
-    def handle_task_outcome(self):
+    def handle_task_outcome(self, task_hash: str):
+        """Record the answer for task_hash, the task the clicked buttons were rendered with
+
+        Read it with current_task() before manage_task_navigation() moves the user on.
+        """
         if self.yes_btn or self.no_btn or self.report_btn:
             
-            if self.redis.get(f"user_{self.user.id}_task_id") is not None:
-                self.last_task_id =  self.redis.get(f"user_{self.user.id}_task_id").decode("utf8")
-                print(f"Last task id={self.last_task_id}")
+            session_state = AnnotationSessionState(self.redis, self.user.id)
+
+            self.last_task_id = session_state.claim_answer(task_hash)
+            print(f"Last task id={self.last_task_id}")
             
             if self.last_task_id is None:
-                st.error("You clicked OK but I couldn't find the task in redis...")
+                if session_state.current_task() is None:
+                    st.error("You clicked OK but I couldn't find the task in redis...")
+                elif session_state.current_task() != task_hash:
+                    st.warning("You have moved on to another task, that answer was not recorded")
+                else:
+                    st.warning("This task has already been answered")
                 return
             
             task : Task = _tasksvc.get_by_hash(self.last_task_id)
@@ -303,6 +339,9 @@ class CDCRTool():
                 print(f"Report task is bad {task.hash}")
                 task.is_bad = True
                 _tasksvc.update(task)
+
+                if DOC_COVERAGE_SUMMARY:
+                    _tasksvc.refresh_doc_coverage([task.news_article_id])
                 return
             
             # there is a random chance that this will become an IAA task
@@ -318,6 +357,9 @@ class CDCRTool():
             print(f"Add user task user={self.user.username}, task={task.hash}")
             #write exercise to cache
             _usersvc.user_add_task(self.user, task, lbl)
+
+            if DOC_COVERAGE_SUMMARY:
+                _tasksvc.refresh_doc_coverage([task.news_article_id])
             
 
             
@@ -345,7 +387,7 @@ class CDCRTool():
             else:
                 st.markdown("# Please enter a task ID to navigate to it\n\n A task ID is a SHA hash like `bf4f745552980203a2a2b6e641b0c069141c7f8e2f9f81466fa112c59e9a1274`")
         
-        self.last_task_id =  self.redis.set(f"user_{self.user.id}_task_id", task_id)
+        AnnotationSessionState(self.redis, self.user.id).set_current_task(task_id)
         
         return next_task
 
@@ -362,13 +404,16 @@ class CDCRTool():
             self.handle_sheet_updates(next_task)
 
             try:
-                entity, start, end = next_task.news_ent.split(";")
+                if next_task.news_ent_start is None or next_task.sci_ent_start is None:
+                    raise ValueError(f"Malformed mentions {next_task.news_ent} and {next_task.sci_ent}")
+
+                entity, start, end = next_task.news_ent_text, next_task.news_ent_start, next_task.news_ent_end
                 
-                buffer = next_task.news_text[:int(start)].strip() + " **" + entity + "** " + next_task.news_text[int(end):].strip()
+                buffer = next_task.news_text[:start].strip() + " **" + entity + "** " + next_task.news_text[end:].strip()
                 
-                sci_entity, start, end = next_task.sci_ent.split(";")
+                sci_entity, start, end = next_task.sci_ent_text, next_task.sci_ent_start, next_task.sci_ent_end
                 
-                sci_buffer = next_task.sci_text[:int(start)].strip() + " **" + sci_entity + "** " + next_task.sci_text[int(end):].strip()
+                sci_buffer = next_task.sci_text[:start].strip() + " **" + sci_entity + "** " + next_task.sci_text[end:].strip()
                 
                 self.task_question_ph.markdown(f"## Are *'{entity}'* and *'{sci_entity}'* mentions of the same thing?")
                 
@@ -389,16 +434,20 @@ class CDCRTool():
     
     def show_task_spreadsheet_options(self, task: Task):
         
-        if task.hash not in get_interesting_tasks():
+        interesting_tasks = get_interesting_tasks()
+
+        if task.hash not in interesting_tasks:
             self.interesting_btn = self.interesting_btn_ph.button("This task is difficult to think about")
         else:
-            self.interesting_btn_ph.markdown(f"**Task already in 'difficult list', added by {get_interesting_tasks()[task.hash]}**")
+            self.interesting_btn_ph.markdown(f"**Task already in 'difficult list', added by {interesting_tasks[task.hash]}**")
             
         if self.user.view_gsheets:
-            if task.hash not in get_frame_tasks():
+            frame_tasks = get_frame_tasks()
+
+            if task.hash not in frame_tasks:
                 self.frame_btn = self.frame_btn_ph.button("Interesting Frame (Append Spreadsheet)")
             else:
-                self.frame_btn_ph.markdown(f"**Task already exists in frame list, added by {get_frame_tasks()[task.hash]}**")
+                self.frame_btn_ph.markdown(f"**Task already exists in frame list, added by {frame_tasks[task.hash]}**")
 
 
     def user_list(self):
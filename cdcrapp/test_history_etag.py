@@ -0,0 +1,73 @@
+import pytest
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from cdcrapp.model import Base, NewsArticle, SciPaper, Task, User, UserTask
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+
+    db_uri = f"sqlite:///{tmp_path / 'history.db'}"
+    monkeypatch.setenv("SQLALCHEMY_DB_URI", db_uri)
+
+    from cdcrapp.web import create_app, db_session
+
+    engine = create_engine(db_uri)
+    Base.metadata.create_all(engine)
+
+    session = sessionmaker(bind=engine)()
+    session.add_all([NewsArticle(id=1, url="news", summary="virus spreads"), SciPaper(id=1, url="sci", abstract="a virus")])
+    session.add(User(id=1, username="alice", password="secret", active=True))
+    session.add(Task(id=1, hash="a", news_article_id=1, sci_paper_id=1, news_ent="virus;0;5", sci_ent="virus;2;7"))
+    session.flush()
+    session.add(UserTask(user_id=1, task_id=1, answer="yes"))
+    session.commit()
+    session.close()
+
+    db_session.remove()
+    db_session.configure(bind=engine)
+
+    app = create_app({"SECURITY_HASHING_SCHEMES": ["hex_md5"], "SECURITY_DEPRECATED_HASHING_SCHEMES": []})
+
+    with app.app_context():
+        headers = {"Authentication-Token": db_session.query(User).get(1).get_auth_token()}
+
+    yield app.test_client(), headers
+
+    db_session.remove()
+
+
+def history_etag(client, headers):
+
+    response = client.get("/api/v1/user/tasks", headers=headers, json={})
+    assert response.status_code == 200
+
+    response = client.get("/api/v1/user/tasks", headers=dict(headers, **{"If-None-Match": response.headers["ETag"]}), json={})
+    assert response.status_code == 304
+
+    return response.headers["ETag"]
+
+
+def test_history_changes_with_answered_tasks(client):
+
+    client, headers = client
+
+    etag = history_etag(client, headers)
+
+    response = client.post("/api/v1/task", headers=headers, json={"task_id": "1", "is_bad": True, "is_bad_reason": "bad sci ent"})
+    assert response.status_code == 200
+
+    response = client.get("/api/v1/user/tasks", headers=dict(headers, **{"If-None-Match": etag}), json={})
+    assert response.status_code == 200
+    assert response.get_json()["tasks"][0]["task"]["is_bad"]
+
+    etag = history_etag(client, headers)
+
+    response = client.patch("/api/v1/entities/news/1", json={"oldEntity": "virus;0;5", "newEntity": "the virus;0;9"})
+    assert response.get_json() == {"updated_rows": 1}
+
+    response = client.get("/api/v1/user/tasks", headers=dict(headers, **{"If-None-Match": etag}), json={})
+    assert response.status_code == 200
+    assert response.get_json()["tasks"][0]["task"]["news_ent"] == "the virus;0;9"
@@ -0,0 +1,99 @@
+import threading
+
+import fakeredis
+import pytest
+
+from cdcrapp.session_state import AnnotationSessionState
+
+
+@pytest.fixture
+def redis_conn():
+    return fakeredis.FakeRedis()
+
+
+def test_claim_answer(redis_conn):
+
+    state = AnnotationSessionState(redis_conn, 1)
+    state.set_current_task("a")
+
+    assert state.claim_answer("a") == "a"
+
+
+def test_claim_answer_twice(redis_conn):
+
+    state = AnnotationSessionState(redis_conn, 1)
+    state.set_current_task("a")
+
+    assert state.claim_answer("a") == "a"
+    assert state.claim_answer("a") is None
+
+
+def test_claim_answer_concurrent(redis_conn):
+
+    AnnotationSessionState(redis_conn, 1).set_current_task("a")
+
+    results = []
+    start = threading.Barrier(8)
+
+    def click():
+        start.wait()
+        results.append(AnnotationSessionState(redis_conn, 1).claim_answer("a"))
+
+    threads = [threading.Thread(target=click) for _ in range(8)]
+
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+    assert results.count("a") == 1
+    assert results.count(None) == 7
+
+
+def test_claim_answer_stale_task(redis_conn):
+
+    state = AnnotationSessionState(redis_conn, 1)
+    state.set_current_task("a")
+    state.claim_answer("a")
+
+    # the user has been moved on to b, a late click on a's buttons mustn't answer b
+    state.set_current_task("b")
+
+    assert state.claim_answer("a") is None
+    assert state.claim_answer("b") == "b"
+
+
+def test_claim_answer_task_reached_by_id(redis_conn):
+
+    state = AnnotationSessionState(redis_conn, 1)
+    state.set_current_task("a")
+    assert state.claim_answer("a") == "a"
+
+    # going back to the same task by its ID, e.g. to report it, lets it be answered again
+    state.set_current_task("a")
+
+    assert state.claim_answer("a") == "a"
+
+
+def test_claim_answer_without_task(redis_conn):
+
+    assert AnnotationSessionState(redis_conn, 1).claim_answer("a") is None
+
+
+def test_ttl_refresh(redis_conn):
+
+    state = AnnotationSessionState(redis_conn, 1, ttl=100)
+    state.set_current_task("a")
+
+    assert 0 < redis_conn.ttl(state.key) <= 100
+
+    redis_conn.expire(state.key, 5)
+    state.claim_answer("a")
+
+    assert redis_conn.ttl(state.key) > 5
+
+    redis_conn.expire(state.key, 5)
+    state.set_current_task("b")
+
+    assert redis_conn.ttl(state.key) > 5
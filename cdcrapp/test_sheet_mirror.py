@@ -0,0 +1,123 @@
+import pytest
+
+from sqlalchemy import create_engine
+
+from cdcrapp.model import Base, SheetTask, Task, User
+from cdcrapp.services import SheetMirrorService
+
+RANGE = "Tasks!A2:C"
+
+
+class FakeSpreadsheet(object):
+    """Keeps the rows of each range in memory, with the get_range/append_sheet methods of Spreadsheet"""
+
+    def __init__(self, rows=None):
+        self.rows = list(rows or [])
+        self.appends = []
+        self.fail = False
+
+    def get_range(self, range_name):
+        # ranges asked for are RANGE moved down by the rows already read
+        offset = int(range_name.split("!A")[1].split(":")[0]) - 2
+        return {"values": self.rows[offset:]}
+
+    def append_sheet(self, range_name, values):
+        if self.fail:
+            raise IOError("sheets API unavailable")
+
+        self.appends.append((range_name, values))
+        self.rows.extend(values)
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'sheets.db'}")
+    Base.metadata.create_all(engine)
+    return engine
+
+
+def sheet_rows(engine):
+    with engine.connect() as conn:
+        return conn.execute(SheetTask.__table__.select().order_by(SheetTask.id)).fetchall()
+
+
+def test_sync_only_reads_new_rows(engine):
+
+    client = FakeSpreadsheet([["a", "alice", ""], ["b", "bob", "odd"]])
+    mirror = SheetMirrorService(engine, client)
+
+    assert mirror.sync(RANGE) == 2
+
+    client.rows.append(["c", "carol", ""])
+
+    assert mirror.sync(RANGE) == 1
+    assert mirror.tasks(RANGE) == {"a": "alice", "b": "bob", "c": "carol"}
+    assert [row.row_index for row in sheet_rows(engine)] == [0, 1, 2]
+
+
+def test_queue_append_and_flush(engine):
+
+    client = FakeSpreadsheet([["a", "alice", ""]])
+    mirror = SheetMirrorService(engine, client)
+    mirror.sync(RANGE)
+
+    mirror.queue_append(RANGE, "b", "bob", "odd")
+    mirror.queue_append(RANGE, "c", "carol")
+
+    # queued rows are seen straight away, before they reach the sheet
+    assert mirror.tasks(RANGE) == {"a": "alice", "b": "bob", "c": "carol"}
+
+    assert mirror.flush() == 2
+    assert client.appends == [(RANGE, [["b", "bob", "odd"], ["c", "carol", ""]])]
+    assert mirror.flush() == 0
+
+    # reading the appended rows back matches them up with the mirrored rows rather than adding them again
+    mirror.sync(RANGE)
+    rows = sheet_rows(engine)
+
+    assert len(rows) == 3
+    assert all(row.synced and row.flushing_since is None for row in rows)
+    assert [row.row_index for row in rows] == [0, 1, 2]
+
+
+def test_flush_failure_requeues_rows(engine):
+
+    client = FakeSpreadsheet()
+    mirror = SheetMirrorService(engine, client)
+    mirror.queue_append(RANGE, "a", "alice")
+
+    client.fail = True
+
+    with pytest.raises(IOError):
+        mirror.flush()
+
+    assert [(row.synced, row.flushing_since) for row in sheet_rows(engine)] == [(False, None)]
+
+    client.fail = False
+
+    assert mirror.flush() == 1
+    assert client.rows == [["a", "alice", ""]]
+
+
+def test_import_difficult(engine):
+
+    with engine.begin() as conn:
+        conn.execute(User.__table__.insert(), [{"id": 1, "username": "alice"}, {"id": 2, "username": "bob"}])
+        conn.execute(Task.__table__.insert(), [{"id": 1, "hash": "a"}, {"id": 2, "hash": "b"}, {"id": 3, "hash": "c"}])
+
+    client = FakeSpreadsheet([["a", "Alice", ""], ["b", "alice", ""], ["b", "bob", ""], ["c", "nobody", ""],
+        ["missing", "bob", ""]])
+    mirror = SheetMirrorService(engine, client)
+    mirror.sync(RANGE)
+
+    result = mirror.import_difficult(RANGE)
+
+    assert result["updated"] == 2
+    assert result["missing_users"] == ["nobody"]
+    assert result["missing_tasks"] == ["missing"]
+
+    with engine.connect() as conn:
+        difficult = conn.execute(Task.__table__.select().order_by(Task.id)).fetchall()
+
+    # each task is attributed to the user on its last row
+    assert [(task.is_difficult, task.is_difficult_user_id) for task in difficult] == [(True, 1), (True, 2), (False, None)]
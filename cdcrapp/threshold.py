@@ -3,18 +3,23 @@ import json
 import os
 import sys
 import itertools
-import torch
 from tqdm.auto import tqdm
 import numpy as np
 
 from collections import defaultdict
 from export import get_next_cluster_id
 
-from ingest import tokenizer,model,get_tokens_by_offset,cosine
+from scipy.spatial.distance import cosine
+from ingest import get_tokens_by_offset
+from cdcrapp.models import get_model, BERT_TOKENIZER
+from cdcrapp.encoders import get_encoder
 
 def predict_threshold(data_file, threshold=0.65):
     """Given a data file, make a series of predictions"""
 
+    tokenizer = get_model(BERT_TOKENIZER)
+    encoder = get_encoder()
+
     with open(data_file,"r") as f:
         docs = json.load(f)
 
@@ -65,16 +70,8 @@ def predict_threshold(data_file, threshold=0.65):
             if (s1id,s2id) not in sentcache:
 
                 # run single pass of BERT with both documents to get attention matrices
-                with torch.no_grad():
-                        hidden_state, out = model(
-                            input_ids=torch.tensor([model_inputs['input_ids']]).cuda(), 
-                            token_type_ids = torch.tensor([model_inputs['token_type_ids']]).cuda(),
-                            attention_mask = torch.tensor([model_inputs['attention_mask']]).cuda()
-                        )
-
-                state = hidden_state.squeeze()
-
-                sentcache[(s1id,s2id)] = hidden_state.squeeze()#state
+                sentcache[(s1id,s2id)] = encoder.encode([model_inputs['input_ids']], [model_inputs['token_type_ids']],
+                    [model_inputs['attention_mask']])[0]
 
             state = sentcache[(s1id,s2id)]
             vectors = []
@@ -88,7 +85,7 @@ def predict_threshold(data_file, threshold=0.65):
                 second = i == 1
                 
                 tokens = list(get_tokens_by_offset(start_char_offset,end_char_offset, model_inputs, second_doc=second))
-                vec = np.mean(np.array([state[i].cpu().numpy() for (i,_) in tokens]), axis=0)
+                vec = np.mean(state[[i for (i,_) in tokens]], axis=0)
 
                 vectors.append(vec)
 
@@ -2,6 +2,8 @@ import os
 import flask
 import hashlib
 
+from typing import Optional
+
 from flask_security import SQLAlchemySessionUserDatastore, Security
 from flask_cors import CORS
 from flask_restful import Api
@@ -23,7 +25,8 @@ def gravatar_for_email(email):
     return "https://www.gravatar.com/avatar/{}".format(m.hexdigest())
 
 
-def create_app():
+def create_app(config: Optional[dict] = None):
+    """Create the flask app, config overrides the settings read from cdcrapp.settings"""
 
     client_path = os.path.abspath(os.path.join(os.path.dirname(__file__), "../../client/build"))
 
@@ -50,6 +53,9 @@ def create_app():
     # configure app
     app.config.from_object("cdcrapp.settings")
 
+    if config is not None:
+        app.config.update(config)
+
 
 
 
@@ -61,6 +67,15 @@ def create_app():
     def shutdown_session(exception=None):
         db_session.remove()
 
+    from .responses import compress_response
+    app.after_request(compress_response)
+
+    from .profiling import init_profiling
+    init_profiling(app, engine, api)
+
+    from .metrics import init_metrics
+    init_metrics(app, engine, db_session)
+
     
 
     # Setup Flask-Security
@@ -69,7 +84,7 @@ def create_app():
 
     #from .views import bp
     from .resources import TaskResource, AnswerListResource, UserResource, EntityResource\
-        , UserTaskListResource, BatchAnswerResource, SingletonAnswerResource
+        , UserTaskListResource, BatchAnswerResource, SingletonAnswerResource, DocumentResource
 
 
     api.add_resource(UserResource, "/user")
@@ -79,6 +94,7 @@ def create_app():
     api.add_resource(AnswerListResource, "/task/<int:task_id>/answers")
     api.add_resource(EntityResource, "/entities/<string:doc_type>/<int:doc_id>")
     api.add_resource(UserTaskListResource, "/user/tasks")
+    api.add_resource(DocumentResource, "/documents/<string:doc_type>/<int:doc_id>")
 
 
 
@@ -30,3 +30,102 @@ def change_password(email, password):
     db_session.commit()
 
 
+
+
+@app.cli.command("payload-sizes")
+@click.option("--email", type=str, prompt='email')
+@click.option("--limit", type=int, default=200)
+@with_appcontext
+def payload_sizes(email, limit):
+    """Measure API payload sizes with and without compression and conditional requests"""
+
+    from cdcrapp.web.responses import brotli
+
+    u = db_session.query(User).filter(User.email==email).one()
+    headers = {"Authentication-Token": u.get_auth_token()}
+    client = app.test_client()
+
+    task = client.get("/api/v1/task", headers=headers).get_json()
+
+    endpoints = [
+        ("task (inline documents)", f"/api/v1/task?hash={task['hash']}&include_documents=true"),
+        ("task", f"/api/v1/task?hash={task['hash']}"),
+        ("news document", f"/api/v1/documents/news/{task['news_article_id']}?v={task['news_article_hash']}"),
+        ("science document", f"/api/v1/documents/science/{task['sci_paper_id']}?v={task['sci_paper_hash']}"),
+        ("news entities", f"/api/v1/entities/news/{task['news_article_id']}"),
+        ("history (full)", f"/api/v1/user/tasks?limit={limit}"),
+        ("history (slim)", f"/api/v1/user/tasks?limit={limit}&fields=id,hash,news_ent,sci_ent"),
+    ]
+
+    encodings = ["identity", "gzip"] + (["br"] if brotli is not None else [])
+
+    print("Endpoint," + ",".join(encodings) + ",revalidated")
+
+    for name, url in endpoints:
+        sizes = []
+        for encoding in encodings:
+            r = client.get(url, headers={**headers, "Accept-Encoding": encoding})
+            sizes.append(len(r.get_data()))
+
+        r = client.get(url, headers={**headers, "If-None-Match": r.headers.get("ETag", "")})
+        revalidated = f"{len(r.get_data())} ({r.status_code})"
+
+        print(f"{name}," + ",".join(str(size) for size in sizes) + f",{revalidated}")
+
+
+@app.cli.command("marshal-benchmark")
+@click.option("--email", type=str, prompt='email')
+@click.option("--rows", type=int, default=200, help="Size of user task history page")
+@click.option("--repeat", type=int, default=50)
+@with_appcontext
+def marshal_benchmark(email, rows, repeat):
+    """Compare flask_restful.marshal against the precompiled serializers
+    
+    The single task benchmark uses the task and document fields only, the per-user
+    fields (entity lists, related answers) run their own queries on every access.
+    """
+
+    import timeit
+
+    from flask_restful import marshal
+    from cdcrapp.model import UserTask
+    from cdcrapp.web.resources import TaskResource, ut_fields, history_serializer
+    from cdcrapp.web.serializers import Serializer, dumps, orjson
+
+    u = db_session.query(User).filter(User.email==email).one()
+
+    history = db_session.query(UserTask).filter(UserTask.user_id==u.id)\
+        .order_by(UserTask.created_at.desc().nullslast(), UserTask.task_id.desc())\
+        .limit(rows).all()
+
+    if len(history) < 1:
+        print(f"User {email} has not answered any tasks")
+        return
+
+    task = history[0].task
+
+    task_fields = dict(**TaskResource.task_fields, **TaskResource.document_fields)
+    task_serializer = Serializer(task_fields)
+    row_serializer = history_serializer()
+
+    # make sure lazy relationships are loaded before timing anything
+    for ut in history:
+        row_serializer(ut)
+    task_serializer(task)
+
+    cases = [
+        (f"history ({len(history)} rows)", 
+            lambda: json.dumps([marshal(ut, ut_fields) for ut in history]),
+            lambda: dumps(row_serializer.many(history))),
+        ("single task",
+            lambda: json.dumps(marshal(task, task_fields)),
+            lambda: dumps(task_serializer(task))),
+    ]
+
+    print(f"JSON encoder: {'orjson' if orjson is not None else 'json'}")
+    print("Response,marshal (ms),serializer (ms),speedup")
+
+    for name, old, new in cases:
+        old_ms = min(timeit.repeat(old, number=1, repeat=repeat)) * 1000
+        new_ms = min(timeit.repeat(new, number=1, repeat=repeat)) * 1000
+        print(f"{name},{old_ms:.3f},{new_ms:.3f},{old_ms/new_ms:.1f}x")
@@ -0,0 +1,33 @@
+"""gunicorn settings for serving cdcrapp.web.wsgi with metrics from every worker
+
+Use with `gunicorn -c cdcrapp/web/gunicorn_conf.py cdcrapp.web.wsgi:app` (or
+GUNICORN_CONF in the docker image).
+"""
+
+import importlib.util
+import os
+import shutil
+
+bind = os.getenv("BIND", "0.0.0.0:80")
+workers = int(os.getenv("WEB_CONCURRENCY", 2))
+
+if importlib.util.find_spec("meinheld") is not None:
+    worker_class = "egg:meinheld#gunicorn_worker"
+
+# prometheus_client keeps each worker's samples in files in this directory
+multiproc_dir = os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", "/tmp/cdcrapp_metrics")
+
+
+def on_starting(server):
+    # samples left over from a previous run would be added to the new totals
+    shutil.rmtree(multiproc_dir, ignore_errors=True)
+    os.makedirs(multiproc_dir, exist_ok=True)
+
+
+def child_exit(server, worker):
+    try:
+        from prometheus_client import multiprocess
+    except ImportError:
+        return
+
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,166 @@
+"""Prometheus metrics for the annotation API
+
+Exposes request latency histograms and counts per route, database pool
+checkouts, answers recorded and the number of tasks left to annotate on
+/metrics. Off unless METRICS_ENABLED is set, and needs the optional
+prometheus_client package, without it the endpoint is not registered. Set
+METRICS_TOKEN to only answer scrapes that send it as a bearer token.
+
+Under gunicorn set PROMETHEUS_MULTIPROC_DIR to an empty directory that all the
+workers can write to (cdcrapp/web/gunicorn_conf.py takes care of this) so that
+every worker's samples are added up whichever worker answers the scrape.
+"""
+
+import hmac
+import os
+import threading
+import time
+
+from flask import Flask, Response, abort, g, request
+from sqlalchemy import event, exists, func, select
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import scoped_session
+
+try:
+    import prometheus_client
+    from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, multiprocess
+    from prometheus_client.core import GaugeMetricFamily
+except ImportError:
+    prometheus_client = None
+
+from cdcrapp.model import Task, UserTask
+
+
+# latency buckets in seconds, fine grained around the task endpoint's usual response times
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.15, 0.2, 0.3, 0.5, 0.75, 1.0, 2.5, 5.0, 10.0)
+
+if prometheus_client is not None:
+    REQUEST_LATENCY = Histogram("cdcr_http_request_duration_seconds", "Time spent handling API requests",
+        ["method", "route"], buckets=LATENCY_BUCKETS)
+    REQUESTS = Counter("cdcr_http_requests_total", "API requests handled", ["method", "route", "status"])
+    CONDITIONAL_REQUESTS = Counter("cdcr_http_conditional_requests_total",
+        "Requests revalidating a cached copy, result is hit when a 304 was returned", ["route", "result"])
+    POOL_CHECKOUTS = Counter("cdcr_db_pool_checkouts_total", "Connections checked out of the database pool")
+    POOL_CHECKED_OUT = Gauge("cdcr_db_pool_checked_out", "Connections currently checked out of the database pool",
+        multiprocess_mode="livesum")
+    ANSWERS = Counter("cdcr_answers_recorded_total", "Answers committed to the database")
+
+
+class TaskQueueCollector(object):
+    """Counts the tasks still waiting for an answer when metrics are scraped
+
+    The counts scan the tasks table so they are reused for cache_seconds
+    rather than recounted on every scrape.
+    """
+
+    def __init__(self, engine: Engine, cache_seconds: float = 30):
+        self.engine = engine
+        self.cache_seconds = cache_seconds
+        self._counts = None
+        self._counted_at = None
+        self._lock = threading.Lock()
+
+    def counts(self) -> tuple:
+        """Number of (unanswered, unanswered IAA priority) tasks, counted at most once every cache_seconds"""
+
+        with self._lock:
+            if self._counted_at is None or time.monotonic() - self._counted_at >= self.cache_seconds:
+                answered = exists().where(UserTask.task_id==Task.id)
+                not_bad = Task.is_bad.isnot(True)
+
+                with self.engine.connect() as conn:
+                    unanswered = conn.execute(select([func.count(Task.id)]).where(not_bad & ~answered)).scalar()
+                    priority = conn.execute(select([func.count(Task.id)])
+                        .where(not_bad & (Task.is_iaa_priority==True) & ~answered)).scalar()
+
+                self._counts = (unanswered, priority)
+                self._counted_at = time.monotonic()
+
+            return self._counts
+
+    def collect(self):
+        unanswered, priority = self.counts()
+
+        queue = GaugeMetricFamily("cdcr_task_queue_depth", "Tasks that have not been answered yet", labels=["queue"])
+        queue.add_metric(["unanswered"], unanswered)
+        queue.add_metric(["iaa_priority"], priority)
+
+        yield queue
+
+
+def _route() -> str:
+    return request.url_rule.rule if request.url_rule is not None else "unmatched"
+
+
+def _start_timer():
+    g.metrics_start = time.perf_counter()
+
+
+def _record_request(response):
+    route = _route()
+
+    if "metrics_start" in g:
+        REQUEST_LATENCY.labels(request.method, route).observe(time.perf_counter() - g.metrics_start)
+
+    REQUESTS.labels(request.method, route, str(response.status_code)).inc()
+
+    if request.if_none_match or request.if_modified_since:
+        CONDITIONAL_REQUESTS.labels(route, "hit" if response.status_code == 304 else "miss").inc()
+
+    return response
+
+
+def _count_new_answers(session, flush_context):
+    session.info["new_answers"] = session.info.get("new_answers", 0) \
+        + sum(1 for obj in session.new if isinstance(obj, UserTask))
+
+
+def _commit_answers(session):
+    ANSWERS.inc(session.info.pop("new_answers", 0))
+
+
+def _discard_answers(session):
+    session.info.pop("new_answers", None)
+
+
+def metrics_registry(engine: Engine, queue_cache_seconds: float = 30) -> "CollectorRegistry":
+    """Registry to expose, adding up all gunicorn workers when running in multiprocess mode"""
+
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR") or os.getenv("prometheus_multiproc_dir"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = CollectorRegistry()
+        registry.register(prometheus_client.REGISTRY)
+
+    registry.register(TaskQueueCollector(engine, cache_seconds=queue_cache_seconds))
+
+    return registry
+
+
+def init_metrics(app: Flask, engine: Engine, db_session: scoped_session):
+    """Record metrics for the app and serve them on /metrics if prometheus_client is installed"""
+
+    if prometheus_client is None or not app.config.get("METRICS_ENABLED", False):
+        return
+
+    app.before_request(_start_timer)
+    app.after_request(_record_request)
+
+    event.listen(engine, "checkout", lambda *args: (POOL_CHECKOUTS.inc(), POOL_CHECKED_OUT.inc()))
+    event.listen(engine, "checkin", lambda *args: POOL_CHECKED_OUT.dec())
+
+    event.listen(db_session, "after_flush", _count_new_answers)
+    event.listen(db_session, "after_commit", _commit_answers)
+    event.listen(db_session, "after_rollback", _discard_answers)
+
+    registry = metrics_registry(engine, app.config.get("METRICS_QUEUE_CACHE_SECONDS", 30))
+    token = app.config.get("METRICS_TOKEN")
+
+    def metrics():
+        if token and not hmac.compare_digest(request.headers.get("Authorization", "").encode(), f"Bearer {token}".encode()):
+            abort(401)
+
+        return Response(prometheus_client.generate_latest(registry), mimetype=prometheus_client.CONTENT_TYPE_LATEST)
+
+    app.add_url_rule("/metrics", "metrics", metrics)
@@ -0,0 +1,173 @@
+"""Opt in per request SQL profiling for the API
+
+Set SQL_PROFILING=true to record, for every request, how many statements were
+run, the total time spent in the database, the slowest statement and the time
+spent marshalling and encoding the response. The figures are sent back in a
+Server-Timing header and logged as one JSON line per request on the
+cdcrapp.web.profiling logger. SQL that runs SQL_PROFILING_REPEAT_THRESHOLD or
+more times within one request (usually a lazy load in a loop) is flagged as a
+possible N+1 query.
+"""
+
+import json
+import logging
+import time
+
+from collections import Counter
+from contextlib import contextmanager
+from typing import List, Optional, Tuple
+
+from flask import Flask, g, has_request_context, request
+from flask.wrappers import Response
+from flask_restful import Api
+from flask_restful.representations.json import output_json
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+# longest statement text written to the logs
+MAX_STATEMENT_LENGTH = 500
+
+
+class RequestProfile(object):
+    """Statement and serialisation timings collected during one request"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.statements = 0
+        self.db_time = 0.0
+        self.slowest_time = 0.0
+        self.slowest_statement = None
+        self.serialize_time = 0.0
+        self.statement_counts = Counter()
+        self._serialize_depth = 0
+
+    def record_statement(self, statement: str, duration: float):
+        self.statements += 1
+        self.db_time += duration
+        self.statement_counts[statement] += 1
+
+        if duration > self.slowest_time:
+            self.slowest_time = duration
+            self.slowest_statement = statement
+
+    def repeated_statements(self, threshold: int) -> List[Tuple[str, int]]:
+        """Statements run at least threshold times, most frequent first"""
+        return [(statement, count) for statement, count in self.statement_counts.most_common() if count >= threshold]
+
+
+def current_profile() -> Optional[RequestProfile]:
+    """Profile of the request being handled, None outside requests or when profiling is off"""
+
+    if not has_request_context():
+        return None
+
+    return g.get("sql_profile")
+
+
+@contextmanager
+def timed_serialization():
+    """Count the time spent inside the block towards the request's serialisation time"""
+
+    profile = current_profile()
+
+    if profile is None:
+        yield
+        return
+
+    # nested blocks (e.g. marshalling inside encoding) are only counted once
+    profile._serialize_depth += 1
+    start = time.perf_counter()
+
+    try:
+        yield
+    finally:
+        profile._serialize_depth -= 1
+
+        if profile._serialize_depth == 0:
+            profile.serialize_time += time.perf_counter() - start
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if current_profile() is not None:
+        conn.info.setdefault("profile_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profile = current_profile()
+    starts = conn.info.get("profile_start")
+
+    if profile is not None and starts:
+        profile.record_statement(statement, time.perf_counter() - starts.pop())
+
+
+def _start_profile():
+    g.sql_profile = RequestProfile()
+
+
+def _finish_profile(response: Response) -> Response:
+    from flask import current_app
+
+    profile = current_profile()
+
+    if profile is None:
+        return response
+
+    total = time.perf_counter() - profile.started
+    repeated = profile.repeated_statements(current_app.config.get("SQL_PROFILING_REPEAT_THRESHOLD", 5))
+
+    timings = [
+        f'db;dur={profile.db_time * 1000:.2f};desc="{profile.statements} statements"',
+        f'db-slowest;dur={profile.slowest_time * 1000:.2f}',
+        f'serialize;dur={profile.serialize_time * 1000:.2f}',
+        f'total;dur={total * 1000:.2f}',
+    ]
+
+    if len(repeated) > 0:
+        timings.append(f'n-plus-one;desc="{len(repeated)} repeated statements"')
+
+    response.headers.add("Server-Timing", ", ".join(timings))
+
+    record = {
+        "method": request.method,
+        "path": request.path,
+        "endpoint": request.endpoint,
+        "status": response.status_code,
+        "statements": profile.statements,
+        "db_ms": round(profile.db_time * 1000, 2),
+        "slowest_ms": round(profile.slowest_time * 1000, 2),
+        "slowest_statement": (profile.slowest_statement or "")[:MAX_STATEMENT_LENGTH],
+        "serialize_ms": round(profile.serialize_time * 1000, 2),
+        "total_ms": round(total * 1000, 2),
+        "repeated_statements": [{"statement": statement[:MAX_STATEMENT_LENGTH], "count": count}
+            for statement, count in repeated],
+    }
+
+    logger.log(logging.WARNING if len(repeated) > 0 else logging.INFO, json.dumps(record))
+
+    return response
+
+
+def init_profiling(app: Flask, engine: Engine, api: Api):
+    """Hook the profiler into the engine and the app's request cycle if SQL_PROFILING is set"""
+
+    if not app.config.get("SQL_PROFILING"):
+        return
+
+    if logger.level == logging.NOTSET:
+        logger.setLevel(logging.INFO)
+
+    if not logger.handlers:
+        logger.addHandler(logging.StreamHandler())
+
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+    app.before_request(_start_profile)
+    app.after_request(_finish_profile)
+
+    @api.representation("application/json")
+    def output_json_timed(data, code, headers=None):
+        with timed_serialization():
+            return output_json(data, code, headers)
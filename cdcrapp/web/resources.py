@@ -4,16 +4,25 @@ import numpy as np
 from datetime import datetime
 
 from collections import defaultdict
-from sqlalchemy import update
+from functools import lru_cache
+from sqlalchemy import update, or_, and_, func
+from sqlalchemy.orm import contains_eager
 
-from flask import current_app
-from flask_restful import Resource, fields, marshal, reqparse
+from flask import current_app, request, jsonify
+from flask_restful import Resource, fields, marshal, reqparse, inputs
 from flask_security import auth_required, current_user
 
-from cdcrapp.services import FlaskTaskService
-from cdcrapp.model import Task, UserTask, NewsArticle, SciPaper
+from cdcrapp.services import FlaskTaskService, task_load_options
+from cdcrapp.model import Task, UserTask, NewsArticle, SciPaper, Mention, content_hash
 from cdcrapp.web import db_session
+from cdcrapp.web.responses import make_etag, latest, not_modified, conditional, json_response
+from cdcrapp.web.serializers import Serializer
 
+
+def refresh_doc_coverage(*news_article_ids: int):
+    """Keep the news_coverage summary of given articles up to date if it is enabled"""
+    if current_app.config.get("DOC_COVERAGE_SUMMARY"):
+        FlaskTaskService(engine=None).refresh_doc_coverage(list(news_article_ids))
         
 
 
@@ -36,13 +45,36 @@ class TaskResource(Resource):
         "is_bad_reported_at": fields.DateTime,
         "news_article_id": fields.Integer,
         "sci_paper_id": fields.Integer,
+        "news_article_hash": fields.String(attribute="newsarticle.content_hash"),
+        "sci_paper_hash": fields.String(attribute="scipaper.content_hash"),
         "news_url": fields.String,
-        "news_text": fields.String,
         "sci_url":fields.String,
-        "sci_text":fields.String,
         "priority": fields.Integer
     }
 
+    # document bodies are served by DocumentResource unless explicitly requested
+    document_fields = {
+        "news_text": fields.String,
+        "sci_text":fields.String,
+    }
+
+    # extra fields only sent for the task the user is looking at
+    detail_fields = {
+        'sci_ents': fields.List(fields.String),
+        'news_ents': fields.List(fields.String),
+        "related_answers": fields.Raw
+    }
+
+    answer_fields = {
+        'current_user_answer': fields.Nested({
+            'task_id': fields.Integer,
+            'answer': fields.String,
+            'created_at': fields.DateTime
+        })
+    }
+
+    serializer = Serializer(task_fields)
+
     @auth_required('token')
     def get(self):
 
@@ -52,11 +84,15 @@ class TaskResource(Resource):
         parser.add_argument('science_id', type=int, required=False)
         parser.add_argument('news_ent',type=str,required=False)
         parser.add_argument('sci_ent',type=str,required=False)
+        parser.add_argument('include_documents', type=inputs.boolean, required=False, default=False)
 
         args = parser.parse_args()
 
+        # document bodies are only needed when they are sent inline
+        profile = "with_docs" if args.include_documents else "with_doc_info"
+
         if args.hash is not None:
-            t = db_session.query(Task).filter(Task.hash==args.hash).one_or_none()
+            t = db_session.query(Task).options(*task_load_options(profile)).filter(Task.hash==args.hash).one_or_none()
 
             if not t:
                 return {"error":f"No task exists with hash={args.hash}"}, 404
@@ -81,10 +117,9 @@ class TaskResource(Resource):
 
 
             print(args)
-            t = db_session.query(Task).filter(Task.news_article_id==args.news_id, 
-                Task.sci_paper_id==args.science_id, 
-                Task.news_ent==args.news_ent, 
-                Task.sci_ent==args.sci_ent).one_or_none()
+            t = db_session.query(Task).options(*task_load_options(profile))\
+                .filter(Task.mention_filter("news", args.news_id, args.news_ent), 
+                Task.mention_filter("sci", args.science_id, args.sci_ent)).one_or_none()
 
             if not t:
                 return {"error":"cannot find a task with that combination of entities and articles."},404
@@ -95,24 +130,44 @@ class TaskResource(Resource):
             # get user's current next task
             tasksvc = FlaskTaskService(engine=None)
 
-            t = tasksvc.next_tasks_for_user(current_user)
+            t = tasksvc.next_tasks_for_user(current_user, profile=profile)
 
-        tfields = dict(**self.task_fields)
-        
-        tfields.update({ 
-            'sci_ents': fields.List(fields.String),
-            'news_ents': fields.List(fields.String),
-            "related_answers": fields.Raw
-        })
+        etag, last_modified = self.validators(t, args.include_documents)
+        cached = not_modified(etag, last_modified)
+
+        if cached is not None:
+            return cached
+
+        with_answer = t.current_user_answer != None and t.current_user_answer.task_id != 0
 
-        if t.current_user_answer != None and t.current_user_answer.task_id != 0:
-            tfields['current_user_answer'] = fields.Nested({
-                'task_id': fields.Integer,
-                'answer': fields.String,
-                'created_at': fields.DateTime
-            })
+        serializer = task_serializer(bool(args.include_documents), with_answer)
         
-        return marshal(t,  tfields)
+        return conditional(serializer(t), etag, last_modified)
+
+    def validators(self, t: Task, include_documents: bool) -> tuple:
+        """Work out the ETag and last modified time of a task as seen by the current user
+
+        The task payload includes the entity lists of both documents and the
+        user's answers for the document pair, so all of those are taken into account.
+        """
+
+        doc_tasks = db_session.query(func.count(Task.id), func.max(Task.updated_at))\
+            .filter(or_(Task.news_article_id==t.news_article_id, Task.sci_paper_id==t.sci_paper_id)).one()
+
+        # renaming an entity only touches its mention row
+        doc_mentions = db_session.query(func.count(Mention.id), func.max(Mention.updated_at))\
+            .filter(or_(Mention.news_article_id==t.news_article_id, Mention.sci_paper_id==t.sci_paper_id)).one()
+
+        answers = db_session.query(func.count(UserTask.task_id), func.max(UserTask.updated_at), func.max(UserTask.created_at))\
+            .join(UserTask.task)\
+            .filter(UserTask.user_id==current_user.id, 
+                Task.news_article_id==t.news_article_id, 
+                Task.sci_paper_id==t.sci_paper_id).one()
+
+        etag = make_etag(current_user.id, t.id, t.updated_at, tuple(doc_tasks), tuple(doc_mentions), tuple(answers),
+            t.newsarticle.content_hash, t.scipaper.content_hash, include_documents)
+
+        return etag, latest(t.updated_at, doc_tasks[1], doc_mentions[1], answers[1], answers[2])
 
     @auth_required('token')
     def post(self):
@@ -128,31 +183,37 @@ class TaskResource(Resource):
 
         t = db_session.query(Task).filter(Task.id==args.task_id).one_or_none()
 
+        # articles whose total task count changes with the bad tasks
+        news_article_ids = set()
+
         if not t:
             return {"error":f"No such task with id={args.task_id}"}, 404
         else:
             
             if args.is_bad is not None:
                 t.is_bad = args.is_bad
+                news_article_ids.add(t.news_article_id)
+
                 if args.is_bad:
                     t.is_bad_reason = args.is_bad_reason
                     t.is_bad_user_id = current_user.id
                     t.is_bad_reported_at = datetime.utcnow()
 
                     if t.is_bad_reason == "bad sci ent":
-                        # update all tasks with same sci ent
-                        db_session.query(Task)\
-                          .filter(Task.sci_ent==t.sci_ent, Task.sci_paper_id==t.sci_paper_id)\
-                          .update({"is_bad":True, "is_bad_reason": t.is_bad_reason})
+                        # update all tasks with same sci ent, the paper may be paired with several articles
+                        same_ent = db_session.query(Task).filter(Task.mention_filter("sci", t.sci_paper_id, t.sci_ent))
+                        news_article_ids.update(id for (id,) in same_ent.with_entities(Task.news_article_id.distinct()))
+
+                        same_ent.update({"is_bad":True, "is_bad_reason": t.is_bad_reason}, synchronize_session=False)
 
                     elif t.is_bad_reason == "bad news ent":
                         #update all tasks with same news ent
                         db_session.query(Task)\
-                          .filter(Task.news_ent==t.news_ent, Task.news_article_id==t.news_article_id)\
+                          .filter(Task.mention_filter("news", t.news_article_id, t.news_ent))\
                           .update({"is_bad":True, 
                               "is_bad_reason": t.is_bad_reason, 
                               "is_bad_reported_at": t.is_bad_reported_at,
-                              "is_bad_user_id": t.is_bad_user_id })
+                              "is_bad_user_id": t.is_bad_user_id }, synchronize_session=False)
                 else:
                     t.is_bad_reason = None
                     t.is_bad_user_id = None
@@ -174,7 +235,29 @@ class TaskResource(Resource):
         db_session.add(t)
         db_session.commit()
 
-        return marshal(t, self.task_fields)
+        news_article_ids.discard(None)
+
+        if len(news_article_ids) > 0:
+            refresh_doc_coverage(*news_article_ids)
+
+        return self.serializer(t)
+
+
+@lru_cache(maxsize=None)
+def task_serializer(include_documents: bool, with_answer: bool) -> Serializer:
+    """Get the precompiled serializer for one of the shapes of TaskResource.get response"""
+
+    tfields = dict(**TaskResource.task_fields)
+
+    if include_documents:
+        tfields.update(TaskResource.document_fields)
+
+    tfields.update(TaskResource.detail_fields)
+
+    if with_answer:
+        tfields.update(TaskResource.answer_fields)
+
+    return Serializer(tfields)
 
 
 
@@ -186,13 +269,13 @@ class AnswerListResource(Resource):
         "user_id": fields.Integer
     }
 
+    serializer = Serializer(ut_fields)
+
     @auth_required('token')
     def get(self, task_id):
         task = db_session.query(Task).filter(Task.id==task_id).join(UserTask).one()
 
-        answers = [marshal(ans, self.ut_fields) for ans in task.usertasks]
-
-        return answers
+        return json_response(self.serializer.many(task.usertasks))
 
 
     @auth_required('token')
@@ -212,7 +295,7 @@ class AnswerListResource(Resource):
         db_session.add(ans)
         db_session.commit()
 
-        return marshal(ans, self.ut_fields), 200
+        return self.serializer(ans), 200
 
     @auth_required('token')
     def post(self, task_id):
@@ -236,7 +319,9 @@ class AnswerListResource(Resource):
         
         db_session.commit()
 
-        return marshal(ut, self.ut_fields), 201
+        refresh_doc_coverage(task.news_article_id)
+
+        return self.serializer(ut), 201
 
 class SingletonAnswerResource(Resource):
     """Provide endpoint for submitting singleton updates for one entity"""
@@ -252,11 +337,11 @@ class SingletonAnswerResource(Resource):
 
         if(args.news_ent is None):
             # science singleton
-            tasks = db_session.query(Task).filter(Task.sci_paper_id==args.sci_paper_id, Task.sci_ent==args.sci_ent).all()
+            tasks = db_session.query(Task).filter(Task.mention_filter("sci", args.sci_paper_id, args.sci_ent)).all()
 
         elif(args.sci_ent is None):
             # news singleton
-            tasks = db_session.query(Task).filter(Task.news_article_id ==args.news_article_id, Task.news_ent==args.news_ent).all()
+            tasks = db_session.query(Task).filter(Task.mention_filter("news", args.news_article_id, args.news_ent)).all()
         else:
             return {"message":"Either news_ent or sci_ent must be null"}, 400
 
@@ -275,6 +360,8 @@ class SingletonAnswerResource(Resource):
         
         db_session.commit()
 
+        refresh_doc_coverage(args.news_article_id)
+
 
 class BatchAnswerResource(Resource):
     """Provide an endpoint for updating multiple answers relating to the same news/science doc combo"""
@@ -317,7 +404,7 @@ class BatchAnswerResource(Resource):
 
                     for ut in t.usertasks:
                         if ut.user_id == current_user.id:
-                            ut.answer = answer['answer'],
+                            ut.answer = answer['answer']
                             existing_answer = True
                             print(f"Update existing answer (news_ent={t.news_ent}, sci_ent={t.sci_ent}, answer={answer['answer']})")
                             dbanswers.append(ut)
@@ -331,6 +418,8 @@ class BatchAnswerResource(Resource):
 
         db_session.commit()
 
+        refresh_doc_coverage(args.news_article_id)
+
         return {"answers":[marshal(ut, ut_fields) for ut in dbanswers]}
         
 
@@ -343,21 +432,27 @@ class EntityResource(Resource):
         """Get entities for doc type"""
 
         if doc_type == "news":
-            base_query = Task.query.filter(Task.news_article_id==doc_id)
-
+            doc_filter = Task.news_article_id==doc_id
         elif doc_type == "science":
-            base_query = Task.query.filter(Task.sci_paper_id==doc_id)
+            doc_filter = Task.sci_paper_id==doc_id
         else:
             return {"error":"Type of document must be 'news' or 'science"}, 404
 
-        tasks = base_query.all()
+        tasks = db_session.query(func.count(Task.id), func.max(Task.updated_at)).filter(doc_filter).one()
+        mentions = db_session.query(func.count(Mention.id), func.max(Mention.updated_at))\
+            .filter(Mention.doc_column(doc_type)==doc_id).one()
 
-        if doc_type == "news":
-            entities = set([task.news_ent for task in tasks])
-        else:
-            entities = set([task.sci_ent for task in tasks])
+        etag = make_etag(doc_type, doc_id, tuple(tasks), tuple(mentions))
+        last_modified = latest(tasks[1], mentions[1])
+
+        cached = not_modified(etag, last_modified)
+
+        if cached is not None:
+            return cached
+
+        entities = Mention.document_entities(db_session, doc_type, doc_id)
         
-        return {"entities":list(entities)}
+        return conditional({"entities":entities}, etag, last_modified)
 
 
     def patch(self, doc_type, doc_id):
@@ -367,19 +462,34 @@ class EntityResource(Resource):
         parser.add_argument('newEntity', type=str, required=True)
         args = parser.parse_args()
 
-        base_query = Task.query
-
-        if(doc_type == "news"):
-            base_query = base_query.filter(Task.news_article_id==doc_id, Task.news_ent==args.oldEntity)
-        elif(doc_type == "science"):
-            base_query = base_query.filter(Task.sci_paper_id==doc_id, Task.sci_ent==args.oldEntity)
-        else:
+        if doc_type not in ("news", "science"):
             return {"error":"Type of document must be 'news' or 'science"}, 400
 
-        if doc_type == "news":
-            affected = base_query.update({Task.news_ent:args.newEntity})
-        else:
-            affected = base_query.update({Task.sci_ent:args.newEntity})
+        mention_column = Task.mention_columns(doc_type)["mention_id"]
+        affected = 0
+
+        # a document has at most one mention with a given entity string
+        mention = db_session.query(Mention)\
+            .filter(Mention.doc_column(doc_type)==doc_id, Mention.ent==args.oldEntity).one_or_none()
+
+        if mention is not None:
+            affected += db_session.query(Task).filter(mention_column==mention.id).count()
+
+            existing = db_session.query(Mention)\
+                .filter(Mention.doc_column(doc_type)==doc_id, Mention.ent==args.newEntity, Mention.id!=mention.id).one_or_none()
+
+            if existing is None:
+                mention.ent = args.newEntity
+            else:
+                # renaming onto an entity that already exists merges the two mentions
+                db_session.query(Task).filter(mention_column==mention.id)\
+                    .update({mention_column: existing.id}, synchronize_session=False)
+                db_session.delete(mention)
+
+        # tasks not linked to a mention yet still store it themselves, bulk updates bypass
+        # the ORM listeners so the structured columns are set explicitly
+        affected += Task.query.filter(Task.legacy_mention_filter(doc_type, doc_id, args.oldEntity))\
+            .update(Task.mention_values(doc_type, args.newEntity), synchronize_session=False)
 
         db_session.commit()
 
@@ -392,6 +502,37 @@ ut_fields = {
     'created_at': fields.DateTime
 }
 
+# task fields that can only be served by loading the related news article and sci paper
+DOCUMENT_FIELDS = {"news_url", "news_text", "news_article_hash", "sci_url", "sci_text", "sci_paper_hash"}
+
+CURSOR_DATE_FORMAT = "%Y-%m-%dT%H:%M:%S.%f"
+
+def encode_cursor(ut: UserTask) -> str:
+    """Generate an opaque keyset cursor pointing at given user task"""
+    created_at = ut.created_at.strftime(CURSOR_DATE_FORMAT) if ut.created_at else ""
+    return f"{created_at}_{ut.task_id}"
+
+def decode_cursor(cursor: str) -> tuple:
+    """Turn a cursor back into a (created_at, task_id) tuple"""
+    created_at, task_id = cursor.rsplit("_", 1)
+    created_at = datetime.strptime(created_at, CURSOR_DATE_FORMAT) if created_at else None
+    return created_at, int(task_id)
+
+@lru_cache(maxsize=64)
+def history_serializer(task_field_names: tuple = None) -> Serializer:
+    """Get a precompiled serializer for history rows containing the given task fields"""
+
+    if task_field_names is None:
+        task_fields = TaskResource.task_fields
+    else:
+        all_fields = dict(**TaskResource.task_fields, **TaskResource.document_fields)
+        task_fields = {f: all_fields[f] for f in task_field_names}
+
+    row_fields = dict(**ut_fields)
+    row_fields['task'] = fields.Nested(task_fields)
+
+    return Serializer(row_fields)
+
 class UserTaskListResource(Resource):
 
     @auth_required('token')
@@ -400,19 +541,143 @@ class UserTaskListResource(Resource):
         ap = reqparse.RequestParser()
         ap.add_argument("offset", required=False, type=int, default=0)
         ap.add_argument("limit", required=False, type=int, default=200)
+        ap.add_argument("cursor", required=False, type=str)
+        ap.add_argument("fields", required=False, type=str)
+        ap.add_argument("count", required=False, type=str, choices=['exact', 'approx', 'none'])
 
         args = ap.parse_args()
 
-        user_tasks = UserTask.query.join(Task.usertasks)\
-            .filter(UserTask.user==current_user)\
-            .order_by(UserTask.created_at.desc())
+        if args.fields:
+            all_fields = dict(**TaskResource.task_fields, **TaskResource.document_fields)
+            task_field_names = [f.strip() for f in args.fields.split(",") if f.strip() != ""]
+            unknown = [f for f in task_field_names if f not in all_fields]
+
+            if len(unknown) > 0:
+                return {"error": f"Unknown task fields: {','.join(unknown)}"}, 400
+
+            serializer = history_serializer(tuple(task_field_names))
+        else:
+            serializer = history_serializer()
+
+        task_fields = serializer.field_dict['task'].nested
+
+        # newest first, task_id breaks ties so that the ordering is stable for keyset pagination
+        user_tasks = db_session.query(UserTask).join(UserTask.task)\
+            .filter(UserTask.user_id==current_user.id)\
+            .order_by(UserTask.created_at.desc().nullslast(), UserTask.task_id.desc())
+
+        if DOCUMENT_FIELDS.intersection(task_fields):
+            user_tasks = user_tasks.options(contains_eager(UserTask.task).joinedload(Task.newsarticle),
+                contains_eager(UserTask.task).joinedload(Task.scipaper))
+        else:
+            user_tasks = user_tasks.options(contains_eager(UserTask.task).lazyload(Task.newsarticle),
+                contains_eager(UserTask.task).lazyload(Task.scipaper))
+
+        tasksvc = FlaskTaskService(engine=None)
+        count_q = db_session.query(UserTask).filter(UserTask.user_id==current_user.id)
+
+        # any new, changed or removed answer changes the history so validate against all of them,
+        # along with the answered tasks themselves (e.g. reported as bad) and their entities (e.g. renamed)
+        history = db_session.query(func.count(UserTask.task_id), func.max(UserTask.updated_at), func.max(UserTask.created_at),
+            func.max(Task.updated_at)).join(UserTask.task).filter(UserTask.user_id==current_user.id).one()
+
+        answered = db_session.query(UserTask.task_id).filter(UserTask.user_id==current_user.id)
+        mention_ids = db_session.query(Task.news_mention_id).filter(Task.id.in_(answered))\
+            .union(db_session.query(Task.sci_mention_id).filter(Task.id.in_(answered)))
+        mentions = db_session.query(func.count(Mention.id), func.max(Mention.updated_at))\
+            .filter(Mention.id.in_(mention_ids)).one()
+
+        etag = make_etag(current_user.id, tuple(history), tuple(mentions), request.query_string)
+        last_modified = latest(history[1], history[2], history[3], mentions[1])
+
+        cached = not_modified(etag, last_modified)
+
+        if cached is not None:
+            return cached
+
+        # cursor requests default to no total, offset requests to an exact one for backwards compatibility
+        total_mode = args.count or ('none' if args.cursor is not None else 'exact')
+
+        if total_mode == 'exact':
+            total = count_q.count()
+        elif total_mode == 'approx':
+            total = tasksvc.estimate_count(count_q)
+        else:
+            total = None
 
-        total = user_tasks.count()
+        if args.cursor is not None:
+            try:
+                created_at, task_id = decode_cursor(args.cursor)
+            except ValueError:
+                return {"error": f"Invalid cursor {args.cursor}"}, 400
 
-        uts = [marshal(ut, ut_fields) for ut in user_tasks.offset(args.offset).limit(args.limit).all()]
-    
+            if created_at is None:
+                user_tasks = user_tasks.filter(UserTask.created_at == None, UserTask.task_id < task_id)
+            else:
+                user_tasks = user_tasks.filter(or_(
+                    UserTask.created_at < created_at,
+                    and_(UserTask.created_at == created_at, UserTask.task_id < task_id),
+                    UserTask.created_at == None))
+        else:
+            user_tasks = user_tasks.offset(args.offset)
+
+        rows = user_tasks.limit(args.limit).all()
+
+        uts = serializer.many(rows)
+
+        next_cursor = encode_cursor(rows[-1]) if len(rows) == args.limit else None
+
+        return conditional({"total":total, "offset":args.offset, "limit": args.limit, "cursor": args.cursor, 
+            "next_cursor": next_cursor, "tasks":uts}, etag, last_modified)
+
+# documents are requested with ?v=<content_hash> so a matching response never goes stale
+DOCUMENT_MAX_AGE = int(os.getenv("DOCUMENT_MAX_AGE", 365 * 24 * 3600))
+
+class DocumentResource(Resource):
+    """Serve news and science document content separately from tasks so that browsers can cache it"""
+
+    news_fields = {
+        "id": fields.Integer,
+        "url": fields.String,
+        "text": fields.String(attribute="summary"),
+        "content_hash": fields.String
+    }
+
+    sci_fields = {
+        "id": fields.Integer,
+        "url": fields.String,
+        "text": fields.String(attribute="abstract"),
+        "content_hash": fields.String
+    }
+
+    @auth_required('token')
+    def get(self, doc_type, doc_id):
+
+        if doc_type == "news":
+            doc = db_session.query(NewsArticle).get(doc_id)
+            doc_fields = self.news_fields
+            text = doc.summary if doc else None
+        elif doc_type == "science":
+            doc = db_session.query(SciPaper).get(doc_id)
+            doc_fields = self.sci_fields
+            text = doc.abstract if doc else None
+        else:
+            return {"error":"Type of document must be 'news' or 'science"}, 404
+
+        if doc is None:
+            return {"error":f"No {doc_type} document with id={doc_id}"}, 404
+
+        etag = doc.content_hash or content_hash(text)
+
+        response = jsonify(marshal(doc, doc_fields))
+        response.set_etag(etag)
+
+        if request.args.get("v") == etag:
+            response.headers["Cache-Control"] = f"private, max-age={DOCUMENT_MAX_AGE}, immutable"
+        else:
+            response.headers["Cache-Control"] = "private, no-cache"
 
-        return {"total":total, "offset":args.offset, "limit": args.limit, "tasks":uts}
+        return response.make_conditional(request)
 
 class UserResource(Resource):
 
@@ -0,0 +1,123 @@
+"""Helpers for conditional GET support and response compression"""
+
+import gzip
+import hashlib
+
+from datetime import datetime, timezone
+from typing import Optional
+
+from flask import current_app, request
+from flask.wrappers import Response
+
+from cdcrapp.web.serializers import dumps
+from cdcrapp.web.profiling import timed_serialization
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# clients may keep a copy of API responses but must check that it is still current before using it
+REVALIDATE = "private, no-cache"
+
+COMPRESSIBLE_MIMETYPES = {"application/json", "text/html", "text/css", "text/plain", "application/javascript"}
+
+
+def make_etag(*parts) -> str:
+    """Generate an ETag from the values that a response depends on"""
+    return hashlib.sha1(repr(parts).encode("utf8")).hexdigest()
+
+
+def latest(*timestamps) -> Optional[datetime]:
+    """Return the most recent of a set of (possibly null) timestamps"""
+    return max([ts for ts in timestamps if ts is not None], default=None)
+
+
+def is_fresh(etag: str, last_modified: Optional[datetime] = None) -> bool:
+    """Check whether the client already has the current representation of a resource"""
+
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+
+    since = request.if_modified_since
+
+    if last_modified is not None and since is not None:
+        if since.tzinfo is not None:
+            last_modified = last_modified.replace(tzinfo=timezone.utc)
+
+        return last_modified.replace(microsecond=0) <= since
+
+    return False
+
+
+def not_modified(etag: str, last_modified: Optional[datetime] = None) -> Optional[Response]:
+    """Return a 304 response if the client's copy is current, otherwise None"""
+
+    if not is_fresh(etag, last_modified):
+        return None
+
+    response = current_app.response_class(status=304)
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = REVALIDATE
+
+    if last_modified is not None:
+        response.last_modified = last_modified
+
+    return response
+
+
+def json_response(payload, status: int = 200) -> Response:
+    """Generate a JSON response using the fast encoder"""
+
+    with timed_serialization():
+        data = dumps(payload)
+
+    return current_app.response_class(data, status=status, mimetype="application/json")
+
+
+def conditional(payload, etag: str, last_modified: Optional[datetime] = None) -> Response:
+    """Generate a JSON response carrying validators for future conditional requests"""
+
+    response = json_response(payload)
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = REVALIDATE
+
+    if last_modified is not None:
+        response.last_modified = last_modified
+
+    return response.make_conditional(request)
+
+
+def compress_response(response: Response) -> Response:
+    """after_request hook that brotli or gzip encodes responses for clients that accept it"""
+
+    if (response.direct_passthrough 
+        or response.status_code < 200 
+        or response.status_code >= 300
+        or "Content-Encoding" in response.headers
+        or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+
+    response.vary.add("Accept-Encoding")
+
+    data = response.get_data()
+
+    if len(data) < current_app.config.get("COMPRESS_MIN_SIZE", 500):
+        return response
+
+    encodings = ["br", "gzip"] if brotli is not None else ["gzip"]
+    encoding = request.accept_encodings.best_match(encodings)
+    level = current_app.config.get("COMPRESS_LEVEL", 6)
+
+    if encoding == "br":
+        data = brotli.compress(data, quality=min(level, 11))
+    elif encoding == "gzip":
+        data = gzip.compress(data, compresslevel=level)
+    else:
+        return response
+
+    response.set_data(data)
+    response.headers["Content-Encoding"] = encoding
+
+    return response
@@ -13,6 +13,7 @@ const apiRoot = (window.location.host == "localhost:3000") ? "http://localhost:5
      userTasks: `${apiRoot}/api/v1/user/tasks`,
      entities: `${apiRoot}/api/v1/entities`,
      answers: `${apiRoot}/api/v1/answers`,
+     documents: `${apiRoot}/api/v1/documents`,
  };
 
  export default Endpoints;
\ No newline at end of file
@@ -14,6 +14,34 @@ const setTaskError = (error) => ({type: "SET_TASK_ERROR", error});
 
 const setTaskListNavigation = (navigation) => ({type: "SET_TASKLIST_NAVIGATION", navigation});
 
+/**
+ * Documents are shared by most consecutive tasks so keep the last few in memory.
+ * Requests include the content hash so the browser cache can also serve them.
+ */
+const documentCache = new Map();
+const DOCUMENT_CACHE_SIZE = 10;
+
+const fetchDocument = async (docType, docID, contentHash, state) => {
+    const key = `${docType}_${docID}`;
+    const cached = documentCache.get(key);
+
+    if (cached && cached.content_hash === contentHash) {
+        return cached;
+    }
+
+    const response = await Axios.get(`${ApiEndpoints.documents}/${docType}/${docID}`, 
+        {params: {v: contentHash}, headers: addAuthHeaders(state)});
+
+    documentCache.delete(key);
+    documentCache.set(key, response.data);
+
+    if (documentCache.size > DOCUMENT_CACHE_SIZE) {
+        documentCache.delete(documentCache.keys().next().value);
+    }
+
+    return response.data;
+};
+
 const reportBadTask = (task, reason) => {
     return async(dispatch, getState) => {
         dispatch(setSendingAnswer(true));
@@ -218,8 +246,14 @@ const fetchTask = (hash, news_id, science_id, news_ent, sci_ent)=> {
         try{
             const response = await Axios.get(ApiEndpoints.task, {params:params, headers:addAuthHeaders(getState())} );
 
+            const task = response.data;
+
+            const [newsDoc, sciDoc] = await Promise.all([
+                fetchDocument("news", task.news_article_id, task.news_article_hash, getState()),
+                fetchDocument("science", task.sci_paper_id, task.sci_paper_hash, getState())
+            ]);
 
-            dispatch(setCurrentTask(response.data));
+            dispatch(setCurrentTask({...task, news_text: newsDoc.text, sci_text: sciDoc.text}));
 
         }catch(error) {
 
@@ -249,7 +283,8 @@ const fetchUserTaskList = () => {
         dispatch(setFetchingTaskList(true));
 
         try{
-            const params = getState().task.currentTaskListNavigation;
+            // the history view doesn't need document bodies so only ask for the task fields it shows
+            const params = {...getState().task.currentTaskListNavigation, fields: "id,hash,news_ent,sci_ent"};
             let response = await Axios.get(ApiEndpoints.userTasks, {params:params, headers:addAuthHeaders(getState())});
 
             
@@ -9,15 +9,13 @@ import csv
 import pandas as pd
 import torch
 
-from transformers import RobertaModel, RobertaTokenizerFast
-from html import unescape
-
 from tqdm.auto import tqdm
 from dotenv import load_dotenv
 from sqlalchemy import create_engine
 from sqlalchemy.orm import subqueryload
 from cdcrapp.services import UserService, TaskService
 from cdcrapp.model import Task, NewsArticle, SciPaper, UserTask
+from cdcrapp.models import get_model, ROBERTA_MODEL, ROBERTA_TOKENIZER
 
 # %%
 
@@ -62,7 +60,7 @@ rows = []
 with _usersvc.session() as session:
 
     print("Selecting tasks...")
-    tasks = session.query(Task)\
+    tasks = _tasksvc.query_tasks(session, "with_docs")\
         .filter(Task.news_article_id.in_(news_docs) | Task.sci_paper_id.in_(sci_docs))\
         .filter(Task.id.in_(session.query(sqlalchemy.distinct(UserTask.task_id))))\
         .options(subqueryload(Task.usertasks))\
@@ -70,7 +68,8 @@ with _usersvc.session() as session:
 
     with open("data/processed/cdcr_task_dump.csv",'w') as f:
 
-        csvw = csv.DictWriter(f, fieldnames=['id','hash','news_text','sci_text','news_ent','sci_ent','bert_similarity','answer'])
+        csvw = csv.DictWriter(f, fieldnames=['id','hash','news_text','sci_text','news_ent','sci_ent',
+            'news_ent_start','news_ent_end','sci_ent_start','sci_ent_end','bert_similarity','answer'])
 
         csvw.writeheader()
 
@@ -82,6 +81,10 @@ with _usersvc.session() as session:
                 "sci_text": task.sci_text,
                 "news_ent": task.news_ent,
                 "sci_ent": task.sci_ent,
+                "news_ent_start": task.news_ent_start,
+                "news_ent_end": task.news_ent_end,
+                "sci_ent_start": task.sci_ent_start,
+                "sci_ent_end": task.sci_ent_end,
                 "bert_similarity": task.similarity,
                 "answer": task.get_best_answer()
             })
@@ -101,10 +104,8 @@ df.dropna(subset=['bert_similarity'],inplace=True)
 
 #%%
 
-device = torch.device('cuda:0')
-
-model = RobertaModel.from_pretrained("roberta-large").to(device)
-tokenizer = RobertaTokenizerFast.from_pretrained("roberta-large")
+model = get_model(ROBERTA_MODEL)
+tokenizer = get_model(ROBERTA_TOKENIZER)
 
 #%%
 def get_tokens_by_offset(start:int,end:int, model_inputs: dict, second_doc=False, sep_char='[SEP]'):
@@ -164,13 +165,12 @@ for line in tqdm(range(len(df))):
     model_input = input_cache[task_hash]
 
     try:
-        news_offset = unescape(df.iloc[line].news_ent).split(";")[1:]
-        news_start = int(news_offset[0])
-        news_end = int(news_offset[1])
+        # offsets of malformed mentions are empty and come through as NaN which int() rejects
+        news_start = int(df.iloc[line].news_ent_start)
+        news_end = int(df.iloc[line].news_ent_end)
 
-        sci_offset = unescape(df.iloc[line].sci_ent).split(";")[1:]
-        sci_start = int(sci_offset[0])# + len(df.iloc[line].summary)
-        sci_end = int(sci_offset[1])#+ len(df.iloc[line].summary)
+        sci_start = int(df.iloc[line].sci_ent_start)# + len(df.iloc[line].summary)
+        sci_end = int(df.iloc[line].sci_ent_end)#+ len(df.iloc[line].summary)
 
         news_tokens,news_text = zip(*get_tokens_by_offset(news_start,news_end, model_input,False,sep_char=tokenizer.sep_token ))
         sci_tokens, sci_text= zip(*get_tokens_by_offset(sci_start,sci_end, model_input,True,sep_char=tokenizer.sep_token ))